@@ -0,0 +1,36 @@
+"""
+The API as run by benchmarks.load: main:app with WHOIS pointed at the local fake
+(EMAILFILTER_BENCH_WHOIS=host:port). DNS and SMTP are redirected with the regular
+EMAILFILTER_DNS_SERVERS / EMAILFILTER_SMTP_PORT settings.
+
+    EMAILFILTER_BENCH_WHOIS=127.0.0.1:10043 uvicorn benchmarks.bench_app:app
+"""
+import os
+import socket
+
+import whois
+from whois.parser import WhoisEntry
+
+WHOIS_SERVER = os.environ.get("EMAILFILTER_BENCH_WHOIS", "127.0.0.1:10043")
+WHOIS_TIMEOUT = 10
+
+
+def fake_whois(domain: str, *args, **kwargs):
+    """
+    Drop-in for whois.whois() that asks the fake server, the answer goes through the library's parser.
+    """
+    host, _, port = WHOIS_SERVER.rpartition(":")
+    with socket.create_connection((host, int(port)), timeout=WHOIS_TIMEOUT) as conn:
+        conn.sendall(f"{domain}\r\n".encode())
+        chunks = []
+        while chunk := conn.recv(4096):
+            chunks.append(chunk)
+    text = b"".join(chunks).decode()
+    if not text:
+        raise ConnectionError(f"no WHOIS answer for {domain}")
+    return WhoisEntry.load(domain, text)
+
+
+whois.whois = fake_whois
+
+from main import app  # noqa: E402
@@ -0,0 +1,60 @@
+"""
+Micro-benchmarks for the in-memory checks run on every request, against the lists in lists/.
+
+    python -m benchmarks.bench_checks [--emails 20000] [--repeat 5]
+"""
+import time
+import random
+import string
+import argparse
+
+from src.snapshot import get_snapshot
+from src.utils_async import check_domain_in_lists, contains_spam_keywords, check_gibberish, local_gibberish_probabilities
+
+
+def random_local(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_lowercase + string.digits + ".", k=rng.randint(4, 20)))
+
+
+def best_of(func, items, repeat: int) -> float:
+    """
+    Fastest of `repeat` runs over all items, in seconds per item.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - start)
+    return best / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    snapshot = get_snapshot()
+    listed = sorted(snapshot.blacklist | snapshot.whitelist) or ["example.com"]
+    # mostly unknown domains, some listed ones
+    domains = [rng.choice(listed) if rng.random() < 0.2 else f"{random_local(rng)}.com" for _ in range(args.emails)]
+    emails = [f"{random_local(rng)}@{domain}" for domain in domains]
+
+    benchmarks = (
+        ("check_domain_in_lists", lambda domain: check_domain_in_lists([domain], snapshot), domains),
+        ("check_domain_in_lists (batch of 1000)", lambda start: check_domain_in_lists(domains[start:start + 1000], snapshot), range(0, len(domains), 1000)),
+        ("contains_spam_keywords", lambda email: contains_spam_keywords(email, snapshot), emails),
+        ("check_gibberish", check_gibberish, emails),
+        ("local_gibberish_probabilities (batch of 1000)", lambda start: local_gibberish_probabilities(emails[start:start + 1000]), range(0, len(emails), 1000)),
+    )
+    print(f"{'check':<48} {'us/op':>10} {'ops/s':>12}")
+    for name, func, items in benchmarks:
+        per_op = best_of(func, items, args.repeat)
+        print(f"{name:<48} {per_op * 1e6:>10.2f} {1 / per_op:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares the trigram gibberish model with the old five-consonant regex: throughput of the regex, the
+model one local part at a time and the NumPy batch path, then how often each flags generated human
+and machine local parts, real-looking addresses whose names the model was never trained on
+(false positives) and a few examples. The threshold was chosen with HELD_OUT_ADDRESSES in view, so the
+false-positive rate on UNSEEN_ADDRESSES, whose name groups are in neither list, is the independent number.
+
+    python -m benchmarks.bench_gibberish [--batches 1,100,1000,10000] [--emails 50000]
+"""
+import re
+import sys
+import time
+import random
+import argparse
+
+from src.gibberish import (
+    GIBBERISH_THRESHOLD, NAMES, get_model, stdlib_words, natural_local_parts, gibberish_local_parts,
+)
+
+CONSONANT_RUN = re.compile(r"[bcdfghjklmnpqrstvwxyz]{5,}", re.IGNORECASE)
+
+# none of their names are in gibberish.NAMES, every one of them should pass - a regression gate,
+# names from the same groups were added to NAMES and the threshold was tuned against it
+HELD_OUT_ADDRESSES = (
+    "stefan.pejcic", "alexander.hamilton.87", "rosalind.fairbanks.1990", "milica.radosavljevic",
+    "bogdan.stankovic", "tijana.vukovic", "aleksandra.dimitrijevic", "zeljko.obradovic", "branislav.lazic",
+    "ljubomir.ristic", "jovana.zivkovic", "ana.bozic", "matej.kranjc", "vaclav.hrdlicka", "radek.stepanek",
+    "bartosz.szczygiel", "lukasz.grabczynski", "zbigniew.brzoska", "jolanta.chmielewska", "eoghan.mcgrath",
+    "saoirse.ronan", "bronwyn.pritchard", "gwenllian.ffrench", "thorsten.schwarzkopf", "friedrich.nietzsche",
+    "gottfried.leibniz", "hrvoje.horvatic", "mihaela.constantinescu", "ioana.popescu87", "razvan.dragomir",
+    "kaloyan.stoyanov", "tsvetelina.georgieva", "anastasiya.shcherbakova", "vsevolod.zhdanov",
+    "mstislav.rostropovich", "yevhen.kravchuk", "oleksandr.tkachenko", "dinh.quoc.bao", "vu.thi.hanh",
+    "xiaoyu.feng", "qingyun.shao", "zhiqiang.lyu", "rajesh.chandrasekhar", "priyanka.bhattacharya",
+    "thirunavukkarasu", "chidinma.okafor", "temitope.adeyemi", "abebe.bekele", "tshepo.mokoena",
+    "nkosazana.dlamini", "sigridur.thorsdottir", "hjalmar.bjornsson", "aino.kallio", "olavi.virtanen",
+    "pekka.jarvinen", "kristjan.tamm", "hamza.benali", "yousra.elmansouri", "ahmet.kucukoglu", "gokhan.ozkan",
+    "marcus.whitfield", "brittany.oconnell.92", "tyler.jameson2004", "kayleigh.fitzgerald", "jdoe", "mwhitaker",
+    "sjkim", "jrobertson_88", "info.sales", "noreply", "billing-team", "hr.recruitment", "webmaster",
+    "postmaster",
+)
+
+# name groups that are neither in NAMES nor in HELD_OUT_ADDRESSES (Georgian, Armenian, Basque, Polynesian, Indonesian,
+# Thai, Somali, Malagasy, Baltic, Albanian, Persian, Punjabi, Kazakh, Mongolian). Only measured, never used to tune
+# the model or GIBBERISH_THRESHOLD - once it has been, it is a second gate and a new untouched set is needed
+UNSEEN_ADDRESSES = (
+    "giorgi.beridze", "nino.kapanadze", "levan.tsiklauri", "tamar.gelashvili", "hovhannes.grigoryan",
+    "anahit.sargsyan", "tigran.petrosyan", "iker.etxeberria", "ainhoa.goikoetxea", "unai.arrizabalaga",
+    "keanu.kahananui", "leilani.kealoha", "aroha.ngata", "wiremu.tawhiri", "budi.santoso", "siti.rahayu",
+    "agus.setiawan", "somchai.wongsawat", "kanokwan.srisuk", "thanawat.chaiyaphum", "abdirahman.warsame",
+    "hodan.farah", "andriamanitra.rakotomalala", "voahangy.randrianarisoa", "vytautas.kazlauskas",
+    "ruta.jankauskiene", "janis.berzins", "ilze.kalnina", "arben.hoxha", "drita.krasniqi", "shirin.ghorbani",
+    "dariush.khosravi", "gurpreet.dhillon", "harjinder.sandhu", "aigerim.zhaksylykova", "nurlan.abenov",
+    "batbayar.ganbold", "oyunchimeg.tserendorj", "gkapanadze", "vkazlauskas84", "s.wongsawat", "ahoxha_1991",
+)
+
+EXAMPLES = (
+    "john.smith", "krzysztof", "mstrzelczyk", "przemyslaw.brzeczyszczykiewicz", "nguyen.van.anh",
+    "zhangwei", "siobhan.walsh", "jsmith1984", "info", "x7kq2zpw", "a3f9c2e1b7d4", "asdfghjk",
+)
+
+
+def timed(func, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        func(item)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", default="1,100,1000,10000", help="comma separated batch sizes")
+    parser.add_argument("--emails", type=int, default=50000, help="local parts scored per run")
+    parser.add_argument("--seed", type=int, default=7, help="differs from the training seed")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    words = stdlib_words()
+    natural = natural_local_parts(words, NAMES.split(), rng, args.emails // 2)
+    gibberish = gibberish_local_parts(words, rng, args.emails // 2)
+    local_parts = natural + gibberish
+    rng.shuffle(local_parts)
+    model = get_model()
+
+    # same answers from both model paths before timing anything
+    for local, probability in zip(local_parts[:1000], model.probabilities(local_parts[:1000])):
+        assert abs(model.probability(local) - probability) < 1e-6, local
+
+    regex_time = timed(CONSONANT_RUN.search, local_parts)
+    scalar_time = timed(model.probability, local_parts)
+    print(f"{'method':<24} {'us/op':>8} {'ops/s':>12}")
+    print(f"{'regex':<24} {regex_time / len(local_parts) * 1e6:>8.2f} {len(local_parts) / regex_time:>12.0f}")
+    print(f"{'model':<24} {scalar_time / len(local_parts) * 1e6:>8.2f} {len(local_parts) / scalar_time:>12.0f}")
+    for size in map(int, args.batches.split(",")):
+        batches = [local_parts[start:start + size] for start in range(0, len(local_parts), size)]
+        batch_time = timed(model.probabilities, batches)
+        name = f"model, batches of {size}"
+        print(f"{name:<24} {batch_time / len(local_parts) * 1e6:>8.2f} {len(local_parts) / batch_time:>12.0f}")
+
+    print()
+    print(f"{'flagged':<24} {'regex':>8} {'model':>8}")
+    for name, items in (("generated human", natural), ("generated machine", gibberish)):
+        regex_rate = sum(bool(CONSONANT_RUN.search(local)) for local in items) / len(items)
+        model_rate = sum(p >= GIBBERISH_THRESHOLD for p in model.probabilities(items)) / len(items)
+        print(f"{name:<24} {regex_rate:>8.1%} {model_rate:>8.1%}")
+
+    known = set(NAMES.split())
+    held_out_parts = {part for local in HELD_OUT_ADDRESSES for part in re.split(r"[._\-0-9]+", local) if part}
+    unseen_parts = {part for local in UNSEEN_ADDRESSES for part in re.split(r"[._\-0-9]+", local) if part}
+    assert not held_out_parts & known and not unseen_parts & (known | held_out_parts)
+    flagged = {}
+    for name, items in (("held-out real names", HELD_OUT_ADDRESSES), ("unseen name groups", UNSEEN_ADDRESSES)):
+        probabilities = model.probabilities(list(items))
+        flagged[name] = [(local, p) for local, p in zip(items, probabilities) if p >= GIBBERISH_THRESHOLD]
+        regex_flagged = sum(bool(CONSONANT_RUN.search(local)) for local in items)
+        print(f"{name:<24} {regex_flagged / len(items):>8.1%} {len(flagged[name]) / len(items):>8.1%}")
+        for local, p in flagged[name]:
+            print(f"  false positive: {local} ({p:.3f})")
+
+    print()
+    print(f"{'local part':<32} {'regex':>6} {'probability':>12}")
+    for local, probability in zip(EXAMPLES, model.probabilities(list(EXAMPLES))):
+        print(f"{local:<32} {'yes' if CONSONANT_RUN.search(local) else 'no':>6} {probability:>12.3f}")
+
+    if flagged["held-out real names"]:
+        sys.exit(f"{len(flagged['held-out real names'])} held-out real names flagged as gibberish at threshold {GIBBERISH_THRESHOLD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Local stand-ins for the DNS, SMTP and WHOIS servers the filter talks to, each with configurable
+latency and failure rate. Answers depend on the domain name so runs are reproducible:
+
+  nx-*        NXDOMAIN
+  nomx-*      exists, no MX and no address records
+  catchall-*  every RCPT is accepted (accept-all domain)
+  new-*       registered a few days ago
+  *           MX on one of the 127.0.0.x addresses the SMTP fake listens on, created years ago
+
+Local parts starting with "bad" are refused with 550.
+"""
+import random
+import asyncio
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+from aiosmtpd.smtp import SMTP
+
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+
+@dataclass
+class Behaviour:
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    fail_rate: float = 0.0
+
+    async def delay(self, rng: random.Random):
+        latency = self.latency_ms + rng.uniform(0, self.jitter_ms)
+        if latency:
+            await asyncio.sleep(latency / 1000)
+
+    def fails(self, rng: random.Random) -> bool:
+        return rng.random() < self.fail_rate
+
+
+def mx_address(domain: str, mx_hosts: int) -> str:
+    return f"127.0.0.{1 + zlib.crc32(domain.encode()) % mx_hosts}"
+
+
+# ---------------------- DNS ---------------------- #
+
+class FakeDNSProtocol(asyncio.DatagramProtocol):
+    """
+    Answers MX / A / AAAA queries over UDP. Failures are answered with SERVFAIL.
+    """
+
+    def __init__(self, behaviour: Behaviour, mx_hosts: int, ttl: int, seed: int):
+        self.behaviour = behaviour
+        self.mx_hosts = mx_hosts
+        self.ttl = ttl
+        self.rng = random.Random(seed)
+        self.transport = None
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr):
+        self.queries += 1
+        asyncio.ensure_future(self.answer(data, addr))
+
+    def build(self, query: dns.message.Message) -> dns.message.Message:
+        response = dns.message.make_response(query)
+        if self.behaviour.fails(self.rng):
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response
+        question = query.question[0]
+        name = question.name.to_text().rstrip(".").lower()
+        if name.startswith("nx-"):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif name.startswith("nomx-"):
+            pass
+        elif question.rdtype == dns.rdatatype.MX:
+            response.answer.append(dns.rrset.from_text(question.name, self.ttl, "IN", "MX", f"10 {mx_address(name, self.mx_hosts)}."))
+        elif question.rdtype == dns.rdatatype.A:
+            response.answer.append(dns.rrset.from_text(question.name, self.ttl, "IN", "A", "127.0.0.1"))
+        return response
+
+    async def answer(self, data: bytes, addr):
+        try:
+            query = dns.message.from_wire(data)
+        except Exception:
+            return
+        await self.behaviour.delay(self.rng)
+        self.transport.sendto(self.build(query).to_wire(), addr)
+
+
+async def start_dns(host: str, port: int, behaviour: Behaviour, mx_hosts: int = 8, ttl: int = 300, seed: int = 1):
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: FakeDNSProtocol(behaviour, mx_hosts, ttl, seed), local_addr=(host, port)
+    )
+    return transport, protocol
+
+
+# ---------------------- SMTP ---------------------- #
+
+class FakeMailbox:
+    """
+    aiosmtpd handler: RCPT answers by local part / domain, failures are answered with 451.
+    """
+
+    def __init__(self, behaviour: Behaviour, seed: int = 2):
+        self.behaviour = behaviour
+        self.rng = random.Random(seed)
+        self.rcpts = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.rcpts += 1
+        await self.behaviour.delay(self.rng)
+        if self.behaviour.fails(self.rng):
+            return "451 4.3.0 Try again later"
+        local, _, domain = address.lower().rpartition("@")
+        if not domain.startswith("catchall-") and (local.startswith("bad") or local.startswith("emailfilter-")):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+
+async def start_smtp(hosts: list, port: int, behaviour: Behaviour, seed: int = 2):
+    mailbox = FakeMailbox(behaviour, seed)
+    server = await asyncio.get_running_loop().create_server(
+        lambda: SMTP(mailbox, hostname="fake-mx.local"), host=hosts, port=port
+    )
+    return server, mailbox
+
+
+# ---------------------- WHOIS ---------------------- #
+
+class FakeWhois:
+    """
+    Port-43 style WHOIS: one domain per connection, answered with a registry-like record.
+    Failures close the connection without an answer.
+    """
+
+    def __init__(self, behaviour: Behaviour, seed: int = 3):
+        self.behaviour = behaviour
+        self.rng = random.Random(seed)
+        self.lookups = 0
+
+    @staticmethod
+    def record(domain: str) -> str:
+        days = 5 if domain.startswith("new-") else 3000 + zlib.crc32(domain.encode()) % 3000
+        created = datetime.now(timezone.utc) - timedelta(days=days)
+        return (
+            f"Domain Name: {domain.upper()}\r\n"
+            f"Registrar: Fake Registrar\r\n"
+            f"Creation Date: {created.strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+        )
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.lookups += 1
+        try:
+            domain = (await reader.readline()).decode().strip().lower()
+            await self.behaviour.delay(self.rng)
+            if not self.behaviour.fails(self.rng):
+                writer.write(self.record(domain).encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def start_whois(host: str, port: int, behaviour: Behaviour, seed: int = 3):
+    whois = FakeWhois(behaviour, seed)
+    server = await asyncio.start_server(whois.handle, host, port)
+    return server, whois
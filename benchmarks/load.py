@@ -0,0 +1,241 @@
+"""
+Load benchmark for /filter-email against local DNS, SMTP and WHOIS fakes (see benchmarks/fakes.py).
+Every worker count / concurrency combination gets a fresh server with empty caches and databases.
+
+    python -m benchmarks.load --workers 1,4 --concurrency 16,64 --requests 2000 \\
+        --dns-latency-ms 5 --smtp-latency-ms 30 --whois-latency-ms 300 --whois-fail-rate 0.05
+
+Reports throughput, p50/p95/p99 latency and the RSS of each worker, --json appends the results
+to a file so releases can be compared. The server runs with the regular SMTP per-host limits,
+raise them with e.g. --env EMAILFILTER_SMTP_RATE_PER_HOST=1000 to measure the code instead.
+"""
+import os
+import sys
+import json
+import time
+import random
+import string
+import asyncio
+import logging
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path as PathLib
+
+import httpx
+
+from benchmarks.fakes import Behaviour, start_dns, start_smtp, start_whois
+
+ROOT = PathLib(__file__).resolve().parent.parent
+
+# share of the generated domains by kind, see benchmarks/fakes.py for what each one does
+DOMAIN_MIX = (("bench-", 0.75), ("new-", 0.1), ("catchall-", 0.05), ("nomx-", 0.05), ("nx-", 0.05))
+
+
+def make_emails(count: int, domains: int, bad_rate: float, seed: int) -> list:
+    rng = random.Random(seed)
+    prefixes = [prefix for prefix, _ in DOMAIN_MIX]
+    weights = [weight for _, weight in DOMAIN_MIX]
+    pool = [f"{rng.choices(prefixes, weights)[0]}{i}.com" for i in range(domains)]
+    emails = []
+    for _ in range(count):
+        local = "".join(rng.choices(string.ascii_lowercase + string.digits, k=rng.randint(5, 12)))
+        if rng.random() < bad_rate:
+            local = "bad" + local
+        # a few hot domains get most of the traffic, like real signups
+        domain = pool[min(int(rng.paretovariate(1.2)) - 1, domains - 1)] if rng.random() < 0.7 else rng.choice(pool)
+        emails.append(f"{local}@{domain}")
+    return emails
+
+
+def worker_pids(master: int) -> list:
+    pids = []
+    for stat in PathLib("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master:
+            pids.append(int(stat.parent.name))
+    return pids or [master]
+
+
+def rss_mb(pid: int) -> float:
+    try:
+        for line in PathLib(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Server:
+    """
+    uvicorn running benchmarks.bench_app in a subprocess, with its state in a temporary directory.
+    """
+
+    def __init__(self, args, workers: int):
+        self.args = args
+        self.workers = workers
+        self.tmp = tempfile.TemporaryDirectory(prefix="emailfilter-bench-")
+        self.url = f"http://127.0.0.1:{args.port}"
+        self.process = None
+
+    def env(self) -> dict:
+        env = dict(os.environ)
+        env.update({
+            "EMAILFILTER_DNS_SERVERS": f"127.0.0.1:{self.args.dns_port}",
+            "EMAILFILTER_SMTP_PORT": str(self.args.smtp_port),
+            "EMAILFILTER_BENCH_WHOIS": f"127.0.0.1:{self.args.whois_port}",
+            "EMAILFILTER_DB_PATH": os.path.join(self.tmp.name, "reputation.db"),
+            "EMAILFILTER_CACHE_PATH": os.path.join(self.tmp.name, "cache.db"),
+            "EMAILFILTER_METRICS_DIR": os.path.join(self.tmp.name, "metrics"),
+        })
+        for item in self.args.env:
+            key, _, value = item.partition("=")
+            env[key] = value
+        return env
+
+    async def start(self):
+        log = open(os.path.join(self.tmp.name, "server.log"), "wb")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.bench_app:app", "--host", "127.0.0.1",
+             "--port", str(self.args.port), "--workers", str(self.workers), "--log-level", "warning"],
+            cwd=ROOT, env=self.env(), stdout=log, stderr=subprocess.STDOUT,
+        )
+        async with httpx.AsyncClient() as client:
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"server exited, see {log.name}")
+                try:
+                    if (await client.get(self.url + "/scores")).status_code == 200:
+                        # let every worker finish starting up
+                        await asyncio.sleep(0.5 * self.workers)
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("server did not start within 60s")
+
+    def memory(self) -> list:
+        return [rss_mb(pid) for pid in worker_pids(self.process.pid)]
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.tmp.cleanup()
+
+
+async def drive(url: str, emails: list, concurrency: int, query: str) -> dict:
+    latencies = []
+    statuses = {}
+    items = iter(emails)
+    target = f"{url}/filter-email" + (f"?{query}" if query else "")
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def user():
+            for email in items:
+                start = time.perf_counter()
+                try:
+                    status = (await client.post(target, json={"email": email})).status_code
+                except httpx.HTTPError:
+                    status = "error"
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+        "statuses": {str(key): value for key, value in statuses.items()},
+    }
+
+
+async def run(args):
+    dns_transport, dns = await start_dns("127.0.0.1", args.dns_port, Behaviour(args.dns_latency_ms, args.jitter_ms, args.dns_fail_rate), args.mx_hosts)
+    smtp_server, mailbox = await start_smtp([f"127.0.0.{i}" for i in range(1, args.mx_hosts + 1)], args.smtp_port, Behaviour(args.smtp_latency_ms, args.jitter_ms, args.smtp_fail_rate))
+    whois_server, whois = await start_whois("127.0.0.1", args.whois_port, Behaviour(args.whois_latency_ms, args.jitter_ms, args.whois_fail_rate))
+
+    emails = make_emails(args.requests, args.domains, args.bad_rate, args.seed)
+    warmup = make_emails(args.warmup, args.domains, args.bad_rate, args.seed + 1) if args.warmup else []
+    results = []
+    print(f"{'workers':>7} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS/worker MB':>14}  statuses")
+    try:
+        for workers in map(int, args.workers.split(",")):
+            for concurrency in map(int, args.concurrency.split(",")):
+                server = Server(args, workers)
+                try:
+                    await server.start()
+                    if warmup:
+                        await drive(server.url, warmup, concurrency, args.query)
+                    result = await drive(server.url, emails, concurrency, args.query)
+                    memory = server.memory()
+                finally:
+                    server.stop()
+                result.update({"workers": workers, "concurrency": concurrency, "rss_mb": [round(mb, 1) for mb in memory]})
+                results.append(result)
+                rss = f"{statistics.fmean(memory):.1f} (max {max(memory):.1f})"
+                print(f"{workers:>7} {concurrency:>5} {result['rps']:>8} {result['p50_ms']:>8} {result['p95_ms']:>8} {result['p99_ms']:>8} {rss:>14}  {result['statuses']}")
+    finally:
+        dns_transport.close()
+        smtp_server.close()
+        whois_server.close()
+
+    print(f"fakes served {dns.queries} DNS queries, {mailbox.rcpts} RCPTs, {whois.lookups} WHOIS lookups")
+    if args.json:
+        with open(args.json, "a") as f:
+            settings = {key: value for key, value in vars(args).items() if key != "json"}
+            f.write(json.dumps({"time": time.time(), "settings": settings, "results": results}) + "\n")
+
+
+def main():
+    for name in ("httpx", "mail.log"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1", help="comma separated uvicorn worker counts")
+    parser.add_argument("--concurrency", default="16,64", help="comma separated numbers of concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per run")
+    parser.add_argument("--warmup", type=int, default=0, help="requests sent before measuring (other addresses, same domains)")
+    parser.add_argument("--domains", type=int, default=500)
+    parser.add_argument("--bad-rate", type=float, default=0.1, help="share of addresses the SMTP fake refuses")
+    parser.add_argument("--query", default="", help="query string for /filter-email, e.g. full=true or deadline_ms=300")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random extra latency added by every fake")
+    for name, latency in (("dns", 2), ("smtp", 20), ("whois", 200)):
+        parser.add_argument(f"--{name}-latency-ms", type=float, default=latency)
+        parser.add_argument(f"--{name}-fail-rate", type=float, default=0.0)
+    parser.add_argument("--mx-hosts", type=int, default=8, help="MX hosts (127.0.0.x addresses) the domains are spread over")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--dns-port", type=int, default=10053)
+    parser.add_argument("--smtp-port", type=int, default=10025)
+    parser.add_argument("--whois-port", type=int, default=10043)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra environment for the server (repeatable)")
+    parser.add_argument("--json", help="append the results to this file as one JSON line")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,24 +24,67 @@
 # THE SOFTWARE.
 ################################################################################
 
+import os
 import json
-from fastapi import FastAPI, HTTPException, Query, Path, Body, Path
+from fastapi import FastAPI, HTTPException, Query, Path, Body, Path, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse, Response
 from fastapi.routing import APIRoute
-from src.models import EmailInput, FeedbackInput
+from pydantic import ValidationError
+from src.models import EmailInput, FeedbackInput, BulkListInput
 from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 from src.database import *
 
 import asyncio
-from src.constants import load_list, add_to_list, remove_from_list
+from contextlib import asynccontextmanager
+from src.constants import load_list, add_to_list, remove_from_list, apply_list_changes, compact_lists, empty_list, JOURNAL_COMPACT_INTERVAL, sorted_list, list_etag, list_page, BATCH_MAX_EMAILS, BATCH_SMTP_CONCURRENCY, BATCH_CONCURRENCY
 from src.logger_config import get_logger
 from pathlib import Path as PathLib
 
 from src.utils_async import *
+from src.snapshot import DEFAULT_SCORES, CONFIG_SCORES_PATH, get_snapshot, publish_change
+from src.mx_health import mx_health
+from src.admission import BULK, Overloaded, lanes, lane_for, admit, in_lane, release_when_done
+from src.pipeline import address_checks, domain_checks, complete_evaluation, evaluate_email, start_pipeline, close_pipeline, project
+from src.responses import EncodedResponse, NegotiatedRoute, BATCH_KEEP_FIELDS, response_format, batch_encoder, ndjson_line, parse_fields
+from src import metrics
+from src import warmup
 
 # ---------------------- STARTUP ---------------------- #
 logger = get_logger(__name__)
-init_db()
-app = FastAPI()
+
+async def compact_loop():
+    """Periodically folds list journals into the sorted list files."""
+    while True:
+        await asyncio.sleep(JOURNAL_COMPACT_INTERVAL)
+        try:
+            await asyncio.to_thread(compact_lists)
+        except Exception as e:
+            logger.error(f"List compaction failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # serving starts right away (/healthz), lists, indexes and caches are loaded in the background (/readyz)
+    await asyncio.to_thread(init_db)
+    start_pipeline()
+    metrics_task = asyncio.create_task(metrics.dump_loop())
+    compact_task = asyncio.create_task(compact_loop())
+    warmup_task = asyncio.create_task(warmup.warm_up())
+    yield
+    warmup_task.cancel()
+    compact_task.cancel()
+    metrics_task.cancel()
+    metrics.remove_worker_metrics()
+    await close_pipeline()
+
+app = FastAPI(lifespan=lifespan, default_response_class=EncodedResponse)
+# orjson responses, MessagePack for clients that send Accept: application/msgpack
+app.router.route_class = NegotiatedRoute
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    logger.warning(f"Shedding {request.url.path}: {exc}")
+    return JSONResponse(status_code=exc.status, content={"detail": f"Too busy, {exc}. Try again later."}, headers={"Retry-After": str(exc.retry_after)})
 
 # respect X-Forwarded-For and X-Forwarded-Proto headers
 app.add_middleware(ProxyHeadersMiddleware, trusted_hosts="*")
@@ -60,132 +103,192 @@ BANNER = r"""
 
 logger.debug("\n" + BANNER)
 
-DEFAULT_SCORES = {
-    "base": 50,
-    "mx_exists": 20,
-    "gibberish": -5,
-    "smtp_valid": 20,
-    "whitelisted": 10,
-    "new_domain": -10,
-    "disposable": -30,
-    "blacklisted": -40,
-    "spam_keywords": -20,
-}
-
-CONFIG_SCORES_PATH = PathLib("config/scores.json")
-
-def load_scores(config_path: PathLib = CONFIG_SCORES_PATH) -> dict:
-    if config_path.is_file():
-        try:
-            with config_path.open("r") as f:
-                user_scores = json.load(f)
-            merged = DEFAULT_SCORES.copy()
-            merged.update(user_scores)
-            logger.debug(f"Loaded custom scores from {config_path}")
-            return merged
-        except Exception as e:
-            logger.error(f"Failed to load scores config: {e}")
-    else:
-        logger.debug(f"No custom scores config found at {config_path}, using defaults.")
-    return DEFAULT_SCORES.copy()
-
-# on startup
-SCORES = load_scores()
 
-
-def invalidate_cache(list_name: str):
+async def read_batch_emails(request: Request) -> list:
     """
-    Remove a list from the cache to force reload on next access.
+    Reads addresses from a JSON array (or {"emails": [...]}) or an NDJSON upload.
+    Items can be plain strings or {"email": "..."} objects.
     """
-    global _cached_lists
-    if list_name in _cached_lists:
-        del _cached_lists[list_name]
-        logger.debug(f"Cache invalidated for {list_name}")
-
-
-
+    content_type = request.headers.get("content-type", "")
+    items = []
+
+    def add_item(item):
+        if isinstance(item, dict):
+            item = item.get("email")
+        if not isinstance(item, str):
+            raise HTTPException(status_code=400, detail="Batch items must be email strings or {\"email\": ...} objects.")
+        if len(items) >= BATCH_MAX_EMAILS:
+            raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_EMAILS} addresses.")
+        items.append(item)
 
+    try:
+        if "ndjson" in content_type or "jsonlines" in content_type:
+            buffer = b""
+            async for chunk in request.stream():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        add_item(json.loads(line))
+            if buffer.strip():
+                add_item(json.loads(buffer))
+        else:
+            payload = await request.json()
+            if isinstance(payload, dict):
+                payload = payload.get("emails")
+            if not isinstance(payload, list):
+                raise HTTPException(status_code=400, detail="Expected a JSON array of emails.")
+            for item in payload:
+                add_item(item)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON in batch body.")
+    return items
+
+
+async def batch_email_check(result: dict, domain_task: asyncio.Task, smtp_limit: asyncio.Semaphore, snapshot, full: bool = False) -> dict:
+    """
+    Completes an address_checks() result from a batch with the domain stage its domain shares.
+    The SMTP probe is skipped when it can't change the verdict, unless full is set.
+    """
+    try:
+        return await complete_evaluation(result, snapshot, full, domain_stage=await domain_task, smtp_slots=smtp_limit)
+    except Exception as e:
+        logger.error(f"Error processing batch item {result['email']}: {e}")
+        return {"email": result["email"], "error": "Internal server error"}
 
 
+async def stream_batch_results(emails: list, full: bool = False, lane=None, fields: tuple | None = None, encode=ndjson_line):
+    """
+    Groups addresses by domain and yields encoded results (NDJSON lines by default) as they finish, projected to
+    fields plus email and error. BATCH_CONCURRENCY workers take the addresses from a bounded queue in the given
+    admission lane, so large batches don't start a task per address up front.
+    """
+    lane = lane or lanes[BULK]
+    by_domain = {}
+    for raw in emails:
+        try:
+            email = EmailInput(email=raw).email
+        except ValidationError:
+            yield encode({"email": raw, "error": "Invalid email address."})
+            continue
+        domain = email.split("@")[1].lower()
+        by_domain.setdefault(domain, {})[email] = None  # dict keeps order and drops duplicates
+
+    total = sum(map(len, by_domain.values()))
+    logger.info(f"Checking batch of {total} addresses across {len(by_domain)} domains")
+    if not total:
+        return
+    snapshot = get_snapshot()
+    list_checks = check_domain_in_lists(list(by_domain), snapshot)
+    checked = [email for addresses in by_domain.values() for email in addresses]
+    gibberish = dict(zip(checked, local_gibberish_probabilities(checked)))
+    smtp_limit = asyncio.Semaphore(BATCH_SMTP_CONCURRENCY)
+    workers = min(BATCH_CONCURRENCY, total)
+    queue = asyncio.Queue(maxsize=workers * 2)
+    results = asyncio.Queue(maxsize=workers * 2)
+    # MX, WHOIS, reputation and the domain profile once per domain, shared by its addresses:
+    # domain -> [domain_checks() task, addresses still running], dropped after the domain's last address
+    domain_tasks = {}
+
+    async def produce():
+        # addresses of a domain are queued together, so only a few domains are in flight at once
+        for domain, addresses in by_domain.items():
+            for email in addresses:
+                await queue.put((email, domain))
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def work():
+        while (item := await queue.get()) is not None:
+            email, domain = item
+            entry = domain_tasks.get(domain)
+            if entry is None:
+                count = len(by_domain[domain])
+                entry = domain_tasks[domain] = [asyncio.create_task(domain_checks(domain, snapshot, full, count, lookups=True)), count]
+            result = await batch_email_check(
+                address_checks(email, domain, snapshot, gibberish[email], list_checks[domain]), entry[0], smtp_limit, snapshot, full,
+            )
+            entry[1] -= 1
+            if not entry[1]:
+                del domain_tasks[domain]
+            await results.put(result)
+
+    async def run():
+        try:
+            await asyncio.gather(produce(), *(in_lane(lane, work()) for _ in range(workers)))
+        finally:
+            await results.put(None)
 
+    runner = asyncio.create_task(run())
+    try:
+        while (result := await results.get()) is not None:
+            yield encode(project(result, fields, BATCH_KEEP_FIELDS))
+        await runner  # raises what stopped the workers
+    finally:
+        # client went away or generator closed early
+        runner.cancel()
+        for entry in list(domain_tasks.values()):
+            entry[0].cancel()
 
 
+DEADLINE_MAX_MS = 60000
 
 
 # ---------------------- API ENDPOINTS ---------------------- #
 # https://github.com/stefanpejcic/EmailFilter/blob/main/README.md#api-usage OR send GET to /
 
 @app.post("/filter-email")
-async def filter_email(data: EmailInput):
+async def filter_email(
+    data: EmailInput,
+    request: Request,
+    full: bool = Query(False, description="Run every check even when the verdict is already decided"),
+    deadline_ms: int | None = Query(None, ge=1, le=DEADLINE_MAX_MS, description="Answer within this many milliseconds with the checks finished so far"),
+    fields: str | None = Query(None, description="Comma separated result fields to return, e.g. verdict,score"),
+):
     """
     Checks an email against multiple rules (disposable, blacklisted, MX/SMTP, gibberish, spam keywords)
-    and returns a score and verdict.
+    and returns a score and verdict. Network checks that can't change the verdict are skipped and listed
+    in skipped_checks, use full=true to run all of them. With deadline_ms, checks still running when the
+    time is up are listed in pending_checks and finish in the background, filling the caches for the next request.
+    fields=verdict,score returns only those fields, Accept: application/msgpack returns MessagePack.
+    Runs in the interactive lane unless the API key or the X-EmailFilter-Lane header says otherwise,
+    a full lane answers 429 or 503 right away.
     """
+    fields = parse_fields(fields)
     email = data.email
     domain = email.split("@")[1].lower()
     logger.info(f"Checking address: {email}")
 
-    try:
-        check_in_list = check_domain_in_lists([domain])[domain]
-
-        # run 1 by 1
-        disposable = check_in_list["disposable"]
-        blacklisted = check_in_list["blacklisted"]
-        whitelisted = check_in_list["whitelisted"]
-        spam_keywords = contains_spam_keywords(email)
-        is_gibberish = check_gibberish(email)
-
-        # run all at once
-        check_mx_and_smtp = mx_and_smtp_check(email)
-        check_domain_whois = cached_domain_age(domain)
-        (mx_exists, mx_record, smtp_valid), (new_domain, domain_age_in_days) = await asyncio.gather(check_mx_and_smtp, check_domain_whois)
-
-        log_domain_check(domain) #todo: make optional for prod
-        rep_penalty = get_reputation_penalty(domain)
-
-        # Calculate score
-        score = SCORES["base"]
-        if is_gibberish:
-            score += SCORES["gibberish"]
-        if mx_exists:
-            score += SCORES["mx_exists"]
-        if smtp_valid:
-            score += SCORES["smtp_valid"]
-        if whitelisted:
-            score += SCORES["whitelisted"]
-        if new_domain:
-            score += SCORES["new_domain"]
-        if disposable:
-            score += SCORES["disposable"]
-        if blacklisted:
-            score += SCORES["blacklisted"]
-        if spam_keywords:
-            score += SCORES["spam_keywords"]
-        score += rep_penalty
-        score = max(0, min(100, score))
-        verdict = "accepted" if score >= 60 else "rejected"
-        logger.debug(f"Filter result for {email} - score: {score}, verdict: {verdict}")
+    async with admit(lane_for(request.headers)):
+        try:
+            with metrics.time_stage("request"):
+                result = await evaluate_email(email, domain, full, deadline_ms)
+            # encoded as is, the result is plain data and doesn't need FastAPI's jsonable_encoder pass
+            return EncodedResponse(project(result, fields))
+        except Exception as e:
+            logger.error(f"Error processing filter request for {email}: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error")
 
-        return {
-            "email": email,
-            "domain": domain,
-            "disposable": disposable,
-            "blacklisted": blacklisted,
-            "whitelisted": whitelisted,
-            "mx_exists": mx_exists,
-            "mx_records": mx_record,
-            "gibberish": is_gibberish,
-            "smtp_valid": smtp_valid,
-            "new_domain": new_domain,
-            "domain_age_in_days": domain_age_in_days,
-            "spam_keywords": spam_keywords,
-            "reputation_penalty": rep_penalty,
-            "score": score,
-            "verdict": verdict
-        }
-    except Exception as e:
-        logger.error(f"Error processing filter request for {email}: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/filter-email/batch")
+async def filter_email_batch(
+    request: Request,
+    full: bool = Query(False, description="Probe SMTP even when the verdict is already decided"),
+    fields: str | None = Query(None, description="Comma separated result fields to return, email and error are always included"),
+):
+    """
+    Checks many emails in one request. Accepts a JSON array (or {"emails": [...]}) or an NDJSON upload
+    (Content-Type: application/x-ndjson). MX, WHOIS, list and reputation lookups run once per distinct domain,
+    SMTP probes run with bounded concurrency (and only when they can change the verdict, unless full=true)
+    and results are streamed back as NDJSON (or a stream of MessagePack objects with Accept: application/msgpack)
+    as they finish. Runs in the bulk lane unless the API key or the X-EmailFilter-Lane header says otherwise.
+    """
+    fields = parse_fields(fields)
+    emails = await read_batch_emails(request)
+    encode, media_type = batch_encoder(response_format.get())
+    lane = lane_for(request.headers, BULK)
+    await lane.enter()
+    return StreamingResponse(release_when_done(lane, stream_batch_results(emails, full, lane, fields, encode)), media_type=media_type)
 
 
 @app.post("/feedback/spam")
@@ -195,7 +298,7 @@ async def report_spam(data: FeedbackInput):
     """  
     domain = data.email.split("@")[1].lower()
     logger.debug(f"Marking domain as spam: {domain}")
-    mark_domain_as_spam(domain)
+    await mark_domain_as_spam(domain)
     return {"message": f"Domain {domain} marked as spam. Thank you for reporting!"}
 
 
@@ -213,7 +316,7 @@ def add_whitelist(domain: str = Query(...)):
         logger.warning(f"Domain is blacklisted, cannot whitelist without removal: {domain}")
         raise HTTPException(status_code=400, detail="Domain is blacklisted. Remove it before adding to whitelist.")
     add_to_list("whitelist", domain)
-    invalidate_cache("whitelist")
+    publish_change()
     logger.debug(f"Domain added to whitelist: {domain}")
     return {"message": f"{domain} added to whitelist."}
 
@@ -229,7 +332,7 @@ def delete_whitelist(domain: str = Query(...)):
         logger.warning(f"Domain not found in whitelist: {domain}")
         raise HTTPException(status_code=404, detail="Domain not in whitelist.")
     remove_from_list("whitelist", domain)
-    invalidate_cache("whitelist")
+    publish_change()
     logger.debug(f"Domain removed from whitelist: {domain}")
     return {"message": f"{domain} removed from whitelist."}
 
@@ -248,7 +351,7 @@ def add_blacklist(domain: str = Query(...)):
         logger.warning(f"Domain is whitelisted, cannot blacklist without removal: {domain}")
         raise HTTPException(status_code=400, detail="Domain is whitelisted. Remove it before adding to blacklist.")
     add_to_list("blacklist", domain)
-    invalidate_cache("blacklist")
+    publish_change()
     logger.debug(f"Domain added to blacklist: {domain}")
     return {"message": f"{domain} added to blacklist."}
 
@@ -264,47 +367,127 @@ def delete_blacklist(domain: str = Query(...)):
         logger.warning(f"Domain not found in blacklist: {domain}")
         raise HTTPException(status_code=404, detail="Domain not in blacklist.")
     remove_from_list("blacklist", domain)
-    invalidate_cache("blacklist")
+    publish_change()
     logger.debug(f"Domain removed from blacklist: {domain}")
     return {"message": f"{domain} removed from blacklist."}
 
 
-@app.get("/lists/{list_name}")
-def get_list(list_name: str = Path(..., description="Name of the list to retrieve")):
-    """
-    Get domains from a specific list.
-    """  
+LIST_PAGE_MAX = 10000
+
+def check_list_name(list_name: str) -> str:
     list_name = list_name.lower()
-    logger.debug(f"Fetching list: {list_name}")
     if list_name not in LIST_FILES:
         logger.warning(f"Requested list not found: {list_name}")
         raise HTTPException(status_code=404, detail="List not found.")
+    return list_name
+
+
+@app.get("/lists/{list_name}")
+def get_list(
+    request: Request,
+    list_name: str = Path(..., description="Name of the list to retrieve"),
+    cursor: str | None = Query(None, description="Return items after this one (next_cursor of the previous page)"),
+    prefix: str | None = Query(None, description="Only items starting with this prefix"),
+    limit: int = Query(1000, ge=1, le=LIST_PAGE_MAX),
+    count_only: bool = Query(False, description="Only return the number of (matching) items"),
+):
+    """
+    Get one page of domains from a specific list, sorted. Follow next_cursor for the next page,
+    use /lists/{list_name}/export for the whole list. Supports ETag / If-None-Match.
+    """
+    list_name = check_list_name(list_name)
+    logger.debug(f"Fetching list: {list_name}")
     try:
-        items = sorted(load_list(list_name))
-        logger.debug(f"Loaded {len(items)} items from list {list_name}")
-        return {
-            "list": list_name,
-            "items": items
-        }
+        etag = list_etag(list_name)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        items, next_cursor, total = list_page(list_name, cursor, prefix, limit)
+        body = {"list": list_name, "count": total}
+        if not count_only:
+            body.update({"items": items, "next_cursor": next_cursor})
+        return EncodedResponse(body, headers={"ETag": etag})
     except Exception as e:
         logger.error(f"Failed to load list {list_name}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to load list: {str(e)}")
 
 
+@app.head("/lists/{list_name}")
+def head_list(list_name: str = Path(..., description="Name of the list")):
+    """
+    Item count (X-Total-Count) and ETag of a list without the items.
+    """
+    list_name = check_list_name(list_name)
+    return Response(headers={"ETag": list_etag(list_name), "X-Total-Count": str(len(sorted_list(list_name)))})
+
+
+@app.get("/lists/{list_name}/export")
+def export_list(
+    request: Request,
+    list_name: str = Path(..., description="Name of the list to export"),
+    format: str = Query("text", pattern="^(text|ndjson)$", description="text (one item per line) or ndjson"),
+):
+    """
+    Stream a whole list, as plain text or NDJSON, without building the response in memory.
+    """
+    list_name = check_list_name(list_name)
+    etag = list_etag(list_name)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    items = sorted_list(list_name)
+
+    def chunks(size: int = 1000):
+        for start in range(0, len(items), size):
+            if format == "ndjson":
+                yield b"".join(map(ndjson_line, items[start:start + size]))
+            else:
+                yield "".join(item + "\n" for item in items[start:start + size])
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/plain"
+    return StreamingResponse(chunks(), media_type=media_type, headers={"ETag": etag})
+
+
 @app.get("/lists")
-def get_all_lists():
+def get_all_lists(request: Request):
+    """
+    Get all available lists. Supports ETag / If-None-Match.
     """
-    Get all available lists.
-    """  
     logger.debug("Fetching all lists")
+    etag = '"' + "|".join(list_etag(name).strip('"') for name in LIST_FILES) + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
     result = {}
     for name in LIST_FILES:
         try:
-            result[name] = sorted(load_list(name))
+            result[name] = sorted_list(name)
         except Exception as e:
             logger.warning(f"Failed to load list {name}: {e}")
             continue
-    return result
+    return EncodedResponse(result, headers={"ETag": etag})
+
+
+@app.post("/lists/{list_name}/bulk")
+def bulk_update_list(list_name: str = Path(..., description="Name of the list to change"), data: BulkListInput = Body(...)):
+    """
+    Add and remove many domains in one call, committed atomically as a single journal record.
+    Adding to whitelist/blacklist is rejected if any of the domains is on the opposite list.
+    """
+    list_name = check_list_name(list_name)
+    add = [item.strip().lower() for item in data.add if item.strip()]
+    remove = [item.strip().lower() for item in data.remove if item.strip()]
+    if len(add) + len(remove) > BATCH_MAX_EMAILS:
+        raise HTTPException(status_code=413, detail=f"Bulk changes are limited to {BATCH_MAX_EMAILS} items.")
+    if list_name in ("whitelist", "blacklist") and add:
+        opposite = "blacklist" if list_name == "whitelist" else "whitelist"
+        conflicts = sorted(set(add) & load_list(opposite))
+        if conflicts:
+            raise HTTPException(status_code=400, detail={"message": f"Remove these domains from {opposite} first.", "domains": conflicts[:100]})
+    logger.debug(f"Bulk update of {list_name}: {len(add)} to add, {len(remove)} to remove")
+    added, removed = apply_list_changes(list_name, add=add, remove=remove)
+    if added or removed:
+        publish_change()
+        if list_name == "disposable":
+            DISPOSABLE_INDEX.refresh(force=True)
+    return {"list": list_name, "added": added, "removed": removed}
 
 
 @app.delete("/lists/{list_name}")
@@ -312,15 +495,15 @@ def clear_list(list_name: str):
     """
     Delete all domains from a list.
     """  
+    list_name = check_list_name(list_name)
     logger.debug(f"Clearing list: {list_name}")
-    if list_name not in LIST_FILES:
-        logger.warning(f"List not found for clearing: {list_name}")
-        raise HTTPException(status_code=404, detail="List not found.")
-    _loaded_sets[list_name] = set()
-    save_list(list_name)
-    invalidate_cache(list_name)
-    logger.debug(f"List cleared: {list_name}")
-    return {"message": f"{list_name} cleared."}
+    removed = empty_list(list_name)
+    if removed:
+        publish_change()
+        if list_name == "disposable":
+            DISPOSABLE_INDEX.refresh(force=True)
+    logger.debug(f"List cleared: {list_name} ({removed} items)")
+    return {"message": f"{list_name} cleared.", "removed": removed}
 
 
 
@@ -329,13 +512,13 @@ def get_scores():
     """
     Get the current scoring weights.
     """
-    return {"scores": SCORES, "note": "To update scores POST new values to /scores and restart the application."}
+    return {"scores": dict(get_snapshot().scores), "note": "To update scores POST new values to /scores, changes apply to all workers without a restart."}
 
 
 @app.post("/scores")
 def update_scores(new_scores: dict = Body(..., example=DEFAULT_SCORES)):
     """
-    Update the scoring weights - app restart is required to apply changes.
+    Update the scoring weights - applied by all workers within a second, no restart required.
     """
     try:
         for key in new_scores.keys():
@@ -345,13 +528,16 @@ def update_scores(new_scores: dict = Body(..., example=DEFAULT_SCORES)):
         CONFIG_SCORES_PATH.parent.mkdir(parents=True, exist_ok=True)
         with CONFIG_SCORES_PATH.open("w") as f:
             json.dump(new_scores, f, indent=4)
+        publish_change()
 
-        logger.debug(f"User updated scores saved to {CONFIG_SCORES_PATH}. App restart required to apply changes.")
+        logger.debug(f"User updated scores saved to {CONFIG_SCORES_PATH} and published to all workers.")
 
         return {
-            "message": "Scores updated successfully. Please restart the application to apply changes.",
+            "message": "Scores updated successfully.",
             "new_scores": new_scores,
         }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to update scores: {e}")
         raise HTTPException(status_code=500, detail="Failed to update scores.")
@@ -359,17 +545,18 @@ def update_scores(new_scores: dict = Body(..., example=DEFAULT_SCORES)):
 @app.post("/scores/default")
 def restore_default_scores():
     """
-    Restore the scoring weights to the default values - app restart is required to apply changes.
+    Restore the scoring weights to the default values - applied by all workers, no restart required.
     """
     try:
         CONFIG_SCORES_PATH.parent.mkdir(parents=True, exist_ok=True)
         with CONFIG_SCORES_PATH.open("w") as f:
             json.dump(DEFAULT_SCORES, f, indent=4)
+        publish_change()
 
-        logger.debug(f"Scores restored to default and saved to {CONFIG_SCORES_PATH}. App restart required to apply changes.")
+        logger.debug(f"Scores restored to default and saved to {CONFIG_SCORES_PATH}.")
 
         return {
-            "message": "Scores restored to default. Please restart the application to apply changes.",
+            "message": "Scores restored to default.",
             "default_scores": DEFAULT_SCORES,
         }
     except Exception as e:
@@ -380,6 +567,53 @@ def restore_default_scores():
 
 # ---------------------- OPTIONAL ENDPOINTS ---------------------- #
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus metrics for all workers: per-stage latency, cache hits and misses, verdicts and open SMTP sessions.
+    """
+    return metrics.render_metrics()
+
+
+@app.get("/healthz")
+def healthz():
+    """
+    Liveness: the worker is up and serving requests.
+    """
+    return {"status": "ok", "worker": os.getpid()}
+
+
+@app.get("/readyz")
+def readyz():
+    """
+    Readiness: 200 once this worker has loaded the lists and indexes (and prewarmed the most checked
+    domains, with EMAILFILTER_PREWARM_DOMAINS), 503 while it is still warming up.
+    """
+    body = {"status": "ready" if warmup.state["ready"] else "warming up", "worker": os.getpid(), **warmup.state}
+    return EncodedResponse(status_code=200 if warmup.state["ready"] else 503, content=body)
+
+
+@app.get("/mx-health")
+def get_mx_health(state: str | None = Query(None, description="Only circuits in this state: closed, open or half_open")):
+    """
+    SMTP probe health of this worker: connect and RCPT outcomes, average latency and circuit state
+    per MX host and per provider. Hosts with an open circuit are not probed, their addresses get smtp_unknown.
+    """
+    health = mx_health.state()
+    if state is not None:
+        health = {kind: {name: info for name, info in circuits.items() if info["state"] == state} for kind, circuits in health.items()}
+    return {"worker": os.getpid(), **health}
+
+
+@app.delete("/mx-health")
+def reset_mx_health(host: str | None = Query(None, description="MX host to forget, all hosts if omitted")):
+    """
+    Closes the circuits of a host and its provider (or all of them) in this worker, e.g. after outbound port 25 was unblocked.
+    """
+    mx_health.reset(host)
+    return {"message": f"MX health reset for {host or 'all hosts'}.", "worker": os.getpid()}
+
+
 @app.get("/")
 def root():
     """
@@ -1,5 +1,7 @@
 #!/bin/bash
 # https://github.com/stefanpejcic/EmailFilter/blob/main/README.md#-exim-incoming-email-filtering
+# For high volume use the policy daemon instead (python -m src.policy_daemon --line ...) and
+# query it from Exim with ${readsocket{...}{$sender_address\n}}, see scripts/README.md
 
 EMAIL="$1"
 
@@ -8,19 +10,15 @@ RESPONSE=$(curl -s -X POST "http://localhost:8000/filter-email" \
   -H "Content-Type: application/json" \
   -d "{\"email\": \"$EMAIL\"}")
 
-# Parse JSON fields (requires jq)
+# Parse the verdict (jq if available)
 if command -v jq > /dev/null; then
-    VALID=$(echo "$RESPONSE" | jq -r '.valid_syntax and .domain_exists and .mx_records_found and (.is_blacklisted | not)')
+    VERDICT=$(echo "$RESPONSE" | jq -r '.verdict')
 else
     # fallback: basic grep
-    echo "$RESPONSE" | grep -q '"valid_syntax": true' &&
-    echo "$RESPONSE" | grep -q '"domain_exists": true' &&
-    echo "$RESPONSE" | grep -q '"mx_records_found": true' &&
-    ! echo "$RESPONSE" | grep -q '"is_blacklisted": true'
-    VALID=$?
+    VERDICT=$(echo "$RESPONSE" | grep -o '"verdict": *"[a-z]*"' | grep -o '[a-z]*"$' | tr -d '"')
 fi
 
-if [ "$VALID" == "true" ] || [ "$VALID" == "0" ]; then
+if [ "$VERDICT" == "accepted" ]; then
     echo "$EMAIL"
 else
     exit 1
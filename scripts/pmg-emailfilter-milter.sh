@@ -1,19 +1,31 @@
 #!/bin/bash
 # Simple milter script for PMG to verify sender email addresses with emailfilter
 # https://github.com/stefanpejcic/EmailFilter/blob/main/README.md#-proxmox-mail-gateway-incoming-email-filtering
+#
+# With EMAILFILTER_DAEMON=host:port the addresses are sent over one persistent connection to the
+# policy daemon's line listener (python -m src.policy_daemon --line host:port) instead of curl.
+
+if [[ -n "$EMAILFILTER_DAEMON" ]]; then
+    exec 3<>"/dev/tcp/${EMAILFILTER_DAEMON%:*}/${EMAILFILTER_DAEMON##*:}" || exit 1
+fi
 
 while read line; do
     # Parse the SMTP 'MAIL FROM' command to extract the sender email
     if [[ "$line" =~ ^MAIL\ FROM:\<(.*)\> ]]; then
         sender="${BASH_REMATCH[1]}"
-        # Query emailfilter
-        response=$(curl -s -X POST "http://localhost:8000/filter-email" \
-            -H "Content-Type: application/json" \
-            -d "{\"email\":\"$sender\"}")
-        # Extract verification status from response (assuming JSON with "valid": true/false)
-        valid=$(echo "$response" | grep -Po '(?<="valid":)[^,}]*')
+        if [[ -n "$EMAILFILTER_DAEMON" ]]; then
+            # reply is "<verdict> <score>"
+            echo "$sender" >&3
+            read -r verdict score <&3
+        else
+            # Query emailfilter
+            response=$(curl -s -X POST "http://localhost:8000/filter-email" \
+                -H "Content-Type: application/json" \
+                -d "{\"email\":\"$sender\"}")
+            verdict=$(echo "$response" | grep -Po '(?<="verdict":")[a-z]*')
+        fi
 
-        if [[ "$valid" != "true" ]]; then
+        if [[ "$verdict" == "rejected" ]]; then
             # Reject sender if invalid
             echo "550 5.7.1 Sender address rejected by emailfilter"
             exit 1
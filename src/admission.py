@@ -0,0 +1,213 @@
+"""
+Admission control: requests are put in a priority lane (interactive signup forms, bulk imports)
+chosen by API key or header. Every lane has its own limit of requests in flight, a bounded queue
+with a maximum wait, and its own concurrency limits for the DNS, WHOIS and SMTP stages, so a bulk
+flood sheds its own requests (429 when its queue is full, 503 when they waited too long) instead
+of slowing down the interactive ones. Resources the lanes share, like the sessions to one MX host,
+are handed out by weighted fair queuing (FairSemaphore).
+
+The lane of the running request is kept in a context variable, tasks started for it inherit it.
+"""
+import os
+import time
+import asyncio
+import weakref
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+
+from src import metrics
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+STAGES = ("dns", "whois", "smtp")
+
+# per lane, overridable with EMAILFILTER_LANE_<LANE>_<SETTING>, e.g. EMAILFILTER_LANE_BULK_SMTP=32
+LANE_DEFAULTS = {
+    INTERACTIVE: {"requests": 256, "queue": 1024, "queue_ms": 1000, "weight": 4, "dns": 128, "whois": 6, "smtp": 64},
+    BULK: {"requests": 16, "queue": 64, "queue_ms": 5000, "weight": 1, "dns": 32, "whois": 2, "smtp": 16},
+}
+
+LANE_HEADER = "x-emailfilter-lane"
+API_KEY_HEADER = "x-api-key"
+# "key1:bulk,key2:interactive" - a key's lane wins over the header
+API_KEY_LANES = dict(
+    item.strip().split(":", 1) for item in os.environ.get("EMAILFILTER_API_KEY_LANES", "").split(",") if ":" in item
+)
+
+current_lane = contextvars.ContextVar("emailfilter_lane", default=INTERACTIVE)
+
+
+class Overloaded(Exception):
+    """
+    The lane can't take the request, status is 429 (queue full) or 503 (queued too long).
+    """
+
+    def __init__(self, lane: str, status: int, retry_after: int, reason: str):
+        super().__init__(f"{lane} lane {reason}")
+        self.lane = lane
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str):
+        settings = dict(LANE_DEFAULTS.get(name, LANE_DEFAULTS[BULK]))
+        for key, value in settings.items():
+            settings[key] = type(value)(os.environ.get(f"EMAILFILTER_LANE_{name.upper()}_{key.upper()}", value))
+        self.name = name
+        self.requests = settings["requests"]
+        self.queue = settings["queue"]
+        self.queue_ms = settings["queue_ms"]
+        self.weight = settings["weight"]
+        self.slots = asyncio.Semaphore(self.requests)
+        self.waiting = 0
+        self.stages = {stage: asyncio.Semaphore(settings[stage]) for stage in STAGES}
+
+    async def enter(self):
+        """
+        Takes a request slot, waiting at most queue_ms. Raises Overloaded instead of queueing when the queue is full.
+        """
+        if not self.slots.locked():
+            await self.slots.acquire()  # free slot, doesn't wait
+            return
+        if self.waiting >= self.queue:
+            metrics.REQUESTS_SHED.inc(lane=self.name, status=429)
+            raise Overloaded(self.name, 429, 1, "queue is full")
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.queue_ms / 1000)
+        except asyncio.TimeoutError:
+            metrics.REQUESTS_SHED.inc(lane=self.name, status=503)
+            raise Overloaded(self.name, 503, max(1, round(self.queue_ms / 1000)), f"queue wait over {self.queue_ms} ms")
+        finally:
+            self.waiting -= 1
+        metrics.LANE_WAIT.observe(time.perf_counter() - started, lane=self.name)
+
+    def leave(self):
+        self.slots.release()
+
+
+lanes = {name: Lane(name) for name in {*LANE_DEFAULTS, *API_KEY_LANES.values()}}
+
+
+def lane_for(headers, default: str = INTERACTIVE) -> Lane:
+    """
+    The lane of a request: by API key, then by the lane header, else default.
+    """
+    name = API_KEY_LANES.get(headers.get(API_KEY_HEADER, "")) or headers.get(LANE_HEADER, "").lower() or default
+    return lanes.get(name) or lanes[default]
+
+
+@asynccontextmanager
+async def admit(lane: Lane):
+    """
+    Runs the block as a request of lane: holds one of its slots and sets it as the current lane.
+    """
+    await lane.enter()
+    token = current_lane.set(lane.name)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+        lane.leave()
+
+
+def release_when_done(lane: Lane, body):
+    """
+    Wraps a streamed response body so the request slot taken with lane.enter() is given back when
+    the stream ends, or when the body is dropped without ever being iterated (client gone).
+    """
+    released = []
+
+    def leave():
+        if not released:
+            released.append(True)
+            lane.leave()
+
+    async def stream():
+        try:
+            async for item in body:
+                yield item
+        finally:
+            leave()
+
+    wrapped = stream()
+    weakref.finalize(wrapped, leave)
+    return wrapped
+
+
+async def in_lane(lane: Lane, coro):
+    """
+    Awaits coro with lane as the current lane, for tasks started outside of admit().
+    """
+    current_lane.set(lane.name)
+    return await coro
+
+
+@asynccontextmanager
+async def stage(name: str):
+    """
+    Holds one of the current lane's slots for a network stage (dns, whois or smtp).
+    """
+    async with lanes[current_lane.get()].stages[name]:
+        yield
+
+
+class FairSemaphore:
+    """
+    Semaphore shared by all lanes: waiters queue per lane and are woken by weighted fair queuing
+    (stride scheduling), so bulk callers can't starve interactive ones of a scarce resource.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = {}     # lane -> deque of futures
+        self._pass = {}        # lane -> virtual time of its next turn
+        self._vtime = 0.0
+
+    def locked(self) -> bool:
+        return self._value <= 0
+
+    async def acquire(self):
+        if self._value > 0 and not any(self._waiters.values()):
+            self._value -= 1
+            return
+        lane = current_lane.get()
+        queue = self._waiters.setdefault(lane, deque())
+        if not queue:
+            # an idle lane starts at the current time instead of cashing in the turns it didn't use
+            self._pass[lane] = max(self._pass.get(lane, 0.0), self._vtime)
+        future = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # woken and cancelled at the same time, hand the slot on
+            else:
+                queue.remove(future)
+            raise
+
+    def release(self):
+        self._value += 1
+        while self._value > 0:
+            lanes_waiting = [lane for lane, queue in self._waiters.items() if queue]
+            if not lanes_waiting:
+                return
+            lane = min(lanes_waiting, key=self._pass.__getitem__)
+            self._vtime = self._pass[lane]
+            self._pass[lane] += 1 / lanes[lane].weight
+            self._value -= 1
+            self._waiters[lane].popleft().set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        self.release()
+
@@ -0,0 +1,305 @@
+"""
+Offline bulk verification of large address lists, without the HTTP API:
+
+    python -m src.bulk_verify export.csv -o results.ndjson [--column email] [--format ndjson|csv|msgpack] [--fields verdict,score]
+
+The input (CSV with a header, or one address per line) is streamed in chunks. The in-memory checks
+run in a process pool, MX / SMTP / WHOIS with bounded asyncio concurrency in this process. Results
+are written in input order and progress is checkpointed to <output>.checkpoint, so running the
+same command again after an interruption continues where it stopped.
+"""
+import os
+import io
+import csv
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from pydantic import ValidationError
+
+from src.models import EmailInput
+from src.database import init_db
+from src.snapshot import get_snapshot
+from src.gibberish import get_model
+from src.utils_async import local_gibberish_probabilities
+from src.pipeline import RESULT_FIELDS, address_checks, complete_evaluation, start_pipeline, close_pipeline, result_fields, project
+from src.responses import ndjson_line, packb
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+
+# ---------------------- input ---------------------- #
+
+def read_addresses(path: str, column: str, skip: int):
+    """
+    Yields (row number, address) for the data rows after the first `skip`. The first line is a header
+    unless it already contains an address.
+    """
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        if column in first:
+            index = first.index(column)
+            rows = reader
+        elif len(first) == 1 or any("@" in cell for cell in first):
+            index = next((i for i, cell in enumerate(first) if "@" in cell), 0)
+            rows = _prepend(first, reader)
+        else:
+            raise SystemExit(f"Column '{column}' not found in header: {first}")
+
+        for number, row in enumerate(rows):
+            if number < skip:
+                continue
+            yield number, row[index].strip() if index < len(row) else ""
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def chunked(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ---------------------- CPU stage (pool processes) ---------------------- #
+
+def init_worker():
+    get_snapshot()
+    get_model()
+
+
+def cheap_checks(chunk: list) -> list:
+    """
+    Validates the addresses of a chunk and runs the in-memory checks, returns (row number, result) pairs.
+    The local parts of the chunk are scored for gibberish in one batch.
+    """
+    snapshot = get_snapshot()
+    results = []
+    valid = []
+    for number, raw in chunk:
+        try:
+            valid.append((number, EmailInput(email=raw).email))
+        except ValidationError:
+            results.append((number, {"email": raw, "error": "Invalid email address."}))
+    probabilities = local_gibberish_probabilities([email for _, email in valid])
+    for (number, email), probability in zip(valid, probabilities):
+        results.append((number, address_checks(email, email.split("@")[1].lower(), snapshot, probability)))
+    return results
+
+
+# ---------------------- output ---------------------- #
+
+class Checkpoint:
+    """
+    <output>.checkpoint: rows of the input already written and the output size at that point.
+    """
+
+    def __init__(self, output: str):
+        self.path = output + ".checkpoint"
+        self.rows = 0
+        self.bytes = 0
+        self.done = False
+
+    def load(self, input_path: str):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("input") != os.path.abspath(input_path):
+            raise SystemExit(f"{self.path} belongs to {state.get('input')}, use --restart to start over")
+        self.rows, self.bytes, self.done = state["rows"], state["bytes"], state.get("done", False)
+
+    def save(self, input_path: str):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"input": os.path.abspath(input_path), "rows": self.rows, "bytes": self.bytes, "done": self.done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+def format_result(result: dict, fmt: str, fields: tuple | None = None) -> bytes:
+    """
+    One output record: an NDJSON line, a MessagePack object or a CSV row of fields (all of them when None).
+    """
+    if fmt == "ndjson":
+        return ndjson_line(project(result, fields))
+    if fmt == "msgpack":
+        return packb(project(result, fields))
+    row = []
+    for field in fields or RESULT_FIELDS:
+        value = result.get(field)
+        if isinstance(value, list):
+            value = ";".join(map(str, value))
+        row.append("" if value is None else value)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode()
+
+
+class OrderedWriter:
+    """
+    Writes results in input order as soon as every earlier row is done, and checkpoints
+    after every `checkpoint_every` rows. At most `window` rows are read ahead of the last one
+    written, which bounds the reordering buffer.
+    """
+
+    def __init__(self, args, checkpoint: Checkpoint):
+        self.args = args
+        self.checkpoint = checkpoint
+        self.file = open(args.output, "r+b" if os.path.exists(args.output) else "w+b")
+        # anything after the checkpoint was written by the interrupted run and is written again
+        self.file.truncate(checkpoint.bytes)
+        self.file.seek(checkpoint.bytes)
+        if checkpoint.bytes == 0 and args.format == "csv":
+            self.file.write(format_result({field: field for field in RESULT_FIELDS}, "csv", args.fields))
+        self.next_row = checkpoint.rows
+        self.ready = {}
+        self.since_checkpoint = 0
+        self.stats = {}
+        self.window = asyncio.Semaphore(args.window)
+
+    def add(self, number: int, result: dict):
+        self.ready[number] = result
+        while self.next_row in self.ready:
+            result = self.ready.pop(self.next_row)
+            self.file.write(format_result(result, self.args.format, self.args.fields))
+            status = result.get("verdict", "error")
+            self.stats[status] = self.stats.get(status, 0) + 1
+            self.next_row += 1
+            self.since_checkpoint += 1
+            self.window.release()
+        if self.since_checkpoint >= self.args.checkpoint_every:
+            self.save()
+
+    def save(self, done: bool = False):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.checkpoint.rows = self.next_row
+        self.checkpoint.bytes = self.file.tell()
+        self.checkpoint.done = done
+        self.checkpoint.save(self.args.input)
+        self.since_checkpoint = 0
+
+    def close(self):
+        self.file.close()
+
+
+# ---------------------- network stage ---------------------- #
+
+async def run(args):
+    checkpoint = Checkpoint(args.output)
+    if args.restart:
+        for path in (args.output, checkpoint.path):
+            if os.path.exists(path):
+                os.unlink(path)
+    checkpoint.load(args.input)
+    if not os.path.exists(checkpoint.path) and os.path.exists(args.output) and os.path.getsize(args.output):
+        raise SystemExit(f"{args.output} exists and has no checkpoint, use --restart to overwrite it")
+    if checkpoint.done:
+        logger.info(f"{args.output} is already complete ({checkpoint.rows} rows), use --restart to run again")
+        return
+    if checkpoint.rows:
+        logger.info(f"Resuming after row {checkpoint.rows}")
+
+    init_db()
+    start_pipeline()
+    loop = asyncio.get_running_loop()
+    writer = OrderedWriter(args, checkpoint)
+    pool = ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn"), initializer=init_worker)
+    chunks = asyncio.Queue(maxsize=args.processes * 2)  # process pool futures, in input order
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    started = time.monotonic()
+    start_row = writer.next_row
+
+    async def produce():
+        for chunk in chunked(read_addresses(args.input, args.column, checkpoint.rows), args.chunk):
+            for _ in chunk:
+                await writer.window.acquire()
+            await chunks.put(loop.run_in_executor(pool, cheap_checks, chunk))
+        await chunks.put(None)
+
+    async def feed():
+        while (future := await chunks.get()) is not None:
+            for item in await future:
+                await queue.put(item)
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def verify():
+        while (item := await queue.get()) is not None:
+            number, result = item
+            if "error" not in result:
+                try:
+                    result = await complete_evaluation(result, get_snapshot(), args.full, log_check=args.log_checks)
+                except Exception as e:
+                    logger.error(f"Failed to verify {result['email']}: {e}")
+                    result = {"email": result["email"], "error": "Internal error"}
+            writer.add(number, result)
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.progress)
+            done = writer.next_row - start_row
+            rate = done / max(time.monotonic() - started, 1e-9)
+            logger.info(f"{writer.next_row} rows written ({rate:.0f}/s), {writer.stats}")
+
+    reporter = asyncio.create_task(report())
+    try:
+        await asyncio.gather(produce(), feed(), *(verify() for _ in range(args.concurrency)))
+        writer.save(done=True)
+        logger.info(f"Finished: {writer.next_row} rows in {args.output}, {writer.stats}")
+    finally:
+        reporter.cancel()
+        if not checkpoint.done:
+            writer.save()
+        writer.close()
+        pool.shutdown(cancel_futures=True)
+        await close_pipeline()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV file with a header, or one address per line")
+    parser.add_argument("-o", "--output", required=True, help="results file, appended to when resuming")
+    parser.add_argument("--format", choices=("ndjson", "csv", "msgpack"), default=None, help="default: from the output file extension")
+    parser.add_argument("--fields", default=None, help="comma separated result fields to write (email and error are always kept), default all")
+    parser.add_argument("--column", default="email", help="CSV column holding the address")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 2, help="processes for the in-memory checks")
+    parser.add_argument("--chunk", type=int, default=1000, help="addresses per process pool task")
+    parser.add_argument("--concurrency", type=int, default=200, help="addresses verified over the network at once")
+    parser.add_argument("--window", type=int, default=None, help="max rows read ahead of the last written one (default 50 x concurrency)")
+    parser.add_argument("--checkpoint-every", type=int, default=10000, help="rows between checkpoints")
+    parser.add_argument("--full", action="store_true", help="run every check even when the verdict is already decided")
+    parser.add_argument("--log-checks", action="store_true", help="count the addresses in the domain reputation")
+    parser.add_argument("--restart", action="store_true", help="discard the output and checkpoint and start over")
+    parser.add_argument("--progress", type=float, default=10, help="seconds between progress lines")
+    args = parser.parse_args()
+    if args.format is None:
+        args.format = {".csv": "csv", ".msgpack": "msgpack"}.get(os.path.splitext(args.output)[1], "ndjson")
+    if args.fields:
+        try:
+            args.fields = tuple(dict.fromkeys(("email", *result_fields(args.fields), "error")))
+        except ValueError as e:
+            parser.error(f"--fields: {e}")
+    if args.window is None:
+        args.window = args.concurrency * 50
+    args.window = max(args.window, args.chunk)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import cache_result
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# shared tier used by all workers on the host: sqlite (default), redis or memory (per-process only)
+CACHE_BACKEND = os.environ.get("EMAILFILTER_CACHE_BACKEND", "sqlite").lower()
+CACHE_PATH = os.environ.get("EMAILFILTER_CACHE_PATH", os.path.join(BASE_DIR, "cache.db"))
+CACHE_URL = os.environ.get("EMAILFILTER_CACHE_URL", "redis://localhost:6379/0")
+# entries read from the shared tier are kept in-process for at most this long
+CACHE_LOCAL_TTL = float(os.environ.get("EMAILFILTER_CACHE_LOCAL_TTL", 60))
+
+
+class TTLCache:
+    """
+    Bounded in-process LRU cache where every entry has its own expiry.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryBackend:
+    """
+    Per-process backend, the same interface as the shared ones.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self._cache = TTLCache(maxsize)
+
+    async def get(self, key: str):
+        return self._cache.get(key)
+
+    async def set(self, key: str, value, ttl: float):
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._cache.pop(key)
+
+    async def close(self):
+        self._cache.clear()
+
+
+class SQLiteBackend:
+    """
+    Host-wide backend: one WAL sqlite file that every worker reads and writes.
+    Values are stored as JSON, expired rows are purged every `purge_every` writes.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, purge_every: int = 1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache")
+        self._conn = None
+        self._writes = 0
+
+    # runs on the executor thread only
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _get(self, key: str):
+        row = self._db().execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value, ttl: float):
+        conn = self._db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl),
+            )
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    def _delete(self, key: str):
+        conn = self._db()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    async def get(self, key: str):
+        try:
+            return await self._run(self._get, key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {e}")
+            return None
+
+    async def set(self, key: str, value, ttl: float):
+        try:
+            await self._run(self._set, key, value, ttl)
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+
+    async def delete(self, key: str):
+        await self._run(self._delete, key)
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+
+
+class RedisBackend:
+    """
+    Redis (or any Redis-compatible server) backend, needs the optional `redis` package.
+    """
+
+    def __init__(self, url: str = CACHE_URL):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("EMAILFILTER_CACHE_BACKEND=redis requires the 'redis' package (pip install redis).")
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str):
+        try:
+            value = await self._client.get(key)
+        except Exception as e:
+            logger.warning(f"Shared cache read failed for {key}: {e}")
+            return None
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: float):
+        try:
+            await self._client.set(key, json.dumps(value), px=max(1, int(ttl * 1000)))
+        except Exception as e:
+            logger.warning(f"Shared cache write failed for {key}: {e}")
+
+    async def delete(self, key: str):
+        await self._client.delete(key)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    if name == "redis":
+        return RedisBackend()
+    if name == "memory":
+        return MemoryBackend()
+    if name != "sqlite":
+        logger.warning(f"Unknown cache backend '{name}', using sqlite")
+    return SQLiteBackend()
+
+shared_backend = create_backend()
+
+
+class TieredCache:
+    """
+    Namespaced cache: a small in-process TTLCache in front of the shared backend,
+    so a value computed by one worker is a hit in every other worker.
+    """
+
+    def __init__(self, namespace: str, maxsize: int = 10000, backend=None):
+        self.namespace = namespace
+        self.local = TTLCache(maxsize, CACHE_LOCAL_TTL)
+        self.backend = backend or shared_backend
+
+    async def get(self, key: str, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            cache_result(self.namespace, "hit")
+            return value
+        value = await self.backend.get(f"{self.namespace}:{key}")
+        if value is None:
+            cache_result(self.namespace, "miss")
+            return default
+        cache_result(self.namespace, "shared_hit")
+        self.local.set(key, value, CACHE_LOCAL_TTL)
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self.local.set(key, value, min(ttl, CACHE_LOCAL_TTL))
+        await self.backend.set(f"{self.namespace}:{key}", value, ttl)
+
+    async def delete(self, key: str):
+        self.local.pop(key)
+        await self.backend.delete(f"{self.namespace}:{key}")
@@ -1,3 +1,8 @@
+import os
+import json
+import fcntl
+import bisect
+from contextlib import contextmanager
 from pathlib import Path as PathLib
 
 BASE_DIR = PathLib(__file__).parent.parent / "lists"
@@ -9,41 +14,214 @@ LIST_FILES = {
     "spam_keywords": BASE_DIR / "spam_keywords.txt",
 }
 
+# batch filtering
+BATCH_MAX_EMAILS = int(os.environ.get("EMAILFILTER_BATCH_MAX", 100000))
+BATCH_SMTP_CONCURRENCY = int(os.environ.get("EMAILFILTER_BATCH_SMTP_CONCURRENCY", 20))
+BATCH_CONCURRENCY = int(os.environ.get("EMAILFILTER_BATCH_CONCURRENCY", 200))  # addresses checked at once per batch
+
+# list changes are appended to a journal per list and compacted into the sorted file later
+JOURNAL_DIR = BASE_DIR / ".journal"
+JOURNAL_COMPACT_BYTES = int(os.environ.get("EMAILFILTER_JOURNAL_COMPACT_BYTES", 1024 * 1024))
+JOURNAL_COMPACT_INTERVAL = float(os.environ.get("EMAILFILTER_JOURNAL_COMPACT_INTERVAL", 300))
+
 _loaded_sets = {}
+_loaded_keys = {}       # name -> list_key() the set was read at
+_journal_offsets = {}   # name -> journal bytes already applied to the set
+
+def file_key(path: PathLib) -> tuple:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return (0, 0)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def journal_path(name: str) -> PathLib:
+    return JOURNAL_DIR / f"{name}.log"
+
+def list_key(name: str) -> tuple:
+    """Changes whenever the list file or its journal changes."""
+    return file_key(LIST_FILES[name]) + file_key(journal_path(name))
+
+def _replay(name: str, items: set, offset: int = 0) -> int:
+    """Applies journal records after `offset` to items, returns the new offset.
+    A partially written last record is left for the next read."""
+    try:
+        with journal_path(name).open('rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return 0
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        items.difference_update(record.get("remove", ()))
+        items.update(record.get("add", ()))
+    return offset + end
+
+def read_list(name: str) -> set:
+    """Reads a list file and its journal from disk, bypassing the cache."""
+    path = LIST_FILES[name]
+    with path.open('r') as f:
+        items = set(line.strip() for line in f if line.strip())
+    _replay(name, items)
+    return items
 
 def load_list(name: str) -> set:
-    """Lazy-loads and returns a cached set from a list file."""
+    """Lazy-loads and returns a cached set from a list file, reloaded when another worker changed the list.
+    If only the journal grew, just the new records are applied."""
     if name not in LIST_FILES:
         raise ValueError(f"List '{name}' not found.")
-    if name not in _loaded_sets:
+    key = list_key(name)
+    cached_key = _loaded_keys.get(name)
+    if name in _loaded_sets and cached_key == key:
+        return _loaded_sets[name]
+    if name in _loaded_sets and cached_key[:2] == key[:2] and key[3] >= _journal_offsets.get(name, 0):
+        _journal_offsets[name] = _replay(name, _loaded_sets[name], _journal_offsets.get(name, 0))
+    else:
         path = LIST_FILES[name]
         with path.open('r') as f:
             _loaded_sets[name] = set(line.strip() for line in f if line.strip())
+        _journal_offsets[name] = _replay(name, _loaded_sets[name])
+    _loaded_keys[name] = key
     return _loaded_sets[name]
 
-def save_list(name: str):
-    """Writes the updated set to its respective file."""
-    if name not in LIST_FILES or name not in _loaded_sets:
-        raise ValueError(f"List '{name}' not loaded or recognized.")
+@contextmanager
+def _list_lock(name: str):
+    """Serializes writers of a list across workers."""
+    JOURNAL_DIR.mkdir(parents=True, exist_ok=True)
+    with open(JOURNAL_DIR / f"{name}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _fsync_dir(path: PathLib):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _write_list_file(name: str):
     path = LIST_FILES[name]
-    with path.open('w') as f:
+    tmp = path.with_suffix(f".tmp{os.getpid()}")
+    with tmp.open('w') as f:
         for item in sorted(_loaded_sets[name]):
             f.write(item + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    # the rename has to be on disk before the journal records it replaces are dropped
+    _fsync_dir(path.parent)
+    # the file now contains every journal record, replaying them again would be a no-op
+    if journal_path(name).exists():
+        os.truncate(journal_path(name), 0)
+    _journal_offsets[name] = 0
+    _loaded_keys[name] = list_key(name)
+
+def save_list(name: str):
+    """Writes the updated set to its respective file (atomically, readers never see a partial file)."""
+    if name not in LIST_FILES or name not in _loaded_sets:
+        raise ValueError(f"List '{name}' not loaded or recognized.")
+    with _list_lock(name):
+        _write_list_file(name)
+
+def compact_list(name: str):
+    """Folds the journal into the sorted list file."""
+    with _list_lock(name):
+        if file_key(journal_path(name))[1] == 0:
+            return
+        load_list(name)
+        _write_list_file(name)
+
+def compact_lists():
+    for name in LIST_FILES:
+        compact_list(name)
+
+def empty_list(name: str) -> int:
+    """Removes every item of a list (file and journal), returns how many there were."""
+    if name not in LIST_FILES:
+        raise ValueError(f"List '{name}' not found.")
+    with _list_lock(name):
+        items = load_list(name)
+        removed = len(items)
+        items.clear()
+        _write_list_file(name)
+    return removed
+
+def apply_list_changes(name: str, add=(), remove=()) -> tuple[int, int]:
+    """
+    Adds and removes many items in one journal record, so the change is applied completely or not at all.
+    Returns how many items were actually added and removed.
+    """
+    if name not in LIST_FILES:
+        raise ValueError(f"List '{name}' not found.")
+    add = {item.strip().lower() for item in add if item.strip()}
+    remove = {item.strip().lower() for item in remove if item.strip()} - add
+    with _list_lock(name):
+        items = load_list(name)
+        add -= items
+        remove &= items
+        if not add and not remove:
+            return 0, 0
+        record = (json.dumps({"add": sorted(add), "remove": sorted(remove)}) + "\n").encode()
+        fd = os.open(journal_path(name), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            written = 0
+            while written < len(record):
+                written += os.write(fd, record[written:])
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        items.difference_update(remove)
+        items.update(add)
+        _loaded_keys[name] = list_key(name)
+        _journal_offsets[name] = _loaded_keys[name][3]
+        if _journal_offsets[name] >= JOURNAL_COMPACT_BYTES:
+            _write_list_file(name)
+    return len(add), len(remove)
+
+_sorted_lists = {}  # name -> (file key, sorted tuple)
+
+def sorted_list(name: str) -> tuple:
+    """Sorted view of a list, only re-sorted when the list changed."""
+    items = load_list(name)
+    key = _loaded_keys[name]
+    cached = _sorted_lists.get(name)
+    if cached is None or cached[0] != key:
+        cached = _sorted_lists[name] = (key, tuple(sorted(items)))
+    return cached[1]
+
+def list_etag(name: str) -> str:
+    """ETag for the current version of a list (file and journal)."""
+    load_list(name)
+    return f'"{name}-' + "-".join(f"{part:x}" for part in _loaded_keys[name]) + '"'
+
+def list_page(name: str, cursor: str | None = None, prefix: str | None = None, limit: int = 1000) -> tuple:
+    """
+    Returns (items, next_cursor, total) - items after `cursor` that start with `prefix`,
+    total is the number of items matching the prefix.
+    """
+    items = sorted_list(name)
+    lo, hi = 0, len(items)
+    if prefix:
+        lo = bisect.bisect_left(items, prefix)
+        hi = bisect.bisect_left(items, prefix + "\uffff", lo)
+    total = hi - lo
+    if cursor:
+        lo = max(lo, bisect.bisect_right(items, cursor))
+    page = items[lo:min(lo + limit, hi)]
+    next_cursor = page[-1] if page and lo + limit < hi else None
+    return list(page), next_cursor, total
 
 def add_to_list(name: str, item: str):
     item = item.strip().lower()
     opposite = "blacklist" if name == "whitelist" else "whitelist"
-    opp_list = load_list(opposite)
-    if item in opp_list:
-        opp_list.remove(item)
-        save_list(opposite)
-    s = load_list(name)
-    s.add(item)
-    save_list(name)
+    apply_list_changes(opposite, remove=[item])
+    apply_list_changes(name, add=[item])
 
 
 
 def remove_from_list(name: str, item: str):
-    s = load_list(name)
-    s.discard(item.strip().lower())
-    save_list(name)
+    apply_list_changes(name, remove=[item])
@@ -1,54 +1,356 @@
 import os
+import time
+import asyncio
 import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import time_stage, cache_result
+from src.logger_config import get_logger
+logger = get_logger(__name__)
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, "reputation.db")
+DB_PATH = os.environ.get("EMAILFILTER_DB_PATH", os.path.join(BASE_DIR, "reputation.db"))
+
+# buffered writes are flushed every N seconds or once this many domains are pending
+REPUTATION_FLUSH_INTERVAL = float(os.environ.get("EMAILFILTER_REPUTATION_FLUSH_INTERVAL", 5))
+REPUTATION_FLUSH_SIZE = int(os.environ.get("EMAILFILTER_REPUTATION_FLUSH_SIZE", 500))
+# cached rows are re-read after this many seconds to pick up writes from other workers
+REPUTATION_CACHE_TTL = float(os.environ.get("EMAILFILTER_REPUTATION_CACHE_TTL", 60))
+REPUTATION_CACHE_SIZE = int(os.environ.get("EMAILFILTER_REPUTATION_CACHE_SIZE", 50000))
+# counters are kept per day, older days weigh less (halved every N days) and are dropped after N days
+REPUTATION_BUCKET_SECONDS = 86400
+REPUTATION_HALF_LIFE_DAYS = float(os.environ.get("EMAILFILTER_REPUTATION_HALF_LIFE_DAYS", 30))
+REPUTATION_RETENTION_DAYS = int(os.environ.get("EMAILFILTER_REPUTATION_RETENTION_DAYS", 180))
+# domains with at most N checks, no spam reports and no activity for N days are pruned
+REPUTATION_LOW_SIGNAL_CHECKS = int(os.environ.get("EMAILFILTER_REPUTATION_LOW_SIGNAL_CHECKS", 2))
+REPUTATION_LOW_SIGNAL_DAYS = int(os.environ.get("EMAILFILTER_REPUTATION_LOW_SIGNAL_DAYS", 14))
+REPUTATION_PRUNE_INTERVAL = float(os.environ.get("EMAILFILTER_REPUTATION_PRUNE_INTERVAL", 3600))
+
+
+def connect(db_path: str = DB_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
+def init_db(db_path: str = DB_PATH):
+    conn = connect(db_path)
     cursor = conn.cursor()
     cursor.execute("""
-        CREATE TABLE IF NOT EXISTS domain_reputation (
+        CREATE TABLE IF NOT EXISTS reputation_daily (
+            domain TEXT NOT NULL,
+            day INTEGER NOT NULL,
+            checks INTEGER NOT NULL DEFAULT 0,
+            spam INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (domain, day)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS reputation_daily_day ON reputation_daily (day)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS domain_age (
             domain TEXT PRIMARY KEY,
-            total_checks INTEGER DEFAULT 0,
-            user_marked_spam INTEGER DEFAULT 0
+            created_at TEXT,
+            checked_at REAL NOT NULL
         )
     """)
     conn.commit()
+    migrate_reputation(conn)
     conn.close()
 
-def log_domain_check(domain: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO domain_reputation (domain, total_checks, user_marked_spam)
-        VALUES (?, 1, 0)
-        ON CONFLICT(domain) DO UPDATE SET total_checks = total_checks + 1
-    """, (domain,))
-    conn.commit()
-    conn.close()
+def migrate_reputation(conn: sqlite3.Connection):
+    """
+    Moves the undated counters of the old domain_reputation table into today's bucket,
+    from where they decay like everything else.
+    """
+    legacy = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'domain_reputation'").fetchone()
+    if legacy is None:
+        return
+    with conn:
+        moved = conn.execute("""
+            INSERT INTO reputation_daily (domain, day, checks, spam)
+            SELECT domain, ?, total_checks, user_marked_spam FROM domain_reputation WHERE true
+            ON CONFLICT(domain, day) DO UPDATE SET checks = checks + excluded.checks, spam = spam + excluded.spam
+        """, (current_day(),)).rowcount
+        conn.execute("DROP TABLE domain_reputation")
+    logger.info(f"Migrated {moved} domains from domain_reputation to reputation_daily")
 
-def mark_domain_as_spam(domain: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO domain_reputation (domain, total_checks, user_marked_spam)
-        VALUES (?, 0, 1)
-        ON CONFLICT(domain) DO UPDATE SET user_marked_spam = user_marked_spam + 1
-    """, (domain,))
-    conn.commit()
-    conn.close()
+def current_day(now: float | None = None) -> int:
+    return int((time.time() if now is None else now) // REPUTATION_BUCKET_SECONDS)
 
-def get_reputation_penalty(domain: str) -> int:
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT total_checks, user_marked_spam FROM domain_reputation WHERE domain = ?", (domain,))
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        total, spam = result
-        if total == 0:
-            return 0
-        spam_ratio = spam / total
-        return int(-50 * spam_ratio)
-    return 0
+def decay_weight(age_days: int) -> float:
+    return 0.5 ** (age_days / REPUTATION_HALF_LIFE_DAYS)
+
+def decayed_counts(rows, today: int) -> tuple[float, float]:
+    """
+    (checks, spam) summed over (day, checks, spam) rows, each day weighted by its age.
+    """
+    total = spam = 0.0
+    for day, checks, spam_reports in rows:
+        weight = decay_weight(max(0, today - day))
+        total += checks * weight
+        spam += spam_reports * weight
+    return total, spam
+
+def calculate_penalty(total: float, spam: float) -> int:
+    if total == 0:
+        return 0
+    spam_ratio = min(1.0, spam / total)
+    return int(-50 * spam_ratio)
+
+def prune_reputation(conn: sqlite3.Connection, today: int | None = None) -> tuple[int, int]:
+    """
+    Deletes days past the retention and domains that were only seen a few times, long ago,
+    and never reported. Returns (expired rows, low-signal rows) deleted.
+    """
+    today = current_day() if today is None else today
+    with conn:
+        expired = conn.execute("DELETE FROM reputation_daily WHERE day <= ?", (today - REPUTATION_RETENTION_DAYS,)).rowcount
+        low_signal = conn.execute("""
+            DELETE FROM reputation_daily WHERE domain IN (
+                SELECT domain FROM reputation_daily GROUP BY domain
+                HAVING SUM(spam) = 0 AND SUM(checks) <= ? AND MAX(day) <= ?
+            )
+        """, (REPUTATION_LOW_SIGNAL_CHECKS, today - REPUTATION_LOW_SIGNAL_DAYS)).rowcount
+    return expired, low_signal
+
+
+class ReputationStore:
+    """
+    Keeps one persistent WAL connection on a dedicated thread so sqlite never runs on the event loop.
+    Check counts are buffered in memory and written to today's bucket in batched transactions,
+    reads sum the decayed buckets and are served from an in-process cache that local writes keep up to date.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reputation")
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending = {}  # domain -> buffered total_checks increment
+        self._cache = OrderedDict()  # domain -> (decayed checks, decayed spam reports, loaded_at)
+        self._flush_task = None
+        self._flush_scheduled = False
+        self._size_flush_task = None  # flush started by log_check() when the buffer is full
+
+    # runs on the executor thread only
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+        return self._conn
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _cache_put(self, domain: str, total: float, spam: float):
+        self._cache[domain] = (total, spam, time.monotonic())
+        self._cache.move_to_end(domain)
+        while len(self._cache) > REPUTATION_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    # ---------------- writes ---------------- #
+
+    def log_check(self, domain: str, count: int = 1):
+        with self._lock:
+            self._pending[domain] = self._pending.get(domain, 0) + count
+            pending = len(self._pending)
+        if pending >= REPUTATION_FLUSH_SIZE and not self._flush_scheduled:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # no loop (CLI, process pool), still written on the executor thread
+                self._apply_flushed(self._executor.submit(self._write_batch, self._take_pending()).result())
+                return
+            self._flush_scheduled = True
+            self._size_flush_task = loop.create_task(self.flush())
+            self._size_flush_task.add_done_callback(self._size_flush_done)
+
+    def _size_flush_done(self, task: asyncio.Task):
+        self._size_flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to flush reputation updates: {task.exception()}")
+
+    def _take_pending(self) -> dict:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+    def _write_batch(self, batch: dict) -> dict:
+        """Writes a batch in one transaction, returns the batch or {} if it was put back."""
+        if not batch:
+            return batch
+        try:
+            conn = self._db()
+            with conn:
+                today = current_day()
+                conn.executemany("""
+                    INSERT INTO reputation_daily (domain, day, checks, spam)
+                    VALUES (?, ?, ?, 0)
+                    ON CONFLICT(domain, day) DO UPDATE SET checks = checks + excluded.checks
+                """, ((domain, today, count) for domain, count in batch.items()))
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} reputation updates: {e}")
+            with self._lock:
+                for domain, count in batch.items():
+                    self._pending[domain] = self._pending.get(domain, 0) + count
+            return {}
+        logger.debug(f"Flushed reputation updates for {len(batch)} domains")
+        return batch
+
+    def _apply_flushed(self, batch: dict):
+        # cached rows now have to include the flushed increments
+        for domain, count in batch.items():
+            cached = self._cache.get(domain)
+            if cached:
+                self._cache[domain] = (cached[0] + count, cached[1], cached[2])
+
+    async def flush(self):
+        try:
+            batch = self._take_pending()
+            if batch:
+                with time_stage("reputation_write"):
+                    flushed = await self._run(self._write_batch, batch)
+                self._apply_flushed(flushed)
+        finally:
+            self._flush_scheduled = False
+
+    def _mark_spam_sync(self, domain: str):
+        conn = self._db()
+        with conn:
+            conn.execute("""
+                INSERT INTO reputation_daily (domain, day, checks, spam)
+                VALUES (?, ?, 0, 1)
+                ON CONFLICT(domain, day) DO UPDATE SET spam = spam + 1
+            """, (domain, current_day()))
+
+    async def mark_spam(self, domain: str):
+        await self._run(self._mark_spam_sync, domain)
+        cached = self._cache.get(domain)
+        if cached:
+            self._cache[domain] = (cached[0], cached[1] + 1, cached[2])
+
+    # ---------------- reads ---------------- #
+
+    def _read_sync(self, domain: str) -> tuple[float, float]:
+        today = current_day()
+        rows = self._db().execute(
+            "SELECT day, checks, spam FROM reputation_daily WHERE domain = ? AND day > ?",
+            (domain, today - REPUTATION_RETENTION_DAYS),
+        ).fetchall()
+        return decayed_counts(rows, today)
+
+    async def get_penalty(self, domain: str) -> int:
+        cached = self._cache.get(domain)
+        if cached is None or time.monotonic() - cached[2] > REPUTATION_CACHE_TTL:
+            cache_result("reputation", "miss")
+            with time_stage("reputation_read"):
+                total, spam = await self._run(self._read_sync, domain)
+            self._cache_put(domain, total, spam)
+        else:
+            cache_result("reputation", "hit")
+            total, spam, _ = cached
+        with self._lock:
+            total += self._pending.get(domain, 0)
+        return calculate_penalty(total, spam)
+
+    def _top_domains_sync(self, limit: int, days: int) -> list:
+        rows = self._db().execute(
+            "SELECT domain FROM reputation_daily WHERE day > ? GROUP BY domain ORDER BY SUM(checks) DESC LIMIT ?",
+            (current_day() - days, limit),
+        ).fetchall()
+        return [domain for (domain,) in rows]
+
+    async def top_domains(self, limit: int, days: int = 7) -> list:
+        """
+        The most checked domains of the last `days` days, most checked first.
+        """
+        return await self._run(self._top_domains_sync, limit, days)
+
+    # ---------------- lifecycle ---------------- #
+
+    async def _flush_loop(self):
+        pruned_at = time.monotonic()
+        while True:
+            await asyncio.sleep(REPUTATION_FLUSH_INTERVAL)
+            await self.flush()
+            if time.monotonic() - pruned_at >= REPUTATION_PRUNE_INTERVAL:
+                pruned_at = time.monotonic()
+                await self.prune()
+
+    async def prune(self):
+        try:
+            expired, low_signal = await self._run(lambda: prune_reputation(self._db()))
+        except Exception as e:
+            logger.error(f"Failed to prune reputation counters: {e}")
+            return
+        if expired or low_signal:
+            logger.info(f"Pruned {expired} expired and {low_signal} low-signal reputation rows")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+
+
+reputation_store = ReputationStore()
+
+def log_domain_check(domain: str, count: int = 1):
+    """Buffers a check, written to the db by the next flush."""
+    reputation_store.log_check(domain, count)
+
+async def mark_domain_as_spam(domain: str):
+    await reputation_store.mark_spam(domain)
+
+async def get_reputation_penalty(domain: str) -> int:
+    return await reputation_store.get_penalty(domain)
+
+
+def _db_size(db_path: str) -> int:
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+def vacuum(db_path: str = DB_PATH) -> dict:
+    """
+    Offline compaction: prunes the reputation counters, then checkpoints, rebuilds and analyzes the file.
+    VACUUM blocks writers while it runs, so stop the API first (or run it when traffic is low).
+    """
+    size_before = _db_size(db_path)
+    init_db(db_path)
+    conn = connect(db_path)
+    try:
+        rows_before = conn.execute("SELECT COUNT(*) FROM reputation_daily").fetchone()[0]
+        expired, low_signal = prune_reputation(conn)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+        conn.execute("ANALYZE")
+        rows_after = conn.execute("SELECT COUNT(*) FROM reputation_daily").fetchone()[0]
+        domains = conn.execute("SELECT COUNT(DISTINCT domain) FROM reputation_daily").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "rows_before": rows_before,
+        "rows_after": rows_after,
+        "expired_rows": expired,
+        "low_signal_rows": low_signal,
+        "domains": domains,
+        "bytes_before": size_before,
+        "bytes_after": _db_size(db_path),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Reputation db maintenance.")
+    parser.add_argument("command", choices=["vacuum"], help="vacuum: prune old and low-signal counters, then compact the db file")
+    parser.add_argument("--db", default=DB_PATH, help=f"database file (default {DB_PATH})")
+    args = parser.parse_args()
+    for key, value in vacuum(args.db).items():
+        print(f"{key:>16}: {value}")
@@ -0,0 +1,132 @@
+import os
+import asyncio
+import aiodns
+from aiodns import error as dns_error
+
+from src.cache import TieredCache
+from src.metrics import cache_result
+from src.admission import stage
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# comma separated, e.g. "127.0.0.1:5353" - defaults to the system resolvers
+DNS_SERVERS = [server.strip() for server in os.environ.get("EMAILFILTER_DNS_SERVERS", "").split(",") if server.strip()]
+DNS_TIMEOUT = float(os.environ.get("EMAILFILTER_DNS_TIMEOUT", 3))
+DNS_CACHE_SIZE = int(os.environ.get("EMAILFILTER_DNS_CACHE_SIZE", 50000))
+# record TTLs are clamped to this range
+DNS_MIN_TTL = float(os.environ.get("EMAILFILTER_DNS_MIN_TTL", 60))
+DNS_MAX_TTL = float(os.environ.get("EMAILFILTER_DNS_MAX_TTL", 86400))
+# NXDOMAIN / no mail records, and SERVFAIL / timeouts
+DNS_NEGATIVE_TTL = float(os.environ.get("EMAILFILTER_DNS_NEGATIVE_TTL", 300))
+DNS_ERROR_TTL = float(os.environ.get("EMAILFILTER_DNS_ERROR_TTL", 30))
+
+# the domain or the record type does not exist - an answer, not a failure
+_NEGATIVE_ERRORS = (dns_error.ARES_ENOTFOUND, dns_error.ARES_ENODATA)
+
+
+def _clamp_ttl(ttl) -> float:
+    try:
+        ttl = float(ttl)
+    except (TypeError, ValueError):
+        ttl = DNS_MIN_TTL
+    return max(DNS_MIN_TTL, min(DNS_MAX_TTL, ttl))
+
+
+def _error_code(e: Exception):
+    return e.args[0] if isinstance(e, aiodns.error.DNSError) and e.args else None
+
+
+class MXResolver:
+    """
+    MX lookups on top of aiodns: answers sorted by preference, cached for the record TTL,
+    NXDOMAIN / no-mail answers cached negatively, concurrent lookups for a domain share one query.
+    Domains without MX but with an A/AAAA record get the implicit MX (the domain itself, RFC 5321).
+    """
+
+    def __init__(self, nameservers: list | None = None):
+        self.nameservers = nameservers or DNS_SERVERS
+        self._resolver = None
+        self.cache = TieredCache("mx", DNS_CACHE_SIZE)  # domain -> [hosts], [] when the domain has no mail server
+        self._inflight = {}
+
+    @property
+    def resolver(self) -> aiodns.DNSResolver:
+        # created lazily so it binds to the running loop
+        if self._resolver is None:
+            self._resolver = aiodns.DNSResolver(nameservers=self.nameservers or None, timeout=DNS_TIMEOUT)
+        return self._resolver
+
+    async def _query(self, domain: str, qtype: str):
+        async with stage("dns"):
+            return await self.resolver.query(domain, qtype)
+
+    async def _has_address(self, domain: str) -> tuple[bool, float]:
+        for qtype in ("A", "AAAA"):
+            try:
+                answer = await self._query(domain, qtype)
+            except aiodns.error.DNSError as e:
+                if _error_code(e) in _NEGATIVE_ERRORS:
+                    continue
+                raise
+            if answer:
+                return True, _clamp_ttl(min(getattr(r, "ttl", DNS_MIN_TTL) for r in answer))
+        return False, DNS_NEGATIVE_TTL
+
+    async def _resolve(self, domain: str) -> tuple[list | None, float]:
+        """
+        Returns (hosts, ttl), hosts is [] for a definite "no mail" answer and None when the lookup failed.
+        """
+        try:
+            answer = await self._query(domain, "MX")
+        except aiodns.error.DNSError as e:
+            code = _error_code(e)
+            if code == dns_error.ARES_ENOTFOUND:
+                return [], DNS_NEGATIVE_TTL
+            if code != dns_error.ARES_ENODATA:
+                logger.warning(f"MX lookup failed for {domain}: {e}")
+                return None, DNS_ERROR_TTL
+            answer = []
+
+        records = sorted(answer, key=lambda r: r.priority)
+        if records:
+            hosts = [r.host.rstrip(".") for r in records]
+            if hosts == [""]:
+                return [], _clamp_ttl(records[0].ttl)  # null MX (RFC 7505), the domain accepts no mail
+            return [host for host in hosts if host], _clamp_ttl(min(getattr(r, "ttl", DNS_MIN_TTL) for r in records))
+
+        # no MX records: fall back to the address records of the domain itself
+        try:
+            has_address, ttl = await self._has_address(domain)
+        except aiodns.error.DNSError as e:
+            logger.warning(f"A/AAAA lookup failed for {domain}: {e}")
+            return None, DNS_ERROR_TTL
+        return ([domain] if has_address else []), ttl
+
+    async def _lookup(self, domain: str) -> list | None:
+        hosts, ttl = await self._resolve(domain)
+        if hosts is None:
+            # keep failures out of the shared tier, just avoid hammering the resolver here
+            self.cache.local.set(domain, [], ttl)
+        else:
+            await self.cache.set(domain, hosts, ttl)
+        return hosts
+
+    async def lookup(self, domain: str) -> list | None:
+        """
+        Mail hosts for a domain in preference order, or None when there are none / the lookup failed.
+        """
+        domain = domain.lower().rstrip(".")
+        hosts = await self.cache.get(domain)
+        if hosts is None:
+            task = self._inflight.get(domain)
+            if task is None:
+                task = asyncio.ensure_future(self._lookup(domain))
+                self._inflight[domain] = task
+                task.add_done_callback(lambda _: self._inflight.pop(domain, None))
+            else:
+                cache_result("mx_inflight", "hit")
+            hosts = await asyncio.shield(task)
+        return hosts or None
+
+
+mx_resolver = MXResolver()
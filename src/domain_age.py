@@ -0,0 +1,173 @@
+import os
+import time
+import asyncio
+import sqlite3
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from src.cache import TTLCache
+from src.database import DB_PATH, connect
+from src.metrics import cache_result
+from src.admission import stage
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+NEW_DOMAIN_DAYS = 30
+# first-seen domains wait at most this long for WHOIS, the lookup keeps running in the background
+WHOIS_WAIT_MS = int(os.environ.get("EMAILFILTER_WHOIS_WAIT_MS", 1500))
+# known creation dates are re-checked after N days, failed lookups after N hours
+WHOIS_REFRESH_DAYS = float(os.environ.get("EMAILFILTER_WHOIS_REFRESH_DAYS", 30))
+WHOIS_RETRY_HOURS = float(os.environ.get("EMAILFILTER_WHOIS_RETRY_HOURS", 24))
+WHOIS_THREADS = int(os.environ.get("EMAILFILTER_WHOIS_THREADS", 8))
+
+
+def whois_creation_date(domain: str) -> datetime | None:
+    """
+    Blocking WHOIS lookup, returns the timezone-aware creation date or None when unknown.
+    """
+    import whois  # slow to import, only needed once a domain isn't in the db
+    try:
+        data = whois.whois(domain)
+        logger.debug(f"[WHOIS Raw Data] {data}")
+
+        created = data.creation_date
+        logger.debug(f"[Parsed Creation Date] {created}")
+
+        if not created:
+            logger.warning(f"No creation date found for domain {domain}")
+            return None
+
+        if isinstance(created, list):
+            created = created[0]
+            logger.debug(f"[Using First Date from List] {created}")
+
+        if not isinstance(created, datetime):
+            try:
+                created = datetime.strptime(str(created), '%Y-%m-%d')
+            except Exception as e:
+                logger.error(f"Failed to parse creation date {created} for domain {domain}: {e}")
+                return None
+
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=timezone.utc)
+        return created
+
+    except Exception as e:
+        logger.error(f"WHOIS lookup exception for domain {domain}: {e}")
+        return None
+
+
+def age_result(created: datetime | None, threshold_days: int = NEW_DOMAIN_DAYS) -> tuple:
+    """
+    (new_domain, domain_age_in_days) - domains with unknown age count as new.
+    """
+    if created is None:
+        return True, None
+    age_days = (datetime.now(timezone.utc) - created).days
+    return age_days < threshold_days, age_days
+
+
+class WhoisPending(Exception):
+    """
+    A first-seen domain's WHOIS lookup didn't finish within WHOIS_WAIT_MS, it keeps running in the background.
+    """
+
+
+class DomainAgeStore:
+    """
+    Creation dates persisted in the domain_age table. Known domains are answered from the table
+    (stale rows are refreshed in the background), first-seen domains wait at most WHOIS_WAIT_MS.
+    """
+
+    def __init__(self, db_path: str = DB_PATH):
+        self.db_path = db_path
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="domain-age")
+        self._whois_executor = ThreadPoolExecutor(max_workers=WHOIS_THREADS, thread_name_prefix="whois")
+        self._conn = None
+        self._cache = TTLCache(50000, 3600)  # domain -> (created, checked_at)
+        self._inflight = {}                  # domain -> lookup task
+
+    # runs on the db executor thread only
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = connect(self.db_path)
+        return self._conn
+
+    def _read(self, domain: str):
+        row = self._db().execute("SELECT created_at, checked_at FROM domain_age WHERE domain = ?", (domain,)).fetchone()
+        if row is None:
+            return None
+        created = datetime.fromisoformat(row[0]) if row[0] else None
+        return created, row[1]
+
+    def _write(self, domain: str, created: datetime | None, checked_at: float):
+        conn = self._db()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO domain_age (domain, created_at, checked_at) VALUES (?, ?, ?)",
+                (domain, created.isoformat() if created else None, checked_at),
+            )
+
+    async def _lookup(self, domain: str) -> datetime | None:
+        loop = asyncio.get_running_loop()
+        async with stage("whois"):
+            created = await loop.run_in_executor(self._whois_executor, whois_creation_date, domain)
+        checked_at = time.time()
+        self._cache.set(domain, (created, checked_at))
+        try:
+            await loop.run_in_executor(self._db_executor, self._write, domain, created, checked_at)
+        except Exception as e:
+            logger.error(f"Failed to store domain age for {domain}: {e}")
+        return created
+
+    def refresh(self, domain: str) -> asyncio.Task:
+        """
+        Starts a WHOIS lookup unless one is already running for the domain.
+        """
+        task = self._inflight.get(domain)
+        if task is None:
+            task = asyncio.ensure_future(self._lookup(domain))
+            self._inflight[domain] = task
+            task.add_done_callback(lambda _: self._inflight.pop(domain, None))
+        return task
+
+    @staticmethod
+    def is_stale(created: datetime | None, checked_at: float) -> bool:
+        max_age = WHOIS_REFRESH_DAYS * 86400 if created else WHOIS_RETRY_HOURS * 3600
+        return time.time() - checked_at > max_age
+
+    async def get(self, domain: str) -> tuple:
+        """
+        Returns (new_domain, domain_age_in_days). Raises WhoisPending if a first lookup didn't finish in time.
+        """
+        entry = self._cache.get(domain)
+        if entry is None:
+            entry = await asyncio.get_running_loop().run_in_executor(self._db_executor, self._read, domain)
+            if entry is not None:
+                self._cache.set(domain, entry)
+            cache_result("whois", "miss" if entry is None else "shared_hit")
+        else:
+            cache_result("whois", "hit")
+
+        if entry is not None:
+            created, checked_at = entry
+            if self.is_stale(created, checked_at):
+                self.refresh(domain)
+            return age_result(created)
+
+        try:
+            created = await asyncio.wait_for(asyncio.shield(self.refresh(domain)), WHOIS_WAIT_MS / 1000)
+        except asyncio.TimeoutError:
+            logger.debug(f"WHOIS for {domain} still running after {WHOIS_WAIT_MS} ms, age unknown for now")
+            raise WhoisPending(domain)
+        return age_result(created)
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._db_executor, self._conn.close)
+            self._conn = None
+        self._whois_executor.shutdown(wait=False, cancel_futures=True)
+
+
+domain_age_store = DomainAgeStore()
@@ -0,0 +1,136 @@
+import os
+import mmap
+import time
+import fcntl
+import struct
+from pathlib import Path as PathLib
+
+from src.constants import BASE_DIR, list_key, read_list
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+INDEX_DIR = BASE_DIR / ".index"
+# how often (seconds) a lookup re-checks the source list for changes
+INDEX_CHECK_INTERVAL = float(os.environ.get("EMAILFILTER_INDEX_CHECK_INTERVAL", 5))
+
+# magic, list_key() of the source (file and journal mtime_ns and size), entry count
+_HEADER = struct.Struct("<8sQQQQI")
+_MAGIC = b"EFIDX002"
+_OFFSET = struct.Struct("<I")
+
+
+def reverse_labels(domain: str) -> bytes:
+    """x.mailinator.com -> com.mailinator.x, so parent domains sort next to their subdomains."""
+    return ".".join(reversed(domain.split("."))).encode()
+
+
+def build_index(list_name: str, target: PathLib):
+    """
+    Writes a sorted array of reversed domains of a list (file and journal): header,
+    count + 1 uint32 offsets, then the names.
+    """
+    # taken before reading, a change while reading makes the index stale instead of wrongly current
+    source_key = list_key(list_name)
+    keys = sorted({reverse_labels(domain.lower()) for domain in read_list(list_name)})
+
+    offsets = bytearray()
+    position = 0
+    for key in keys:
+        offsets += _OFFSET.pack(position)
+        position += len(key)
+    offsets += _OFFSET.pack(position)
+
+    tmp = target.with_suffix(f".tmp{os.getpid()}")
+    with tmp.open("wb") as f:
+        f.write(_HEADER.pack(_MAGIC, *source_key, len(keys)))
+        f.write(offsets)
+        f.write(b"".join(keys))
+    os.replace(tmp, target)
+    logger.info(f"Built index {target.name} with {len(keys)} domains")
+
+
+class DomainIndex:
+    """
+    Memory-mapped, sorted index of a domain list. Every worker maps the same file,
+    so the list lives once in the page cache. The index is rebuilt when the list file or its
+    journal changes, so list changes don't have to be compacted into the file first.
+    """
+
+    def __init__(self, list_name: str):
+        self.list_name = list_name
+        self.path = INDEX_DIR / f"{list_name}.idx"
+        self._mmap = None
+        self._count = 0
+        self._data_start = 0
+        self._checked_at = 0.0
+        self._source_key = None
+
+    def _is_current(self, source_key: tuple) -> bool:
+        try:
+            with self.path.open("rb") as f:
+                magic, *key, _ = _HEADER.unpack(f.read(_HEADER.size))
+        except (OSError, struct.error):
+            return False
+        return magic == _MAGIC and tuple(key) == source_key
+
+    def _open(self):
+        source_key = list_key(self.list_name)
+        if not self._is_current(source_key):
+            INDEX_DIR.mkdir(parents=True, exist_ok=True)
+            with open(INDEX_DIR / ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # one worker builds, the others wait and reuse it
+                if not self._is_current(source_key):
+                    build_index(self.list_name, self.path)
+
+        with self.path.open("rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        count = _HEADER.unpack_from(mapped, 0)[-1]
+        old, self._mmap = self._mmap, mapped
+        self._count = count
+        self._data_start = _HEADER.size + (count + 1) * _OFFSET.size
+        self._source_key = source_key
+        if old is not None:
+            old.close()
+
+    def refresh(self, force: bool = False):
+        """
+        Reopens (and if needed rebuilds) the index when the source list changed.
+        """
+        now = time.monotonic()
+        if not force and self._mmap is not None and now - self._checked_at < INDEX_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        if force or self._mmap is None or list_key(self.list_name) != self._source_key:
+            self._open()
+
+    def _key(self, i: int) -> bytes:
+        start, end = struct.unpack_from("<II", self._mmap, _HEADER.size + i * _OFFSET.size)
+        return self._mmap[self._data_start + start:self._data_start + end]
+
+    def _contains_key(self, key: bytes) -> bool:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo < self._count and self._key(lo) == key
+
+    def __len__(self):
+        self.refresh()
+        return self._count
+
+    def contains(self, domain: str) -> bool:
+        """Exact match."""
+        self.refresh()
+        return self._contains_key(reverse_labels(domain.lower()))
+
+    def matches(self, domain: str) -> bool:
+        """Exact match or any parent domain is listed (x.mailinator.com matches mailinator.com)."""
+        self.refresh()
+        labels = domain.lower().split(".")
+        for i in range(len(labels) - 1):
+            if self._contains_key(reverse_labels(".".join(labels[i:]))):
+                return True
+        return False
@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+from dataclasses import dataclass, astuple
+
+from src.cache import TieredCache
+from src.database import get_reputation_penalty
+from src.smtp_verifier import smtp_verifier
+from src.snapshot import Snapshot, get_snapshot
+from src.utils_async import check_domain_in_lists, timed_mx_lookup, cached_domain_age
+from src.domain_age import WhoisPending
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# profiles older than PROFILE_REFRESH seconds are still served but rebuilt in the background,
+# after PROFILE_TTL they are dropped
+PROFILE_REFRESH = float(os.environ.get("EMAILFILTER_PROFILE_REFRESH", 60))
+PROFILE_TTL = float(os.environ.get("EMAILFILTER_PROFILE_TTL", 3600))
+PROFILE_CACHE_SIZE = int(os.environ.get("EMAILFILTER_PROFILE_CACHE_SIZE", 10000))
+
+LIST_FLAGS = ("disposable", "blacklisted", "whitelisted")
+
+
+@dataclass(frozen=True, slots=True)
+class DomainProfile:
+    """
+    Everything about a domain that doesn't depend on the local part, stored as one flat record.
+    List flags are valid for the snapshot lists_version they were computed with.
+    """
+    lists_version: int
+    disposable: bool
+    blacklisted: bool
+    whitelisted: bool
+    mx_records: list
+    new_domain: bool
+    domain_age_in_days: int | None
+    catch_all: bool | None
+    reputation_penalty: int
+    built_at: float
+
+    @classmethod
+    def from_result(cls, result: dict, lists_version: int) -> "DomainProfile":
+        return cls(
+            lists_version, result["disposable"], result["blacklisted"], result["whitelisted"],
+            result["mx_records"], result["new_domain"], result["domain_age_in_days"],
+            result["catch_all"], result["reputation_penalty"], time.time(),
+        )
+
+    def fields(self, domain: str, snapshot: Snapshot) -> dict:
+        """
+        The result fields this profile answers, list flags are recomputed if the lists changed since.
+        """
+        if self.lists_version == snapshot.lists_version:
+            flags = {flag: getattr(self, flag) for flag in LIST_FLAGS}
+        else:
+            flags = check_domain_in_lists([domain], snapshot)[domain]
+        return {
+            **flags,
+            "mx_exists": True,
+            "mx_records": self.mx_records,
+            "new_domain": self.new_domain,
+            "domain_age_in_days": self.domain_age_in_days,
+            "catch_all": self.catch_all,
+            "reputation_penalty": self.reputation_penalty,
+        }
+
+
+class DomainProfileStore:
+    """
+    Domain profiles in the shared cache, so hot domains only need the per-address checks.
+    Only domains with mail servers and a WHOIS answer get a profile.
+    """
+
+    def __init__(self):
+        self.cache = TieredCache("profile", PROFILE_CACHE_SIZE)  # domain -> astuple(DomainProfile)
+        self._refreshing = {}
+
+    async def get(self, domain: str) -> DomainProfile | None:
+        record = await self.cache.get(domain)
+        if record is None:
+            return None
+        try:
+            profile = DomainProfile(*record)
+        except TypeError:
+            return None  # written by an older version
+        if time.time() - profile.built_at > PROFILE_REFRESH:
+            self.refresh(domain)
+        return profile
+
+    async def put(self, domain: str, result: dict, lists_version: int):
+        if not result["mx_records"] or result["new_domain"] is None:
+            return
+        await self.cache.set(domain, list(astuple(DomainProfile.from_result(result, lists_version))), PROFILE_TTL)
+
+    async def _rebuild(self, domain: str):
+        snapshot = get_snapshot()
+        result = dict(check_domain_in_lists([domain], snapshot)[domain])
+        try:
+            (mx_records, (new_domain, domain_age_in_days)) = await asyncio.gather(timed_mx_lookup(domain), cached_domain_age(domain))
+        except WhoisPending:
+            return  # rebuilt by the next request once the lookup has finished
+        result.update({
+            "mx_records": mx_records,
+            "new_domain": new_domain,
+            "domain_age_in_days": domain_age_in_days,
+            "catch_all": await smtp_verifier.accept_all.get(domain) if mx_records else None,
+            "reputation_penalty": await get_reputation_penalty(domain),
+        })
+        if mx_records:
+            await self.put(domain, result, snapshot.lists_version)
+        else:
+            await self.cache.delete(domain)
+
+    def refresh(self, domain: str) -> asyncio.Task:
+        """
+        Rebuilds the profile in the background unless that's already running.
+        """
+        task = self._refreshing.get(domain)
+        if task is None:
+            task = asyncio.ensure_future(self._rebuild(domain))
+            self._refreshing[domain] = task
+            task.add_done_callback(lambda done: self._refresh_done(domain, done))
+        return task
+
+    def _refresh_done(self, domain: str, task: asyncio.Task):
+        self._refreshing.pop(domain, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Failed to refresh profile of {domain}: {task.exception()}")
+
+    async def close(self):
+        for task in list(self._refreshing.values()):
+            task.cancel()
+
+
+domain_profiles = DomainProfileStore()
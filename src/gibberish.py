@@ -0,0 +1,402 @@
+"""
+Gibberish probability of local parts from a character trigram model: every trigram of the local part
+(with start and end markers) adds the log-likelihood ratio of machine-generated vs human-chosen text,
+and a logistic calibration turns the sum into a probability. The model is a flat int8 table of
+30 x 30 x 30 ratios (letters, one symbol for all digits, one for separators, one for anything else),
+shipped as src/gibberish_model.bin and trained offline:
+
+    python -m src.gibberish train [--natural accepted_local_parts.txt ...] [--output src/gibberish_model.bin]
+    python -m src.gibberish score john.smith krzysztof xk7qzt0pw
+
+Without --natural the human side is words from the Python standard library's sources and a list of
+names from many languages, combined into local-part shapes (name.surname, initials, years); the
+machine side is generated random, hex, keyboard-mash and random-suffix strings. The calibration is
+fit on names left out of the ratio table, benchmarks/bench_gibberish.py checks names from none of
+them. Single local parts are scored in plain Python, lists of them (batch endpoint, bulk CLI) with NumPy.
+"""
+import os
+import re
+import math
+import struct
+import random
+import string
+import argparse
+import sysconfig
+from array import array
+from collections import Counter
+from pathlib import Path as PathLib
+
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+MODEL_PATH = PathLib(os.environ.get("EMAILFILTER_GIBBERISH_MODEL", PathLib(__file__).parent / "gibberish_model.bin"))
+# local parts at or above this probability are reported as gibberish
+GIBBERISH_THRESHOLD = float(os.environ.get("EMAILFILTER_GIBBERISH_THRESHOLD", 0.7))
+
+MAX_LENGTH = 64
+# smaller lists are scored one by one, NumPy's per-call overhead outweighs the vectorized loop
+VECTORIZE_MIN = 16
+# symbol 0 marks the start and the end of the local part
+BOUNDARY, DIGIT, SEPARATOR, OTHER = 0, 27, 28, 29
+SYMBOLS = 30
+
+# magic, symbols, ratio scale, intercept, evidence weight, length weight - followed by SYMBOLS ** 3 int8 ratios
+_HEADER = struct.Struct("<8sHffff")
+_MAGIC = b"EFGIB001"
+
+# share of gibberish local parts assumed by the calibration, the training data is balanced
+GIBBERISH_PRIOR = 0.1
+
+
+def _symbol_table() -> bytes:
+    table = bytearray([OTHER] * 256)
+    for i, char in enumerate(string.ascii_lowercase, start=1):
+        table[ord(char)] = table[ord(char.upper())] = i
+    for char in string.digits:
+        table[ord(char)] = DIGIT
+    for char in "._-":
+        table[ord(char)] = SEPARATOR
+    return bytes(table)
+
+
+SYMBOL_TABLE = _symbol_table()
+
+
+def encode(local: str) -> bytes:
+    """
+    Symbols of a local part: +tag dropped, at most MAX_LENGTH characters.
+    """
+    return local.split("+", 1)[0][:MAX_LENGTH].encode("ascii", "replace").translate(SYMBOL_TABLE)
+
+
+class GibberishModel:
+
+    def __init__(self, ratios: bytes, scale: float, intercept: float, evidence: float, length: float):
+        self.ratios = ratios
+        self.scale = scale
+        self.intercept = intercept
+        self.evidence = evidence
+        self.length = length
+        self._ratios = [value * scale for value in array("b", ratios)]
+        self._array = None  # numpy copy, made by the first batch
+
+    @classmethod
+    def load(cls, path: PathLib = MODEL_PATH) -> "GibberishModel":
+        data = path.read_bytes()
+        magic, symbols, scale, intercept, evidence, length = _HEADER.unpack_from(data)
+        if magic != _MAGIC or symbols != SYMBOLS or len(data) != _HEADER.size + SYMBOLS ** 3:
+            raise ValueError(f"{path} is not a gibberish model for this version")
+        return cls(data[_HEADER.size:], scale, intercept, evidence, length)
+
+    def save(self, path: PathLib = MODEL_PATH):
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_bytes(_HEADER.pack(_MAGIC, SYMBOLS, self.scale, self.intercept, self.evidence, self.length) + self.ratios)
+        os.replace(tmp, path)
+
+    def score(self, symbols: bytes) -> float:
+        """
+        Sum of the trigram log-likelihood ratios, positive is machine-like.
+        """
+        ratios = self._ratios
+        a = b = BOUNDARY
+        total = 0.0
+        for c in symbols:
+            total += ratios[(a * SYMBOLS + b) * SYMBOLS + c]
+            a, b = b, c
+        return total + ratios[(a * SYMBOLS + b) * SYMBOLS + BOUNDARY]
+
+    def _probability(self, total: float, trigrams: int) -> float:
+        z = self.intercept + self.evidence * total + self.length * trigrams
+        return 1 / (1 + math.exp(-max(-50.0, min(50.0, z))))
+
+    def probability(self, local: str) -> float:
+        symbols = encode(local)
+        return self._probability(self.score(symbols), len(symbols) + 1)
+
+    def probabilities(self, local_parts: list) -> list:
+        """
+        probability() of many local parts at once, vectorized over a padded symbol matrix.
+        """
+        if len(local_parts) < VECTORIZE_MIN:
+            return [self.probability(local) for local in local_parts]
+        import numpy as np  # only batches need it, keeps it out of the startup path
+
+        if self._array is None:
+            self._array = np.frombuffer(self.ratios, dtype=np.int8).astype(np.float32) * self.scale
+        encoded = [encode(local) for local in local_parts]
+        lengths = np.fromiter(map(len, encoded), dtype=np.intp, count=len(encoded))
+        width = int(lengths.max()) + 3
+        padded = b"".join(b"\0\0" + symbols + bytes(width - 2 - len(symbols)) for symbols in encoded)
+        ids = np.frombuffer(padded, dtype=np.uint8).reshape(len(encoded), width).astype(np.intp)
+        values = self._array[(ids[:, :-2] * SYMBOLS + ids[:, 1:-1]) * SYMBOLS + ids[:, 2:]]
+        # a local part of n symbols has n + 1 trigrams, the rest is padding
+        values[np.arange(width - 2) > lengths[:, None]] = 0
+        z = self.intercept + self.evidence * values.sum(axis=1, dtype=np.float64) + self.length * (lengths + 1)
+        return (1 / (1 + np.exp(-np.clip(z, -50, 50)))).tolist()
+
+
+_model = None
+
+
+def get_model() -> GibberishModel:
+    global _model
+    if _model is None:
+        _model = GibberishModel.load()
+    return _model
+
+
+def gibberish_probability(local: str) -> float:
+    return get_model().probability(local)
+
+
+def gibberish_probabilities(local_parts: list) -> list:
+    return get_model().probabilities(local_parts)
+
+
+# ---------------------- training ---------------------- #
+
+KEYBOARD_ROWS = ("1234567890", "qwertyuiop", "asdfghjkl", "zxcvbnm")
+
+# given names and surnames of many languages, so their spelling doesn't read as machine-made next to English
+NAMES = """
+james john robert michael william david richard joseph thomas charles mary patricia jennifer linda elizabeth
+smith johnson williams brown jones miller davis wilson anderson taylor moore jackson martin thompson white
+harris clark lewis robinson walker young allen wright scott green baker adams nelson hill campbell mitchell
+muller schmidt schneider fischer weber meyer wagner becker schulz hoffmann schafer koch bauer richter klein
+wolf schroder neumann schwarz zimmermann braun kruger hofmann hartmann lange jurgen gunther wolfgang
+krzysztof grzegorz andrzej tomasz piotr pawel wojciech jakub kowalski nowak wisniewski wojcik kowalczyk
+kaminski lewandowski zielinski szymanski wozniak dabrowski kozlowski jankowski mazur kwiatkowski krawczyk
+strzelczyk przybylski szczepanski brzezinski chrzanowski malgorzata agnieszka katarzyna grazyna
+jiri petr jaroslav miroslav zdenek novak svoboda novotny dvorak cerny prochazka kucera vesely horak
+nguyen tran pham hoang huynh phan dang bui truong ngoc thanh minh tuan huong trang phuong nhung
+wang zhang zhao chen yang huang zhou xiao xu sun zhu qian jiang xiong zheng liang ming qiang xiu
+kim lee park choi jung kang cho yoon jang lim jeon seo hwang song hyun jae eun seong
+sato suzuki takahashi tanaka watanabe ito yamamoto nakamura kobayashi kato yoshida yamada hiroshi
+garcia rodriguez martinez hernandez lopez gonzalez perez sanchez ramirez torres flores rivera gomez diaz
+jose juan luis carlos jorge alejandro maria carmen lucia guadalupe ximena xochitl joaquin
+silva santos oliveira souza rodrigues ferreira alves pereira lima gomes ribeiro carvalho joao goncalves
+rossi russo ferrari esposito bianchi romano colombo ricci marino greco bruno gallo giuseppe giovanni
+dubois durand leroy moreau simon laurent lefebvre michel fournier girard bonnet francois jacques
+jansen janssen devries vandenberg bakker visser smit meijer mulder bos vos dijkstra sjoerd
+ivanov smirnov kuznetsov popov vasiliev petrov sokolov mikhailov fedorov morozov volkov alexei dmitri
+yevgeny vladimir svetlana ekaterina olga natalia zhukov khrushchev tsvetaeva
+nagy kovacs toth szabo horvath varga kiss molnar nemeth farkas balogh gyorgy laszlo zsolt szilvia
+yilmaz kaya demir sahin celik yildiz yildirim ozturk aydin ozdemir arslan dogan mehmet mustafa
+kumar singh sharma patel gupta reddy rao iyer krishnan venkatesh lakshmi srinivasan subramanian
+mohammed ahmed ali hassan hussein abdullah ibrahim khalid fatima aisha omar youssef abdelrahman
+ochieng otieno wanjiru mwangi kamau oluwaseun adebayo chukwuemeka ngozi nkechi olumide
+murphy kelly sullivan walsh byrne ryan oconnor doherty siobhan niamh padraig aoife caoimhe
+llewellyn gwyn rhys dafydd bryn cerys evans hughes
+nielsen hansen pedersen andersen christensen larsen sorensen rasmussen johansson karlsson
+lindqvist bjorn sven ingrid astrid soren henrik
+papadopoulos georgiou konstantinos dimitrios eleftheria cohen levi mizrahi yosef
+jovanovic petrovic nikolic markovic djordjevic stojanovic ilic pavlovic milosevic popovic kovacevic
+babic maric tomic knezevic jankovic savic dragan milan nenad dejan goran zoran marko nikola jelena ivana
+snezana vesna dusan horvat novak kranjec zupan
+ionescu popa dumitru gheorghe radu andrei mihai cristina elena stan dimitrov ivanova nikolov todorov
+hristov georgiev
+nkosi ndlovu mthembu khumalo zulu sithole molefe naidoo mahlangu thandiwe sipho
+demiroglu karaoglu ramasamy murugan palaniappan annamalai thangavel arumugam
+korhonen nieminen makinen hamalainen laine heikkinen koskinen jukka mikko tuomas aleksi
+eoin sean ciaran oisin aisling mcdonagh macnamara
+wei jun jie hui lei yan fang xin hao yong jian ping luo guo gao lin cao peng zeng
+"""
+
+
+def stdlib_words(min_count: int = 5) -> list:
+    """
+    Words from the standard library's sources (tests excluded), as a stand-in for human-chosen text.
+    """
+    counts = Counter()
+    for path in PathLib(sysconfig.get_paths()["stdlib"]).rglob("*.py"):
+        if "test" in path.parts or "tests" in path.parts or "site-packages" in path.parts:
+            continue
+        try:
+            counts.update(re.findall(r"[a-z]{3,12}", path.read_text(errors="ignore").lower()))
+        except OSError:
+            continue
+    return [word for word, count in counts.items() if count >= min_count]
+
+
+def natural_local_parts(words: list, names: list, rng: random.Random, count: int) -> list:
+    def word():
+        return rng.choice(words)
+
+    def name():
+        return rng.choice(names)
+
+    def initial():
+        return rng.choice(string.ascii_lowercase)
+
+    def number():
+        digits = str(rng.randint(1950, 2015)) if rng.random() < 0.5 else str(rng.randint(1, 99))
+        return rng.choice(("", "", ".", "_", "-")) + digits
+
+    shapes = (
+        lambda: name(),
+        lambda: name() + rng.choice(("", ".", "_", "-")) + name(),
+        lambda: name() + rng.choice(("", ".", "_", "-")) + name() + number(),
+        lambda: initial() + rng.choice(("", ".")) + name(),
+        lambda: initial() + name() + number(),
+        lambda: name() + "." + initial(),
+        lambda: name() + number(),
+        lambda: word(),
+        lambda: word() + rng.choice(("", ".", "_", "-")) + word(),
+        lambda: initial() + rng.choice(("", ".")) + word(),
+        lambda: word() + number(),
+        lambda: word() + "." + word() + number(),
+    )
+    return [rng.choice(shapes)() for _ in range(count)]
+
+
+def gibberish_local_parts(words: list, rng: random.Random, count: int) -> list:
+    def keyboard_mash():
+        row = rng.randrange(len(KEYBOARD_ROWS))
+        position = rng.randrange(len(KEYBOARD_ROWS[row]))
+        chars = []
+        for _ in range(rng.randint(6, 14)):
+            row = max(0, min(len(KEYBOARD_ROWS) - 1, row + rng.choice((-1, 0, 0, 1))))
+            position = max(0, min(len(KEYBOARD_ROWS[row]) - 1, position + rng.choice((-1, 1, 1, 2))))
+            chars.append(KEYBOARD_ROWS[row][position])
+        return "".join(chars)
+
+    def random_chars(alphabet: str, low: int, high: int) -> str:
+        return "".join(rng.choices(alphabet, k=rng.randint(low, high)))
+
+    shapes = (
+        lambda: random_chars(string.ascii_lowercase, 6, 16),
+        lambda: random_chars(string.ascii_lowercase + string.digits, 6, 16),
+        lambda: random_chars(string.hexdigits.lower(), 8, 32),
+        lambda: random_chars("bcdfghjklmnpqrstvwxz", 5, 12),
+        keyboard_mash,
+        lambda: rng.choice(words) + rng.choice(("", ".", "_")) + random_chars(string.ascii_lowercase + string.digits, 5, 10),
+        lambda: random_chars(string.ascii_lowercase, 2, 5) + random_chars(string.digits, 3, 8) + random_chars(string.ascii_lowercase, 1, 4),
+    )
+    return [rng.choice(shapes)() for _ in range(count)]
+
+
+def trigram_counts(local_parts: list):
+    import numpy as np
+
+    counts = np.zeros(SYMBOLS ** 3, dtype=np.int64)
+    indexes = []
+    for local in local_parts:
+        a = b = BOUNDARY
+        for c in encode(local) + bytes([BOUNDARY]):
+            indexes.append((a * SYMBOLS + b) * SYMBOLS + c)
+            a, b = b, c
+    np.add.at(counts, np.array(indexes, dtype=np.intp), 1)
+    return counts
+
+
+def log_probabilities(counts, smoothing: float):
+    """
+    log P(c | a b) for every trigram, interpolated with P(c | b) and P(c) so that trigrams the
+    training text never had but that are made of common pairs (unseen surnames) aren't impossible.
+    """
+    import numpy as np
+
+    trigrams = counts.reshape(SYMBOLS, SYMBOLS, SYMBOLS).astype(np.float64) + smoothing
+    bigrams = trigrams.sum(axis=0)
+    unigrams = bigrams.sum(axis=0)
+    p3 = trigrams / trigrams.sum(axis=2, keepdims=True)
+    p2 = bigrams / bigrams.sum(axis=1, keepdims=True)
+    p1 = unigrams / unigrams.sum()
+    return np.log(0.5 * p3 + 0.35 * p2[None, :, :] + 0.15 * p1[None, None, :]).ravel()
+
+
+def ratio_table(natural: list, gibberish: list, smoothing: float) -> GibberishModel:
+    """
+    Uncalibrated model (evidence weight 1) with the quantized log-likelihood ratios of gibberish vs natural.
+    """
+    import numpy as np
+
+    ratios = log_probabilities(trigram_counts(gibberish), smoothing) - log_probabilities(trigram_counts(natural), smoothing)
+    scale = float(np.abs(ratios).max()) / 127
+    return GibberishModel(np.round(ratios / scale).astype(np.int8).tobytes(), scale, 0.0, 1.0, 0.0)
+
+
+def fit_logistic(features, labels, ridge: float, iterations: int = 25):
+    """
+    Logistic regression by Newton's method with an L2 penalty on the feature weights, features get an intercept column.
+    """
+    import numpy as np
+
+    x = np.column_stack([np.ones(len(features)), features])
+    penalty = ridge * np.eye(x.shape[1])
+    penalty[0, 0] = 1e-6
+    weights = np.zeros(x.shape[1])
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(-np.clip(x @ weights, -50, 50)))
+        gradient = x.T @ (labels - p) - penalty @ weights
+        hessian = (x * (p * (1 - p))[:, None]).T @ x + penalty
+        weights += np.linalg.solve(hessian, gradient)
+    return weights
+
+
+def train(natural: list, gibberish: list, held_out_natural: list, held_out_gibberish: list,
+          smoothing: float = 0.5, ridge: float = 100.0) -> GibberishModel:
+    """
+    The calibration is fit on held-out local parts, built from names the ratio table was trained
+    without, so a surname isn't machine-made just because the table never saw it. The shipped
+    table is then rebuilt from all local parts and keeps that calibration.
+    """
+    import numpy as np
+
+    model = ratio_table(natural, gibberish, smoothing)
+    held_out = held_out_natural + held_out_gibberish
+    labels = np.array([0.0] * len(held_out_natural) + [1.0] * len(held_out_gibberish))
+    features = np.array([(model.score(encode(local)), len(encode(local)) + 1) for local in held_out])
+    intercept, evidence, length = fit_logistic(features, labels, ridge)
+
+    predicted = 1 / (1 + np.exp(-(intercept + features @ np.array([evidence, length])))) >= 0.5
+    logger.info(
+        f"Held out: {predicted[labels == 1].mean():.1%} of gibberish and {predicted[labels == 0].mean():.1%} "
+        f"of natural local parts flagged before the prior shift"
+    )
+    model = ratio_table(natural + held_out_natural, gibberish + held_out_gibberish, smoothing)
+    model.intercept = float(intercept + math.log(GIBBERISH_PRIOR / (1 - GIBBERISH_PRIOR)))
+    model.evidence = float(evidence)
+    model.length = float(length)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    train_parser = commands.add_parser("train", help="train the model and write it")
+    train_parser.add_argument("--natural", action="append", default=[], metavar="FILE",
+                              help="real local parts, one per line (repeatable), added to the generated ones")
+    train_parser.add_argument("--samples", type=int, default=200000, help="generated local parts per class")
+    train_parser.add_argument("--seed", type=int, default=42)
+    train_parser.add_argument("--output", type=PathLib, default=MODEL_PATH)
+    score_parser = commands.add_parser("score", help="print the gibberish probability of local parts")
+    score_parser.add_argument("local_parts", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "score":
+        for local, probability in zip(args.local_parts, gibberish_probabilities(args.local_parts)):
+            print(f"{probability:.3f}  {local}")
+        return
+
+    rng = random.Random(args.seed)
+    words = stdlib_words()
+    names = NAMES.split()
+    rng.shuffle(names)
+    # a quarter of the names only appear in the calibration set
+    held_out_names, names = names[:len(names) // 4], names[len(names) // 4:]
+    natural = natural_local_parts(words, names, rng, args.samples)
+    for path in args.natural:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            natural += [line.strip().split("@")[0] for line in f if line.strip()]
+    gibberish = gibberish_local_parts(words, rng, args.samples)
+    held_out_natural = natural_local_parts(words, held_out_names, rng, args.samples // 4)
+    held_out_gibberish = gibberish_local_parts(words, rng, args.samples // 4)
+    logger.info(f"Training on {len(natural)} natural and {len(gibberish)} gibberish local parts ({len(words)} words)")
+    model = train(natural, gibberish, held_out_natural, held_out_gibberish)
+    model.save(args.output)
+    logger.info(f"Wrote {args.output} ({_HEADER.size + len(model.ratios)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
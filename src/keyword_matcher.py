@@ -0,0 +1,93 @@
+from collections import deque
+
+
+def parse_keyword(line: str) -> tuple[str, int | None]:
+    """
+    'casino' -> ('casino', None), 'casino,-30' -> ('casino', -30).
+    """
+    keyword, sep, weight = line.rpartition(",")
+    if sep:
+        try:
+            return keyword.strip().lower(), int(weight)
+        except ValueError:
+            pass
+    return line.strip().lower(), None
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over the spam keywords: one pass over the text finds every keyword,
+    no matter how many keywords there are. Build once per list version, matching is read-only.
+    """
+
+    def __init__(self, keywords: dict[str, int | None]):
+        self.weights = {k: w for k, w in keywords.items() if k}
+        self._goto = [{}]      # state -> {char: next state}
+        self._fail = [0]
+        self._output = [()]    # state -> keywords ending here
+        for keyword in self.weights:
+            self._add(keyword)
+        self._build_links()
+
+    @classmethod
+    def from_lines(cls, lines) -> "KeywordMatcher":
+        return cls(dict(parse_keyword(line) for line in lines if line.strip()))
+
+    def _add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            state = nxt
+        self._output[state] += (keyword,)
+
+    def _build_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._output[nxt] += self._output[self._fail[nxt]]
+
+    def __len__(self):
+        return len(self.weights)
+
+    def find(self, text: str) -> list[str]:
+        """Distinct keywords found in text, in order of first occurrence."""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = {}
+        state = 0
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for keyword in output[state]:
+                found[keyword] = None
+        return list(found)
+
+    def search(self, text: str) -> bool:
+        return bool(self.find(text))
+
+    def penalty(self, matched: list[str], default_weight: int) -> int:
+        """
+        Sum of the weights of the matched keywords, keywords without a weight share
+        a single `default_weight` (the configured spam_keywords score).
+        """
+        total = 0
+        unweighted = False
+        for keyword in matched:
+            weight = self.weights.get(keyword)
+            if weight is None:
+                unweighted = True
+            else:
+                total += weight
+        return total + (default_weight if unweighted else 0)
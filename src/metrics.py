@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import asyncio
+from contextlib import contextmanager
+from pathlib import Path as PathLib
+
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# every worker dumps its metrics here, /metrics merges the files of all live workers
+METRICS_DIR = PathLib(os.environ.get("EMAILFILTER_METRICS_DIR", "/tmp/emailfilter-metrics"))
+METRICS_DUMP_INTERVAL = float(os.environ.get("EMAILFILTER_METRICS_DUMP_INTERVAL", 5))
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """
+    A named metric with label sets. Counters and gauges keep one float per label set,
+    histograms keep cumulative bucket counts followed by sum and count.
+    """
+
+    def __init__(self, name: str, kind: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.samples = {}  # label values tuple -> float | list
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.samples[key] = self.samples.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        sample = self.samples.get(key)
+        if sample is None:
+            sample = self.samples[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                sample[i] += 1
+        sample[-2] += value
+        sample[-1] += 1
+
+    def dump(self) -> dict:
+        return {
+            "kind": self.kind,
+            "help": self.help,
+            "labels": list(self.labels),
+            "buckets": list(self.buckets),
+            "samples": [[list(key), value] for key, value in self.samples.items()],
+        }
+
+
+REGISTRY = {}
+
+def _register(metric: Metric) -> Metric:
+    REGISTRY[metric.name] = metric
+    return metric
+
+STAGE_DURATION = _register(Metric(
+    "emailfilter_stage_duration_seconds", "histogram",
+    "Latency of each filter stage (list_check, mx, smtp, whois, reputation_read, reputation_write, request).",
+    ("stage",),
+))
+CACHE_REQUESTS = _register(Metric(
+    "emailfilter_cache_requests_total", "counter",
+    "Cache lookups by cache and result (hit, shared_hit, miss).",
+    ("cache", "result"),
+))
+VERDICTS = _register(Metric(
+    "emailfilter_verdicts_total", "counter",
+    "Filter verdicts returned.",
+    ("verdict",),
+))
+CHECKS_SKIPPED = _register(Metric(
+    "emailfilter_checks_skipped_total", "counter",
+    "Network checks skipped or cancelled because the verdict was already decided.",
+    ("check",),
+))
+CHECKS_PENDING = _register(Metric(
+    "emailfilter_checks_pending_total", "counter",
+    "Network checks still running at the request deadline, left to finish in the background.",
+    ("check",),
+))
+SMTP_IN_FLIGHT = _register(Metric(
+    "emailfilter_smtp_connections_in_flight", "gauge",
+    "Open SMTP sessions to MX hosts.",
+))
+SMTP_IN_FLIGHT.inc(0)
+REQUESTS_SHED = _register(Metric(
+    "emailfilter_requests_shed_total", "counter",
+    "Requests refused by admission control: 429 when the lane's queue was full, 503 when they queued too long.",
+    ("lane", "status"),
+))
+LANE_WAIT = _register(Metric(
+    "emailfilter_lane_wait_seconds", "histogram",
+    "Time admitted requests waited for a slot in their lane.",
+    ("lane",),
+))
+MX_SKIPPED = _register(Metric(
+    "emailfilter_mx_probes_skipped_total", "counter",
+    "SMTP probes not sent because the MX host's or provider's circuit was open.",
+))
+MX_CIRCUITS_OPENED = _register(Metric(
+    "emailfilter_mx_circuits_opened_total", "counter",
+    "MX host and provider circuits opened after repeated timeouts, errors or greylisting.",
+    ("kind",),
+))
+
+
+@contextmanager
+def time_stage(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+def cache_result(cache: str, result: str):
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+
+
+# ---------------- cross-worker aggregation ---------------- #
+
+def _worker_path(pid: int) -> PathLib:
+    return METRICS_DIR / f"{pid}.json"
+
+
+def dump_worker_metrics():
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    path = _worker_path(os.getpid())
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({name: metric.dump() for name, metric in REGISTRY.items()}))
+    os.replace(tmp, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge_all() -> dict:
+    merged = {}
+    for path in METRICS_DIR.glob("*.json"):
+        try:
+            pid = int(path.stem)
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            path.unlink(missing_ok=True)
+            continue
+        try:
+            worker = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for name, metric in worker.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for key, value in metric["samples"]:
+                key = tuple(key)
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = value
+                elif isinstance(value, list):
+                    target["samples"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["samples"][key] = current + value
+    return merged
+
+
+def _format_labels(names: list, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_metrics() -> str:
+    """
+    Prometheus text exposition of the metrics of all workers.
+    """
+    dump_worker_metrics()
+    lines = []
+    for name, metric in sorted(_merge_all().items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for key, value in sorted(metric["samples"].items()):
+            if metric["kind"] == "histogram":
+                for bound, count in zip(metric["buckets"], value):
+                    labels = _format_labels(metric["labels"], key, f'le="{bound}"')
+                    lines.append(f"{name}_bucket{labels} {count}")
+                labels = _format_labels(metric["labels"], key, 'le="+Inf"')
+                lines.append(f"{name}_bucket{labels} {value[-1]}")
+                labels = _format_labels(metric["labels"], key)
+                lines.append(f"{name}_sum{labels} {value[-2]}")
+                lines.append(f"{name}_count{labels} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(metric['labels'], key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def dump_loop():
+    while True:
+        await asyncio.sleep(METRICS_DUMP_INTERVAL)
+        try:
+            dump_worker_metrics()
+        except Exception as e:
+            logger.warning(f"Failed to write worker metrics: {e}")
+
+
+def remove_worker_metrics():
+    _worker_path(os.getpid()).unlink(missing_ok=True)
@@ -5,3 +5,7 @@ class EmailInput(BaseModel):
 
 class FeedbackInput(BaseModel):
     email: EmailStr
+
+class BulkListInput(BaseModel):
+    add: list[str] = []
+    remove: list[str] = []
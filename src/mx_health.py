@@ -0,0 +1,203 @@
+import os
+import time
+
+from src import metrics
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# consecutive failed probes (timeouts, refused connections, greylisting) that open a circuit
+MX_HEALTH_FAILURES = int(os.environ.get("EMAILFILTER_MX_HEALTH_FAILURES", 5))
+# failures across all hosts of a provider before the whole provider is skipped
+MX_HEALTH_PROVIDER_FAILURES = int(os.environ.get("EMAILFILTER_MX_HEALTH_PROVIDER_FAILURES", 20))
+# seconds an open circuit waits before letting one probe through, doubled after every failed retry
+MX_HEALTH_RETRY = float(os.environ.get("EMAILFILTER_MX_HEALTH_RETRY", 60))
+MX_HEALTH_RETRY_MAX = float(os.environ.get("EMAILFILTER_MX_HEALTH_RETRY_MAX", 3600))
+MX_HEALTH_MAX_HOSTS = int(os.environ.get("EMAILFILTER_MX_HEALTH_MAX_HOSTS", 10000))
+
+# probe outcomes
+MX_OK = "ok"                  # the host answered with a definite verdict
+MX_TIMEOUT = "timeout"
+MX_ERROR = "error"            # refused or dropped connection, protocol errors
+MX_GREYLISTED = "greylisted"  # 4xx, including 421
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+LATENCY_ALPHA = 0.2  # weight of the newest sample in the moving averages
+
+# second-level labels under which providers register their domains (mx.example.co.uk -> example.co.uk)
+SECOND_LEVEL_LABELS = {"co", "com", "net", "org", "ac", "gov", "edu", "ne", "or"}
+
+
+def provider_of(host: str) -> str:
+    """
+    Registered domain of an MX host, hosts of one provider (aspmx.l.google.com, alt1.aspmx.l.google.com)
+    share its circuit.
+    """
+    labels = host.lower().rstrip(".").split(".")
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+class Circuit:
+    """
+    Outcome counters, latency averages and breaker state for one MX host or provider.
+    Closed lets every probe through; open none until retry_at, then half open lets a single
+    probe through - a successful RCPT closes the circuit, a failure opens it again for twice as long.
+    A successful connect is only counted, the RCPT that follows may still be refused or greylisted.
+    """
+
+    def __init__(self, name: str, threshold: int):
+        self.name = name
+        self.threshold = threshold
+        self.state = CLOSED
+        self.failures = 0                # consecutive
+        self.retry_after = MX_HEALTH_RETRY
+        self.retry_at = 0.0
+        self.trial = False               # the half open probe is running
+        self.outcomes = {}               # stage -> outcome -> count
+        self.latency = {}                # stage -> moving average, seconds
+        self.last_error = None
+        self.last_seen = time.time()
+
+    def ready(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return now >= self.retry_at
+        return not self.trial
+
+    def claim(self):
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self.trial = True
+
+    def release(self):
+        self.trial = False
+
+    def record(self, stage: str, outcome: str, latency: float, error: str | None = None) -> bool:
+        """
+        Counts one outcome, returns True when this opened the circuit.
+        """
+        self.last_seen = time.time()
+        counts = self.outcomes.setdefault(stage, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+        previous = self.latency.get(stage)
+        self.latency[stage] = latency if previous is None else previous + LATENCY_ALPHA * (latency - previous)
+        if outcome == MX_OK and stage != "rcpt":
+            return False
+        self.trial = False
+
+        if outcome == MX_OK:
+            if self.state != CLOSED:
+                logger.info(f"MX circuit for {self.name} closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.retry_after = MX_HEALTH_RETRY
+            return False
+
+        self.failures += 1
+        self.last_error = error or outcome
+        if self.state == HALF_OPEN:
+            self.retry_after = min(self.retry_after * 2, MX_HEALTH_RETRY_MAX)
+        elif self.state == OPEN or self.failures < self.threshold:
+            return False
+        self.state = OPEN
+        self.retry_at = time.monotonic() + self.retry_after
+        logger.warning(f"MX circuit for {self.name} opened after {self.failures} failures ({self.last_error}), retrying in {self.retry_after:.0f}s")
+        return True
+
+    def info(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in": round(max(0.0, self.retry_at - time.monotonic()), 1) if self.state == OPEN else None,
+            "outcomes": self.outcomes,
+            "latency_ms": {stage: round(value * 1000, 1) for stage, value in self.latency.items()},
+            "last_error": self.last_error,
+            "last_seen": round(self.last_seen),
+        }
+
+
+class MXHealthRegistry:
+    """
+    Connect and RCPT outcomes per MX host and per provider, kept by every worker for its own probes.
+    SMTPVerifier asks allow() before probing a host and skips it while its circuit (or its
+    provider's) is open, so hosts that tarpit or sit behind a blocked port 25 don't cost a timeout per address.
+    """
+
+    def __init__(self):
+        self.hosts = {}
+        self.providers = {}
+
+    def _circuits(self, host: str) -> tuple[Circuit, Circuit]:
+        circuit = self.hosts.get(host)
+        if circuit is None:
+            if len(self.hosts) >= MX_HEALTH_MAX_HOSTS:
+                self._evict()
+            circuit = self.hosts[host] = Circuit(host, MX_HEALTH_FAILURES)
+        provider = provider_of(host)
+        provider_circuit = self.providers.get(provider)
+        if provider_circuit is None:
+            provider_circuit = self.providers[provider] = Circuit(provider, MX_HEALTH_PROVIDER_FAILURES)
+        return circuit, provider_circuit
+
+    def _evict(self):
+        # healthy hosts that haven't been probed for longest go first
+        oldest = sorted((circuit for circuit in self.hosts.values() if circuit.state == CLOSED), key=lambda circuit: circuit.last_seen)
+        for circuit in oldest[:max(1, len(self.hosts) // 10)]:
+            del self.hosts[circuit.name]
+        used = {provider_of(host) for host in self.hosts}
+        for provider in [provider for provider in self.providers if provider not in used]:
+            del self.providers[provider]
+
+    def allow(self, host: str) -> bool:
+        """
+        Whether host may be probed now. A True for a circuit that isn't closed makes this the
+        retry probe, it has to be followed by record() or release().
+        """
+        now = time.monotonic()
+        circuits = self._circuits(host)
+        if not all(circuit.ready(now) for circuit in circuits):
+            metrics.MX_SKIPPED.inc()
+            return False
+        for circuit in circuits:
+            circuit.claim()
+        return True
+
+    def release(self, host: str):
+        """
+        Ends a probe without an outcome (cancelled), a retry probe can be started again.
+        """
+        for circuit in self._circuits(host):
+            circuit.release()
+
+    def record(self, host: str, stage: str, outcome: str, latency: float, error: str | None = None):
+        """
+        stage is "connect" or "rcpt".
+        """
+        for kind, circuit in zip(("host", "provider"), self._circuits(host)):
+            if circuit.record(stage, outcome, latency, error):
+                metrics.MX_CIRCUITS_OPENED.inc(kind=kind)
+
+    def state(self) -> dict:
+        return {
+            "hosts": {host: circuit.info() for host, circuit in sorted(self.hosts.items())},
+            "providers": {provider: circuit.info() for provider, circuit in sorted(self.providers.items())},
+        }
+
+    def reset(self, host: str | None = None):
+        """
+        Forgets everything about host (and its provider), or about all hosts.
+        """
+        if host is None:
+            self.hosts.clear()
+            self.providers.clear()
+        else:
+            self.hosts.pop(host, None)
+            self.providers.pop(provider_of(host), None)
+
+
+mx_health = MXHealthRegistry()
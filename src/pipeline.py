@@ -0,0 +1,308 @@
+"""
+The scoring pipeline shared by the API and the policy daemon: runs the checks for an address
+and turns the results into a score and verdict.
+"""
+import asyncio
+from dataclasses import dataclass
+
+from src.database import log_domain_check, get_reputation_penalty, reputation_store
+from src.utils_async import (
+    check_domain_in_lists, match_spam_keywords, gibberish_fields, local_gibberish_probabilities,
+    timed_mx_lookup, timed_smtp_check, smtp_fields, cached_domain_age,
+)
+from src.smtp_verifier import smtp_verifier
+from src.domain_age import domain_age_store, WhoisPending
+from src.cache import shared_backend
+from src.domain_profile import DomainProfile, domain_profiles
+from src.snapshot import get_snapshot
+from src.planner import SCORED_CHECKS, ACCEPT_SCORE, gibberish_score, decided_verdict
+from src import metrics
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# every field a filter result can have, in output order (bulk CSV columns, ?fields= names)
+RESULT_FIELDS = (
+    "email", "domain", "verdict", "score", "disposable", "blacklisted", "whitelisted", "mx_exists",
+    "mx_records", "gibberish", "gibberish_probability", "smtp_valid", "smtp_unknown", "catch_all", "new_domain",
+    "domain_age_in_days", "spam_keywords", "spam_keywords_matched", "reputation_penalty", "skipped_checks",
+    "pending_checks", "error",
+)
+
+
+def result_fields(fields: str) -> tuple:
+    """
+    Field names of a comma separated projection like "verdict,score". Raises ValueError for unknown names.
+    """
+    names = tuple(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [name for name in names if name not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}, available: {', '.join(RESULT_FIELDS)}")
+    return names
+
+
+def project(result: dict, fields: tuple | None, keep: tuple = ()) -> dict:
+    """
+    The result reduced to keep + fields (the fields it has), or the whole result when fields is None.
+    """
+    if fields is None:
+        return result
+    return {name: result[name] for name in (*keep, *fields) if name in result}
+
+
+def calculate_score(result: dict, snapshot=None) -> tuple[int, str]:
+    """
+    Applies the scoring weights to the collected check results and returns (score, verdict).
+    Spam keywords add their own weights, unweighted ones share the spam_keywords score.
+    Skipped checks (None) don't count, an SMTP probe nobody answered scores smtp_unknown and
+    gibberish is weighted by its probability.
+    """
+    snapshot = snapshot or get_snapshot()
+    scores = snapshot.scores
+    score = scores["base"]
+    for check in SCORED_CHECKS:
+        if result[check]:
+            score += scores[check]
+    if result.get("smtp_unknown"):
+        score += scores["smtp_unknown"]
+    score += gibberish_score(result, scores)
+    score += snapshot.spam_matcher.penalty(result["spam_keywords_matched"], scores["spam_keywords"])
+    score += result["reputation_penalty"]
+    score = max(0, min(100, round(score)))
+    verdict = "accepted" if score >= ACCEPT_SCORE else "rejected"
+    return score, verdict
+
+
+NETWORK_CHECKS = ("mx", "smtp", "whois")
+
+# checks that outlived their request's deadline, kept referenced until they finish
+background_checks = set()
+
+
+async def complete_check(email: str, check: str, task: asyncio.Future):
+    try:
+        mx_records = await task
+        if check == "mx" and mx_records:
+            await timed_smtp_check(email, mx_records)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.debug(f"Background {check} check for {email} failed: {e}")
+
+
+def finish_in_background(email: str, tasks: dict):
+    """
+    Lets checks that missed the deadline run to completion so their results land in the caches
+    (an MX lookup is followed by the SMTP probe).
+    """
+    for task, check in tasks.items():
+        background = asyncio.ensure_future(complete_check(email, check, task))
+        background_checks.add(background)
+        background.add_done_callback(background_checks.discard)
+
+
+async def run_network_checks(email: str, domain: str, result: dict, snapshot, full: bool = False, deadline: float | None = None, smtp_slots: asyncio.Semaphore | None = None) -> tuple[list, list]:
+    """
+    Runs MX (then SMTP) and WHOIS concurrently and fills their fields in result as they finish,
+    fields already filled in (from a domain profile) are not checked again. Unless full is set,
+    checks that can no longer change the verdict are not started, or cancelled if already running
+    (MX and WHOIS lookups still finish in the background and fill the caches).
+    Checks still running at the deadline (loop time) are left to finish in the background, so is
+    a first WHOIS lookup that takes longer than WHOIS_WAIT_MS. smtp_slots bounds the SMTP probes of a batch.
+    Returns (skipped, pending) check names, their fields stay None.
+    """
+    async def smtp_check(mx_records: list):
+        if smtp_slots is None:
+            return await timed_smtp_check(email, mx_records)
+        async with smtp_slots:
+            return await timed_smtp_check(email, mx_records)
+
+    loop = asyncio.get_running_loop()
+    tasks = {}
+    finished = set()
+    if result["mx_exists"] is not None:
+        finished.add("mx")
+        if not result["mx_records"] or result["smtp_unknown"] is not None:
+            finished.add("smtp")
+    if result["new_domain"] is not None:
+        finished.add("whois")
+    pending = []
+    try:
+        if full or decided_verdict(result, snapshot) is None:
+            if "mx" not in finished:
+                tasks[asyncio.ensure_future(timed_mx_lookup(domain))] = "mx"
+            elif "smtp" not in finished:
+                tasks[asyncio.ensure_future(smtp_check(result["mx_records"]))] = "smtp"
+            if "whois" not in finished:
+                tasks[asyncio.ensure_future(cached_domain_age(domain))] = "whois"
+
+        while tasks:
+            timeout = None if deadline is None else max(0, deadline - loop.time())
+            done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                pending = [check for check in NETWORK_CHECKS if check not in finished]
+                finish_in_background(email, tasks)
+                tasks = {}
+                break
+            for task in done:
+                check = tasks.pop(task)
+                finished.add(check)
+                if check == "mx":
+                    mx_records = task.result()
+                    result["mx_exists"] = bool(mx_records)
+                    result["mx_records"] = mx_records
+                    if mx_records:
+                        tasks[asyncio.ensure_future(smtp_check(mx_records))] = "smtp"
+                    else:
+                        result["smtp_valid"], result["smtp_unknown"] = False, False
+                        finished.add("smtp")
+                elif check == "smtp":
+                    result.update(smtp_fields(*task.result()))
+                else:
+                    try:
+                        result["new_domain"], result["domain_age_in_days"] = task.result()
+                    except WhoisPending:
+                        finished.discard("whois")
+                        pending.append("whois")
+            if not full and tasks and decided_verdict(result, snapshot) is not None:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    skipped = [check for check in NETWORK_CHECKS if check not in finished and check not in pending]
+    for check in skipped:
+        metrics.CHECKS_SKIPPED.inc(check=check)
+    for check in pending:
+        metrics.CHECKS_PENDING.inc(check=check)
+    return skipped, pending
+
+
+def address_checks(email: str, domain: str, snapshot, gibberish_probability: float | None = None, check_in_list: dict | None = None) -> dict:
+    """
+    The checks that only need memory (lists, gibberish, spam keywords). Returns the result
+    with every other field None - picklable, so it can run in a process pool. Batches pass
+    gibberish_probability from one local_gibberish_probabilities() call and check_in_list
+    from one check_domain_in_lists() call.
+    """
+    if gibberish_probability is None:
+        gibberish_probability = local_gibberish_probabilities([email])[0]
+    if check_in_list is None:
+        check_in_list = check_domain_in_lists([domain], snapshot)[domain]
+    spam_keywords = match_spam_keywords(email, snapshot)
+    # network fields stay None until their check has run
+    return {
+        "email": email,
+        "domain": domain,
+        "disposable": check_in_list["disposable"],
+        "blacklisted": check_in_list["blacklisted"],
+        "whitelisted": check_in_list["whitelisted"],
+        "mx_exists": None,
+        "mx_records": None,
+        **gibberish_fields(gibberish_probability),
+        "smtp_valid": None,
+        "smtp_unknown": None,
+        "catch_all": None,
+        "new_domain": None,
+        "domain_age_in_days": None,
+        "spam_keywords": bool(spam_keywords),
+        "spam_keywords_matched": spam_keywords,
+        "reputation_penalty": None,
+    }
+
+
+async def _domain_age(domain: str) -> tuple | None:
+    try:
+        return await cached_domain_age(domain)
+    except WhoisPending:
+        return None
+
+
+@dataclass(slots=True)
+class DomainStage:
+    """
+    The domain-level part of a result, shared by every address at the domain.
+    """
+    fields: dict
+    profile: DomainProfile | None = None
+    saved: bool = False  # a profile was written for the domain by one of its addresses
+
+
+async def domain_checks(domain: str, snapshot, full: bool = False, count: int = 1, log_check: bool = True, lookups: bool = False) -> DomainStage:
+    """
+    Domain-level results: all of them from the domain profile for hot domains, otherwise the reputation
+    penalty - and with lookups also MX and WHOIS, so a batch runs them once per domain instead of leaving
+    them to run_network_checks() for every address. count is how many addresses are logged as checked.
+    """
+    if log_check:
+        log_domain_check(domain, count)
+    profile = None if full else await domain_profiles.get(domain)
+    if profile is not None:
+        return DomainStage(profile.fields(domain, snapshot), profile)
+    if not lookups:
+        return DomainStage({"reputation_penalty": await get_reputation_penalty(domain)})
+    mx_records, domain_age, reputation_penalty = await asyncio.gather(
+        timed_mx_lookup(domain), _domain_age(domain), get_reputation_penalty(domain),
+    )
+    fields = {"mx_exists": bool(mx_records), "mx_records": mx_records, "reputation_penalty": reputation_penalty}
+    # a pending WHOIS is left to run_network_checks, which waits on the same lookup and reports it
+    if domain_age is not None:
+        fields["new_domain"], fields["domain_age_in_days"] = domain_age
+    if not mx_records:
+        fields.update(smtp_valid=False, smtp_unknown=False)
+    return DomainStage(fields)
+
+
+async def complete_evaluation(
+    result: dict, snapshot, full: bool = False, deadline: float | None = None, log_check: bool = True,
+    domain_stage: DomainStage | None = None, smtp_slots: asyncio.Semaphore | None = None,
+) -> dict:
+    """
+    Adds the domain-level and network results to an address_checks() result, then the score and verdict.
+    Batches pass the domain_stage shared by the domain's addresses (logged there) and smtp_slots.
+    Returns the result with its fields in RESULT_FIELDS order.
+    """
+    email, domain = result["email"], result["domain"]
+    if domain_stage is None:
+        domain_stage = await domain_checks(domain, snapshot, full, log_check=log_check)
+    result.update(domain_stage.fields)
+
+    result["skipped_checks"], result["pending_checks"] = await run_network_checks(email, domain, result, snapshot, full, deadline, smtp_slots)
+    if (
+        domain_stage.profile is None and not domain_stage.saved
+        and not {"mx", "whois"} & set(result["skipped_checks"] + result["pending_checks"])
+    ):
+        domain_stage.saved = True
+        await domain_profiles.put(domain, result, snapshot.lists_version)
+    result["score"], result["verdict"] = calculate_score(result, snapshot)
+    metrics.VERDICTS.inc(verdict=result["verdict"])
+    logger.debug(f"Filter result for {email} - score: {result['score']}, verdict: {result['verdict']}, skipped: {result['skipped_checks']}, pending: {result['pending_checks']}")
+    return {name: result[name] for name in RESULT_FIELDS if name in result}
+
+
+async def evaluate_email(email: str, domain: str, full: bool = False, deadline_ms: int | None = None) -> dict:
+    """
+    Runs the checks for a single address and returns the result with score and verdict.
+    Domain-level results come from the domain profile when there is one, otherwise the reputation
+    lookup runs first. Network checks run only as long as they can still change the verdict -
+    full=True runs all of them and ignores profiles. With deadline_ms the result is returned after
+    at most that long, checks that didn't finish are listed in pending_checks and the score is
+    computed from the rest.
+    """
+    deadline = None if deadline_ms is None else asyncio.get_running_loop().time() + deadline_ms / 1000
+    snapshot = get_snapshot()
+    #todo: make the reputation log optional for prod
+    return await complete_evaluation(address_checks(email, domain, snapshot), snapshot, full, deadline)
+
+
+def start_pipeline():
+    reputation_store.start()
+
+
+async def close_pipeline():
+    for task in list(background_checks):
+        task.cancel()
+    await domain_profiles.close()
+    await reputation_store.close()
+    await smtp_verifier.close()
+    await domain_age_store.close()
+    await shared_backend.close()
@@ -0,0 +1,78 @@
+"""
+Score bounds for partially evaluated addresses. Checks that haven't run yet are None in the result;
+once the worst and the best possible score fall on the same side of ACCEPT_SCORE the verdict
+can't change any more and the remaining (network) checks can be skipped.
+"""
+
+ACCEPT_SCORE = 60
+REPUTATION_PENALTY_MIN = -50  # see database.calculate_penalty
+
+# gibberish is scored by its probability, see gibberish_score()
+SCORED_CHECKS = ("mx_exists", "smtp_valid", "whitelisted", "new_domain", "disposable", "blacklisted")
+
+
+def _clamp(score: float) -> int:
+    return max(0, min(100, round(score)))
+
+
+def gibberish_score(result: dict, scores) -> float:
+    """
+    The gibberish weight scaled by the local part's gibberish probability.
+    """
+    return scores["gibberish"] * result["gibberish_probability"]
+
+
+def _outcomes(result: dict, check: str, scores) -> tuple:
+    """
+    The weights a check can still add: the one it added, or every possible one if it hasn't run.
+    SMTP can also end up unknown (smtp_unknown).
+    """
+    value = result.get(check)
+    if check == "smtp_valid":
+        if result.get("smtp_unknown"):
+            return (scores["smtp_unknown"],)
+        if value is None:
+            return (0, scores["smtp_unknown"], scores[check])
+    if value is None:
+        return (0, scores[check])
+    return (scores[check] if value else 0,)
+
+
+def score_bounds(result: dict, snapshot) -> tuple[int, int]:
+    """
+    (worst, best) final score given what is known so far.
+    """
+    scores = snapshot.scores
+    worst = best = scores["base"]
+    for check in SCORED_CHECKS:
+        outcomes = _outcomes(result, check, scores)
+        worst += min(outcomes)
+        best += max(outcomes)
+
+    gibberish = gibberish_score(result, scores)
+    worst += gibberish
+    best += gibberish
+
+    spam = snapshot.spam_matcher.penalty(result.get("spam_keywords_matched") or [], scores["spam_keywords"])
+    worst += spam
+    best += spam
+
+    penalty = result.get("reputation_penalty")
+    if penalty is None:
+        worst += REPUTATION_PENALTY_MIN
+    else:
+        worst += penalty
+        best += penalty
+    return _clamp(worst), _clamp(best)
+
+
+def decided_verdict(result: dict, snapshot) -> str | None:
+    """
+    The verdict if the checks still missing can no longer change it, else None.
+    """
+    worst, best = score_bounds(result, snapshot)
+    if worst >= ACCEPT_SCORE:
+        return "accepted"
+    if best < ACCEPT_SCORE:
+        return "rejected"
+    return None
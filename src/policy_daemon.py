@@ -0,0 +1,182 @@
+"""
+Long-running socket daemon for mail servers, runs the scoring pipeline in-process:
+
+  postfix - Postfix policy delegation protocol (check_policy_service), name=value lines ending
+            with an empty line, answered with action=... Connections are reused by Postfix.
+  line    - one address per line (plain or "MAIL FROM:<address>"), answered with "<verdict> <score>",
+            for Exim ${readsocket ...} and the PMG milter script.
+
+    python -m src.policy_daemon --postfix unix:/run/emailfilter/policy.sock --line 127.0.0.1:10041
+"""
+import os
+import re
+import signal
+import asyncio
+import argparse
+
+from pydantic import ValidationError
+
+from src.models import EmailInput
+from src.database import init_db
+from src.pipeline import evaluate_email, start_pipeline, close_pipeline
+from src.warmup import warm_up
+from src import metrics
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# answers are sent after at most this long, unfinished checks complete in the background
+POLICY_DEADLINE_MS = int(os.environ.get("EMAILFILTER_POLICY_DEADLINE_MS", 3000))
+# postfix attribute holding the address to check
+POLICY_ATTRIBUTE = os.environ.get("EMAILFILTER_POLICY_ATTRIBUTE", "sender")
+POLICY_REJECT = os.environ.get("EMAILFILTER_POLICY_REJECT", "REJECT 5.7.1 Sender address rejected by emailfilter")
+# action for accepted addresses, and when the address can't be checked (empty sender, errors)
+POLICY_ACCEPT = os.environ.get("EMAILFILTER_POLICY_ACCEPT", "DUNNO")
+POLICY_ON_ERROR = os.environ.get("EMAILFILTER_POLICY_ON_ERROR", "DUNNO")
+# permissions of unix sockets (octal), the MTA's user has to be the owner or in the group
+POLICY_SOCKET_MODE = int(os.environ.get("EMAILFILTER_POLICY_SOCKET_MODE", "660"), 8)
+# bytes per request line / attributes per postfix request, anything longer is a broken client
+MAX_LINE = 8192
+MAX_ATTRIBUTES = 100
+
+MAIL_FROM = re.compile(r"^MAIL FROM:\s*<([^>]*)>", re.IGNORECASE)
+
+
+async def check_address(address: str) -> dict | None:
+    """
+    Filter result for an address, None when it isn't a valid address.
+    """
+    try:
+        email = EmailInput(email=address).email
+    except ValidationError:
+        return None
+    domain = email.split("@")[1].lower()
+    with metrics.time_stage("request"):
+        return await evaluate_email(email, domain, deadline_ms=POLICY_DEADLINE_MS)
+
+
+async def postfix_action(attributes: dict) -> str:
+    address = attributes.get(POLICY_ATTRIBUTE, "").strip()
+    if not address:
+        return POLICY_ACCEPT  # null sender (bounces) or attribute not sent at this stage
+    try:
+        result = await check_address(address)
+    except Exception as e:
+        logger.error(f"Policy check failed for {address}: {e}")
+        return POLICY_ON_ERROR
+    if result is None:
+        logger.debug(f"Not a valid address, can't check: {address}")
+        return POLICY_ON_ERROR
+    return POLICY_REJECT if result["verdict"] == "rejected" else POLICY_ACCEPT
+
+
+async def line_reply(line: str) -> str:
+    match = MAIL_FROM.match(line)
+    address = match.group(1) if match else line
+    try:
+        result = await check_address(address.strip())
+    except Exception as e:
+        logger.error(f"Line check failed for {address}: {e}")
+        return "error"
+    if result is None:
+        return "invalid 0"
+    return f"{result['verdict']} {result['score']}"
+
+
+async def read_line(reader: asyncio.StreamReader) -> str | None:
+    line = await reader.readline()  # ValueError past MAX_LINE
+    if not line:
+        return None
+    return line.decode("utf-8", "replace").rstrip("\r\n")
+
+
+async def handle_postfix(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            attributes = {}
+            while True:
+                line = await read_line(reader)
+                if line is None:
+                    return
+                if not line:
+                    break
+                name, _, value = line.partition("=")
+                attributes[name] = value
+                if len(attributes) > MAX_ATTRIBUTES:
+                    raise ValueError("too many attributes")
+            writer.write(f"action={await postfix_action(attributes)}\n\n".encode())
+            await writer.drain()
+    except (ConnectionError, ValueError) as e:
+        logger.debug(f"Policy client disconnected: {e}")
+    finally:
+        writer.close()
+
+
+async def handle_line(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            line = await read_line(reader)
+            if line is None:
+                return
+            if line.strip():
+                writer.write(f"{await line_reply(line)}\n".encode())
+                await writer.drain()
+    except (ConnectionError, ValueError) as e:
+        logger.debug(f"Line client disconnected: {e}")
+    finally:
+        writer.close()
+
+
+async def listen(address: str, handler) -> asyncio.AbstractServer:
+    """
+    address is unix:/path/to/socket or host:port
+    """
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(handler, path, limit=MAX_LINE + 2)
+        os.chmod(path, POLICY_SOCKET_MODE)
+    else:
+        host, _, port = address.rpartition(":")
+        server = await asyncio.start_server(handler, host or "127.0.0.1", int(port), limit=MAX_LINE + 2)
+    logger.info(f"Listening on {address} ({handler.__name__})")
+    return server
+
+
+async def serve(postfix: list, line: list):
+    init_db()
+    start_pipeline()
+    await warm_up()  # MTAs connect as soon as the socket exists, don't answer their first queries cold
+    servers = [await listen(address, handle_postfix) for address in postfix]
+    servers += [await listen(address, handle_line) for address in line]
+    metrics_task = asyncio.create_task(metrics.dump_loop())
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Shutting down")
+        for server in servers:
+            server.close()
+        metrics_task.cancel()
+        metrics.remove_worker_metrics()
+        await close_pipeline()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EmailFilter policy daemon for Postfix, Exim and PMG.")
+    parser.add_argument("--postfix", action="append", default=[], metavar="ADDRESS",
+                        help="Postfix policy listener, unix:/path or host:port (repeatable)")
+    parser.add_argument("--line", action="append", default=[], metavar="ADDRESS",
+                        help="line protocol listener, unix:/path or host:port (repeatable)")
+    args = parser.parse_args()
+    if not args.postfix and not args.line:
+        parser.error("at least one --postfix or --line listener is required")
+    asyncio.run(serve(args.postfix, args.line))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Response encoding: JSON is written with orjson, clients that prefer MessagePack get it by sending
+Accept: application/msgpack (needs the optional msgpack package), and filter results can be
+reduced to the fields a caller needs with ?fields=verdict,score. Batch results use the same
+encoders: one NDJSON line or one MessagePack object per address.
+"""
+import contextvars
+import importlib.util
+
+import orjson
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+
+from src.pipeline import result_fields
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack", "application/vnd.msgpack")
+JSON_TYPES = (JSON, "application/*", "*/*")
+
+MSGPACK_AVAILABLE = importlib.util.find_spec("msgpack") is not None
+
+# kept in every projected batch result, they tie a result to its address
+BATCH_KEEP_FIELDS = ("email", "error")
+
+# format negotiated for the running request, JSON or MSGPACK
+response_format = contextvars.ContextVar("emailfilter_response_format", default=JSON)
+
+
+def _default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def ndjson_line(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def packb(content) -> bytes:
+    try:
+        import msgpack
+    except ImportError:
+        raise RuntimeError("MessagePack output needs the msgpack package: pip install msgpack")
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+def negotiate(accept: str) -> str:
+    """
+    MSGPACK when the Accept header ranks a MessagePack type above JSON, else JSON.
+    """
+    if not MSGPACK_AVAILABLE or "msgpack" not in accept:
+        return JSON
+    json_q = msgpack_q = 0.0
+    for item in accept.split(","):
+        media_type, *params = (part.strip() for part in item.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    pass
+        if media_type in MSGPACK_TYPES:
+            msgpack_q = max(msgpack_q, q)
+        elif media_type in JSON_TYPES:
+            json_q = max(json_q, q)
+    return MSGPACK if msgpack_q > json_q else JSON
+
+
+def batch_encoder(fmt: str):
+    """
+    (encode one result, media type) of a streamed batch in the given format.
+    """
+    if fmt == MSGPACK:
+        return packb, MSGPACK
+    return ndjson_line, NDJSON
+
+
+class EncodedResponse(Response):
+    """
+    The app's default response class: orjson, or MessagePack when the request negotiated it.
+    """
+    media_type = JSON
+
+    def render(self, content) -> bytes:
+        if response_format.get() == MSGPACK:
+            self.media_type = MSGPACK
+            return packb(content)
+        return dumps(content)
+
+
+class NegotiatedRoute(APIRoute):
+    """
+    Sets response_format from the Accept header while the endpoint runs and its response is built.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def negotiated(request: Request) -> Response:
+            token = response_format.set(negotiate(request.headers.get("accept", "")))
+            try:
+                response = await handler(request)
+            finally:
+                response_format.reset(token)
+            response.headers.append("Vary", "Accept")
+            return response
+
+        return negotiated
+
+
+def parse_fields(fields: str | None) -> tuple | None:
+    """
+    The ?fields= projection of a request, None for the whole result. Unknown names are a 400.
+    """
+    if not fields:
+        return None
+    try:
+        return result_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {e}")
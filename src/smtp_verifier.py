@@ -0,0 +1,312 @@
+import os
+import time
+import uuid
+import asyncio
+
+from src.cache import TieredCache
+from src.metrics import SMTP_IN_FLIGHT
+from src.admission import FairSemaphore, stage
+from src.mx_health import mx_health, MX_OK, MX_TIMEOUT, MX_ERROR, MX_GREYLISTED
+
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+SMTP_PORT = int(os.environ.get("EMAILFILTER_SMTP_PORT", 25))
+SMTP_TIMEOUT = float(os.environ.get("EMAILFILTER_SMTP_TIMEOUT", 2))
+SMTP_HELO_HOSTNAME = os.environ.get("EMAILFILTER_SMTP_HELO", "emailfilter.pejcic.rs")
+SMTP_MAIL_FROM = os.environ.get("EMAILFILTER_SMTP_MAIL_FROM", "noreply@emailfilter.pejcic.rs")
+SMTP_SESSIONS_PER_HOST = int(os.environ.get("EMAILFILTER_SMTP_SESSIONS_PER_HOST", 2))    # also the per-host concurrency cap
+SMTP_RCPT_PER_SESSION = int(os.environ.get("EMAILFILTER_SMTP_RCPT_PER_SESSION", 20))     # reconnect after this many RCPTs
+SMTP_RATE_PER_HOST = float(os.environ.get("EMAILFILTER_SMTP_RATE_PER_HOST", 10))         # RCPT commands per second
+SMTP_SESSION_IDLE = float(os.environ.get("EMAILFILTER_SMTP_SESSION_IDLE", 30))           # seconds before an idle session is dropped
+
+# verdicts returned by SMTPVerifier.verify
+SMTP_VALID = "valid"
+SMTP_INVALID = "invalid"
+SMTP_TEMPFAIL = "tempfail"
+SMTP_ERROR = "error"
+
+# how long verdicts are cached per address, and accept-all flags per domain
+SMTP_CACHE_SIZE = int(os.environ.get("EMAILFILTER_SMTP_CACHE_SIZE", 100000))
+SMTP_VALID_TTL = float(os.environ.get("EMAILFILTER_SMTP_VALID_TTL", 86400))
+SMTP_INVALID_TTL = float(os.environ.get("EMAILFILTER_SMTP_INVALID_TTL", 21600))
+SMTP_TEMPFAIL_TTL = float(os.environ.get("EMAILFILTER_SMTP_TEMPFAIL_TTL", 300))
+SMTP_ACCEPT_ALL_TTL = float(os.environ.get("EMAILFILTER_SMTP_ACCEPT_ALL_TTL", 86400))
+
+SMTP_TTLS = {
+    SMTP_VALID: SMTP_VALID_TTL,
+    SMTP_INVALID: SMTP_INVALID_TTL,
+    SMTP_TEMPFAIL: SMTP_TEMPFAIL_TTL,
+    SMTP_ERROR: SMTP_TEMPFAIL_TTL,
+}
+
+
+def probe_outcome(error: Exception) -> str:
+    # aiosmtplib's timeouts are TimeoutError subclasses
+    return MX_TIMEOUT if isinstance(error, TimeoutError) else MX_ERROR
+
+
+class RateLimiter:
+    """
+    Token bucket, `rate` acquisitions per second with bursts up to `rate`.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SMTPSession:
+    """
+    One open connection to an MX with HELO done, reused for several RCPT TO commands.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float):
+        import aiosmtplib  # imported with the first probe (or by the warm-up), not at startup
+        self.host = host
+        self.smtp = aiosmtplib.SMTP(hostname=host, port=port, timeout=timeout, local_hostname=SMTP_HELO_HOSTNAME)
+        self.rcpt_count = 0
+        self.last_used = time.monotonic()
+        self.opened = False
+
+    async def open(self):
+        await self.smtp.connect()
+        self.opened = True
+        SMTP_IN_FLIGHT.inc()
+        try:
+            await self.smtp.helo()
+        except BaseException:
+            # also on cancellation, the session is in an unknown state
+            self.abort()
+            raise
+
+    async def rcpt(self, email: str) -> int:
+        import aiosmtplib
+        if self.rcpt_count:
+            await self.smtp.rset()
+        self.rcpt_count += 1
+        self.last_used = time.monotonic()
+        await self.smtp.mail(SMTP_MAIL_FROM)
+        try:
+            response = await self.smtp.rcpt(email)
+            return response.code
+        except aiosmtplib.SMTPRecipientRefused as e:
+            return e.code
+
+    @property
+    def reusable(self) -> bool:
+        return (
+            self.smtp.is_connected
+            and self.rcpt_count < SMTP_RCPT_PER_SESSION
+            and time.monotonic() - self.last_used < SMTP_SESSION_IDLE
+        )
+
+    def abort(self):
+        self.smtp.close()
+        if self.opened:
+            self.opened = False
+            SMTP_IN_FLIGHT.dec()
+
+    async def close(self):
+        try:
+            if self.smtp.is_connected:
+                await self.smtp.quit()
+        except Exception:
+            pass
+        self.abort()
+
+
+class MXHostPool:
+    """
+    Idle sessions, concurrency cap and rate limit for a single MX host.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.idle = []
+        self.slots = FairSemaphore(SMTP_SESSIONS_PER_HOST)   # shared by the lanes, see src/admission.py
+        self.limiter = RateLimiter(SMTP_RATE_PER_HOST)
+
+    async def _session(self, reuse: bool = True) -> SMTPSession:
+        """
+        An idle session, or a new one - connect outcomes go to the MX health registry.
+        """
+        while reuse and self.idle:
+            session = self.idle.pop()
+            if session.reusable:
+                return session
+            await session.close()
+        started = time.monotonic()
+        session = SMTPSession(self.host, self.port, self.timeout)
+        try:
+            await session.open()
+        except Exception as e:
+            mx_health.record(self.host, "connect", probe_outcome(e), time.monotonic() - started, repr(e))
+            raise
+        mx_health.record(self.host, "connect", MX_OK, time.monotonic() - started)
+        return session
+
+    async def _rcpt(self, session: SMTPSession, email: str, record_failure: bool = True) -> int:
+        started = time.monotonic()
+        try:
+            code = await session.rcpt(email)
+        except BaseException as e:
+            session.abort()
+            if record_failure and isinstance(e, Exception):
+                mx_health.record(self.host, "rcpt", probe_outcome(e), time.monotonic() - started, repr(e))
+            raise
+        if 400 <= code < 500:
+            mx_health.record(self.host, "rcpt", MX_GREYLISTED, time.monotonic() - started, f"RCPT answered {code}")
+        else:
+            mx_health.record(self.host, "rcpt", MX_OK, time.monotonic() - started)
+        return code
+
+    async def rcpt(self, email: str) -> int:
+        """
+        RCPT TO on an idle or new session, connect and RCPT outcomes go to the MX health registry.
+        A reused session that fails (usually closed by the server while idle) is retried once on a
+        new connection before it counts as a failure.
+        """
+        async with self.slots:
+            await self.limiter.acquire()
+            session = await self._session()
+            if session.rcpt_count:
+                try:
+                    code = await self._rcpt(session, email, record_failure=False)
+                except Exception as e:
+                    logger.debug(f"Reused session to {self.host} failed ({e!r}), retrying on a new connection")
+                    session = await self._session(reuse=False)
+                    code = await self._rcpt(session, email)
+            else:
+                code = await self._rcpt(session, email)
+            if session.reusable and code != 421:
+                self.idle.append(session)
+            else:
+                await session.close()
+            return code
+
+    async def close(self):
+        while self.idle:
+            await self.idle.pop().close()
+
+
+class SMTPVerifier:
+    """
+    RCPT TO verification with per-MX session pools. MX hosts are tried in the order given
+    (preference order), the next one is used when a host can't be reached or answers 421.
+    Hosts whose circuit is open in the MX health registry are not tried at all.
+    """
+
+    def __init__(self, port: int = SMTP_PORT, timeout: float = SMTP_TIMEOUT):
+        self.port = port
+        self.timeout = timeout
+        self.pools = {}
+        self.results = TieredCache("smtp", SMTP_CACHE_SIZE)                   # address (or @domain for its probe) -> verdict
+        self.accept_all = TieredCache("smtp_accept_all", SMTP_CACHE_SIZE)     # domain -> bool
+        self._accept_all_probes = {}                   # domain -> in-flight detection task
+
+    def pool(self, host: str) -> MXHostPool:
+        if host not in self.pools:
+            self.pools[host] = MXHostPool(host, self.port, self.timeout)
+        return self.pools[host]
+
+    async def verify(self, email: str, mx_records: list) -> tuple[str, int | None]:
+        """
+        Returns (verdict, smtp code), verdict is one of SMTP_VALID, SMTP_INVALID, SMTP_TEMPFAIL or SMTP_ERROR
+        (no host answered or every circuit was open).
+        """
+        for mx_host in mx_records:
+            if not mx_health.allow(mx_host):
+                logger.debug(f"Skipping {mx_host} for {email}, circuit open")
+                continue
+            try:
+                async with stage("smtp"):
+                    code = await self.pool(mx_host).rcpt(email)
+            except Exception as e:
+                logger.debug(f"SMTP probe via {mx_host} failed for {email}: {e!r}")
+                continue
+            finally:
+                mx_health.release(mx_host)
+            if code == 421:
+                logger.debug(f"{mx_host} is unavailable (421), trying next MX")
+                continue
+            if code in (250, 251):
+                return SMTP_VALID, code
+            if 400 <= code < 500:
+                return SMTP_TEMPFAIL, code
+            return SMTP_INVALID, code
+        return SMTP_ERROR, None
+
+    async def _detect_accept_all(self, domain: str, mx_records: list) -> str:
+        verdict, _ = await self.verify(f"emailfilter-{uuid.uuid4().hex[:16]}@{domain}", mx_records)
+        if verdict in (SMTP_VALID, SMTP_INVALID):
+            await self.accept_all.set(domain, verdict == SMTP_VALID, SMTP_ACCEPT_ALL_TTL)
+            logger.debug(f"Accept-all for {domain}: {verdict == SMTP_VALID}")
+        else:
+            # undecided (greylisted or no answer), kept like a tempfail verdict so the host isn't probed per address
+            await self.results.set(f"@{domain}", verdict, SMTP_TTLS[verdict])
+        return verdict
+
+    async def probe_accept_all(self, domain: str, mx_records: list) -> str | None:
+        """
+        Probes one random local part, concurrent callers for the same domain share the probe.
+        Returns the probe verdict (cached for an undecided probe), or None when the accept-all flag is already cached.
+        """
+        if await self.accept_all.get(domain) is not None:
+            return None
+        undecided = await self.results.get(f"@{domain}")
+        if undecided is not None:
+            return undecided
+        task = self._accept_all_probes.get(domain)
+        if task is None:
+            task = asyncio.ensure_future(self._detect_accept_all(domain, mx_records))
+            self._accept_all_probes[domain] = task
+            task.add_done_callback(lambda _: self._accept_all_probes.pop(domain, None))
+        return await asyncio.shield(task)
+
+    async def check(self, email: str, mx_records: list) -> tuple[str, bool | None]:
+        """
+        Cached verify: returns (verdict, catch_all). Addresses at accept-all domains are not probed.
+        """
+        domain = email.split("@")[1].lower()
+        key = email.lower()
+        verdict = await self.results.get(key)
+        if verdict is not None:
+            return verdict, await self.accept_all.get(domain)
+
+        probe_verdict = await self.probe_accept_all(domain, mx_records)
+        catch_all = await self.accept_all.get(domain)
+        if catch_all:
+            return SMTP_VALID, True
+        if probe_verdict == SMTP_ERROR:
+            # no MX answered the probe, don't wait for the same timeouts again
+            verdict = SMTP_ERROR
+        else:
+            verdict, _ = await self.verify(email, mx_records)
+        await self.results.set(key, verdict, SMTP_TTLS[verdict])
+        return verdict, catch_all
+
+    async def close(self):
+        for pool in self.pools.values():
+            await pool.close()
+        self.pools.clear()
+
+
+smtp_verifier = SMTPVerifier()
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import pickle
+import fcntl
+import hashlib
+from types import MappingProxyType
+from dataclasses import dataclass
+from pathlib import Path as PathLib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.constants import LIST_FILES, BASE_DIR, read_list, file_key, list_key
+from src.keyword_matcher import KeywordMatcher
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+DEFAULT_SCORES = {
+    "base": 50,
+    "mx_exists": 20,
+    "gibberish": -5,
+    "smtp_valid": 20,
+    "smtp_unknown": 10,
+    "whitelisted": 10,
+    "new_domain": -10,
+    "disposable": -30,
+    "blacklisted": -40,
+    "spam_keywords": -20,
+}
+
+CONFIG_SCORES_PATH = BASE_DIR.parent / "config" / "scores.json"
+# bumped by whichever worker changes a list or the scores, watched by all of them
+GENERATION_PATH = BASE_DIR / ".generation"
+# how often (seconds) a request checks whether a new snapshot has to be loaded
+RELOAD_CHECK_INTERVAL = float(os.environ.get("EMAILFILTER_RELOAD_CHECK_INTERVAL", 1))
+# the parsed lists and the spam keyword automaton, pickled by the first worker that builds them
+# (the disposable list has its own memory-mapped index, see src/domain_index.py)
+COMPILED_LISTS_PATH = BASE_DIR / ".index" / "lists.pickle"
+COMPILED_LISTS = ("whitelist", "blacklist", "spam_keywords")
+COMPILED_FORMAT = 1
+
+
+def load_scores(config_path: PathLib = CONFIG_SCORES_PATH) -> dict:
+    if config_path.is_file():
+        try:
+            with config_path.open("r") as f:
+                user_scores = json.load(f)
+            merged = DEFAULT_SCORES.copy()
+            merged.update(user_scores)
+            logger.debug(f"Loaded custom scores from {config_path}")
+            return merged
+        except Exception as e:
+            logger.error(f"Failed to load scores config: {e}")
+    else:
+        logger.debug(f"No custom scores config found at {config_path}, using defaults.")
+    return DEFAULT_SCORES.copy()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Immutable view of the lists and scores. A request keeps the snapshot it started with,
+    reloads swap in a new object instead of mutating this one. version is the generation bumped
+    by publish_change(), lists_version changes with every list change, also ones made outside
+    the API (list updates, hand edits, git pull).
+    """
+    version: int
+    key: tuple
+    lists_version: int
+    whitelist: frozenset
+    blacklist: frozenset
+    spam_keywords: frozenset
+    spam_matcher: KeywordMatcher
+    scores: MappingProxyType
+
+
+def _source_key() -> tuple:
+    return (file_key(GENERATION_PATH), file_key(CONFIG_SCORES_PATH)) + tuple(list_key(name) for name in LIST_FILES)
+
+
+def _lists_version(key: tuple) -> int:
+    """
+    Identifies the list files and journals of a _source_key() (the generation and scores parts don't affect lists).
+    """
+    return int.from_bytes(hashlib.blake2b(repr(key[2:]).encode(), digest_size=7).digest(), "big")
+
+
+def read_generation() -> int:
+    try:
+        return int(GENERATION_PATH.read_text().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation() -> int:
+    """
+    Tells every worker that lists or scores changed.
+    """
+    GENERATION_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(GENERATION_PATH.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        generation = read_generation() + 1
+        tmp = GENERATION_PATH.with_suffix(f".tmp{os.getpid()}")
+        tmp.write_text(str(generation))
+        os.replace(tmp, GENERATION_PATH)
+    return generation
+
+
+def _read_compiled(key: tuple) -> tuple | None:
+    try:
+        with COMPILED_LISTS_PATH.open("rb") as f:
+            compiled_format, compiled_key, lists = pickle.load(f)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+    if compiled_format != COMPILED_FORMAT or compiled_key != key:
+        return None
+    return lists
+
+
+def compile_lists() -> tuple:
+    """
+    (whitelist, blacklist, spam keyword matcher) for the current list files and journals: unpickled
+    from the compiled file when it matches them, else parsed and compiled - under a lock so only one
+    worker does it - and written for the others and for the next start.
+    """
+    key = tuple(list_key(name) for name in COMPILED_LISTS)
+    lists = _read_compiled(key)
+    if lists is not None:
+        return lists
+
+    COMPILED_LISTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(COMPILED_LISTS_PATH.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        lists = _read_compiled(key)
+        if lists is not None:
+            return lists
+        lists = (
+            frozenset(read_list("whitelist")),
+            frozenset(read_list("blacklist")),
+            KeywordMatcher.from_lines(read_list("spam_keywords")),
+        )
+        tmp = COMPILED_LISTS_PATH.with_suffix(f".tmp{os.getpid()}")
+        with tmp.open("wb") as f:
+            pickle.dump((COMPILED_FORMAT, key, lists), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, COMPILED_LISTS_PATH)
+        logger.debug(f"Compiled lists to {COMPILED_LISTS_PATH}")
+    return lists
+
+
+def build_snapshot() -> Snapshot:
+    key = _source_key()
+    whitelist, blacklist, spam_matcher = compile_lists()
+    snapshot = Snapshot(
+        version=read_generation(),
+        key=key,
+        lists_version=_lists_version(key),
+        whitelist=whitelist,
+        blacklist=blacklist,
+        spam_keywords=frozenset(spam_matcher.weights),
+        spam_matcher=spam_matcher,
+        scores=MappingProxyType(load_scores()),
+    )
+    logger.debug(f"Loaded lists and scores snapshot (generation {snapshot.version})")
+    return snapshot
+
+
+_reloader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
+_snapshot = None
+_reloading = None
+_checked_at = 0.0
+
+
+def _swap(future):
+    global _snapshot, _reloading
+    try:
+        _snapshot = future.result()
+    except Exception as e:
+        logger.error(f"Failed to reload lists and scores: {e}")
+    _reloading = None
+
+
+def get_snapshot() -> Snapshot:
+    """
+    Returns the current snapshot. At most every RELOAD_CHECK_INTERVAL it stats the source files,
+    a change starts a rebuild in the background and requests keep the old snapshot until it is ready.
+    """
+    global _snapshot, _reloading, _checked_at
+    if _snapshot is None:
+        _snapshot = build_snapshot()
+        _checked_at = time.monotonic()
+        return _snapshot
+
+    now = time.monotonic()
+    if now - _checked_at >= RELOAD_CHECK_INTERVAL and _reloading is None:
+        _checked_at = now
+        if _source_key() != _snapshot.key:
+            _reloading = _reloader.submit(build_snapshot)
+            _reloading.add_done_callback(_swap)
+    return _snapshot
+
+
+def publish_change() -> Snapshot:
+    """
+    Called after this worker changed a list or the scores: bumps the generation for the other
+    workers and reloads here right away so the change is visible to the next request.
+    """
+    global _snapshot, _checked_at
+    bump_generation()
+    _snapshot = build_snapshot()
+    _checked_at = time.monotonic()
+    return _snapshot
@@ -1,148 +1,109 @@
-import re
-import aiodns
 import asyncio
-import aiosmtplib
-import dns.resolver
 from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor
-import whois
 from src.constants import *
-from async_lru import alru_cache
+from src.dns_resolver import mx_resolver
+from src.domain_age import domain_age_store, whois_creation_date, age_result
+from src.smtp_verifier import smtp_verifier, SMTP_VALID, SMTP_TEMPFAIL, SMTP_ERROR
+from src.domain_index import DomainIndex
+from src.gibberish import GIBBERISH_THRESHOLD, gibberish_probability, gibberish_probabilities
+from src.snapshot import Snapshot, get_snapshot
+from src.metrics import time_stage
 import time
 
-resolver = aiodns.DNSResolver()
 executor = ThreadPoolExecutor()
 
-WHITELISTED_DOMAINS = set(load_list("whitelist"))
-BLACKLISTED_DOMAINS = set(load_list("blacklist"))
-DISPOSABLE_DOMAINS = set(load_list("disposable"))
-SPAM_KEYWORDS = load_list("spam_keywords")
-SPAM_PATTERN = re.compile("|".join(map(re.escape, SPAM_KEYWORDS)), re.IGNORECASE)
+# memory-mapped, shared by all workers and matches subdomains too
+DISPOSABLE_INDEX = DomainIndex("disposable")
 
 from src.logger_config import get_logger
 logger = get_logger(__name__)
 
-_cached_lists = {}
-_MX_CACHE = {}
 
-def get_domain_set(list_name: str) -> set:
+def local_gibberish_probabilities(emails: list) -> list:
     """
-    Returns the cached set for a list. Loads from disk if not cached.
+    Gibberish probability of the local part of each address, scored in one vectorized batch.
     """
-    global _cached_lists
-    if list_name not in _cached_lists:
-        _cached_lists[list_name] = set(load_list(list_name))
-    return _cached_lists[list_name]
+    return gibberish_probabilities([email.split("@")[0] for email in emails])
+
+
+def gibberish_fields(probability: float) -> dict:
+    return {"gibberish": probability >= GIBBERISH_THRESHOLD, "gibberish_probability": round(probability, 3)}
 
 
 def check_gibberish(email: str) -> bool:
-    local_part = email.split("@")[0]
-    logger.debug(f"Checking if '{local_part}' is gibberish")
-    if re.search(r"[bcdfghjklmnpqrstvwxyz]{5,}", local_part, re.IGNORECASE):
-        logger.warning(f"'{local_part}' detected as gibberish")
-        return True
-    return False
+    probability = gibberish_probability(email.split("@")[0])
+    logger.debug(f"'{email}' gibberish probability {probability:.3f}")
+    return probability >= GIBBERISH_THRESHOLD
 
 async def mx_and_smtp_check(email: str):
     domain = email.split('@')[1]
-    mx_records = await cached_mx_lookup(domain)
+    mx_records = await timed_mx_lookup(domain)
     if not mx_records:
-        return False, None, False
+        return False, None, False, None
 
-    try:
-        mx_host = mx_records[0]
-        smtp = aiosmtplib.SMTP(hostname=mx_host, timeout=2)
+    smtp_valid, catch_all = await timed_smtp_check(email, mx_records)
+    return True, mx_records, smtp_valid, catch_all
 
-        await smtp.connect()
-        await smtp.helo()
-        await smtp.mail("noreply@emailfilter.pejcic.rs")
+async def timed_mx_lookup(domain: str):
+    with time_stage("mx"):
+        return await cached_mx_lookup(domain)
 
-        code, _ = await smtp.rcpt(email)
-        await smtp.quit()
+async def timed_smtp_check(email: str, mx_records: list):
+    with time_stage("smtp"):
+        return await smtp_check(email, mx_records)
 
-        smtp_valid = code == 250
-    except Exception:
-        smtp_valid = False
 
-    return True, mx_records, smtp_valid
+async def smtp_check(email: str, mx_records: list) -> tuple[bool | None, bool | None]:
+    """
+    RCPT TO probe through the pooled verifier, returns (smtp_valid, catch_all).
+    smtp_valid is None when no MX gave a definite answer (timeouts, greylisting, open circuits),
+    see smtp_fields(). Verdicts are cached per address and accept-all domains skip per-address probes.
+    """
+    verdict, catch_all = await smtp_verifier.check(email, mx_records)
+    if verdict in (SMTP_TEMPFAIL, SMTP_ERROR):
+        return None, catch_all
+    return verdict == SMTP_VALID, catch_all
 
 
+def smtp_fields(smtp_valid: bool | None, catch_all: bool | None) -> dict:
+    """
+    Result fields for a finished smtp_check(): an unanswered probe is reported as smtp_unknown
+    and scored with its own weight instead of as an invalid address.
+    """
+    return {"smtp_valid": smtp_valid, "smtp_unknown": smtp_valid is None, "catch_all": catch_all}
 
-# cache MX
-async def cached_mx_lookup(domain: str):
-    now = time.time()
 
-    if domain in _MX_CACHE:
-        ts, mx_records = _MX_CACHE[domain]
-        if mx_records and now - ts < 3600:
-            return mx_records
 
-    try:
-        answer = await resolver.query(domain, 'MX')
-        mx_records = [r.host for r in answer]
-        _MX_CACHE[domain] = (now, mx_records)
-        return mx_records
-    except Exception:
-        logger.warning(f"MX lookup failed for {domain}")
-        return None
+# cache MX - TTL-aware, negative caching and coalescing, see src/dns_resolver.py
+async def cached_mx_lookup(domain: str):
+    return await mx_resolver.lookup(domain)
 
 
-# cache domain
-@alru_cache(maxsize=1000)
+# cache domain - persisted in reputation.db, see src/domain_age.py
 async def cached_domain_age(domain):
-    return await is_new_domain(domain)
+    with time_stage("whois"):
+        return await domain_age_store.get(domain)
 
 async def is_new_domain(domain: str, threshold_days=30) -> bool:
     logger.debug(f"Checking if domain is new (threshold {threshold_days} days): {domain}")
-    def inner():
-        try:
-            data = whois.whois(domain)
-            logger.debug(f"[WHOIS Raw Data] {data}")
-
-            created = data.creation_date
-            logger.debug(f"[Parsed Creation Date] {created}")
+    created = await asyncio.get_event_loop().run_in_executor(executor, whois_creation_date, domain)
+    return age_result(created, threshold_days)
 
-            if not created:
-                logger.warning(f"No creation date found for domain {domain}")
-                return True, None  # Age unknown
 
-            if isinstance(created, list):
-                created = created[0]
-                logger.debug(f"[Using First Date from List] {created}")
 
-            if isinstance(created, datetime):
-                created_date = created
-            else:
-                try:
-                    created_date = datetime.strptime(str(created), '%Y-%m-%d')
-                except Exception as e:
-                    logger.error(f"Failed to parse creation date {created} for domain {domain}: {e}")
-                    return True, None
 
-            age_days = (datetime.now(timezone.utc) - created_date).days #timezone-aware
-            logger.debug(f"Domain {domain} age: {age_days} days")
-            return age_days < threshold_days, age_days
+def check_domain_in_lists(domains: list[str], snapshot: Snapshot | None = None):
+    with time_stage("list_check"):
+        return _check_domain_in_lists(domains, snapshot or get_snapshot())
 
-        except Exception as e:
-            logger.error(f"WHOIS lookup exception for domain {domain}: {e}")
-            return True, None
-
-    return await asyncio.get_event_loop().run_in_executor(executor, inner)
-
-
-
-
-def check_domain_in_lists(domains: list[str]):
+def _check_domain_in_lists(domains: list[str], snapshot: Snapshot):
     results = {}
     domain_set = set(domains)
 
-    disposable_set = get_domain_set("disposable")
-    blacklist_set = get_domain_set("blacklist")
-    whitelist_set = get_domain_set("whitelist")
-
-    disposable_domains = domain_set & disposable_set
-    blacklisted_domains = domain_set & blacklist_set
-    whitelisted_domains = domain_set & whitelist_set
+    disposable_domains = {domain for domain in domain_set if DISPOSABLE_INDEX.matches(domain)}
+    blacklisted_domains = domain_set & snapshot.blacklist
+    whitelisted_domains = domain_set & snapshot.whitelist
 
     for domain in domain_set:
         results[domain] = {
@@ -152,6 +113,12 @@ def check_domain_in_lists(domains: list[str]):
         }
     return results
 
-def contains_spam_keywords(email: str) -> bool:
+def match_spam_keywords(email: str, snapshot: Snapshot | None = None) -> list[str]:
+    """
+    Spam keywords found in the local part, weights are looked up with snapshot.spam_matcher.penalty().
+    """
     local = email.split("@")[0].lower()
-    return bool(SPAM_PATTERN.search(local))
+    return (snapshot or get_snapshot()).spam_matcher.find(local)
+
+def contains_spam_keywords(email: str, snapshot: Snapshot | None = None) -> bool:
+    return bool(match_spam_keywords(email, snapshot))
@@ -0,0 +1,76 @@
+"""
+Worker warm-up, run in the background once the worker has started: loads the lists snapshot, the
+disposable index and the gibberish model, imports the SMTP and WHOIS libraries and optionally rebuilds the domain profiles of
+the most checked domains, so the first requests don't pay for any of it. /readyz reports ready when done.
+"""
+import os
+import time
+import asyncio
+import importlib
+
+from src.admission import BULK, lanes, in_lane
+from src.database import reputation_store
+from src.domain_profile import domain_profiles
+from src.snapshot import get_snapshot
+from src.gibberish import get_model
+from src.utils_async import DISPOSABLE_INDEX
+from src.logger_config import get_logger
+logger = get_logger(__name__)
+
+# profiles built for the N most checked domains of the last PREWARM_DAYS days, 0 disables
+PREWARM_DOMAINS = int(os.environ.get("EMAILFILTER_PREWARM_DOMAINS", 0))
+PREWARM_DAYS = int(os.environ.get("EMAILFILTER_PREWARM_DAYS", 7))
+PREWARM_CONCURRENCY = int(os.environ.get("EMAILFILTER_PREWARM_CONCURRENCY", 16))
+# the worker reports ready after this long even if prewarming hasn't finished
+PREWARM_TIMEOUT = float(os.environ.get("EMAILFILTER_PREWARM_TIMEOUT", 30))
+
+LAZY_MODULES = ("aiosmtplib", "whois", "numpy")
+
+state = {"ready": False, "stage": "starting", "seconds": None, "prewarmed_domains": 0}
+
+
+def load_local():
+    """
+    The blocking part: lists snapshot, disposable index, gibberish model and the lazily imported libraries.
+    """
+    get_snapshot()
+    DISPOSABLE_INDEX.refresh()
+    get_model()
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
+
+
+async def prewarm_domains(limit: int):
+    domains = await reputation_store.top_domains(limit, PREWARM_DAYS)
+    slots = asyncio.Semaphore(PREWARM_CONCURRENCY)
+
+    async def prewarm(domain: str):
+        async with slots:
+            try:
+                await domain_profiles.refresh(domain)
+            except Exception as e:
+                logger.debug(f"Prewarming {domain} failed: {e}")
+                return
+            state["prewarmed_domains"] += 1
+
+    await asyncio.gather(*(prewarm(domain) for domain in domains))
+
+
+async def warm_up():
+    started = time.monotonic()
+    try:
+        state["stage"] = "loading lists"
+        await asyncio.to_thread(load_local)
+        if PREWARM_DOMAINS:
+            state["stage"] = "prewarming domains"
+            try:
+                # in the bulk lane, so prewarming doesn't take the interactive lane's slots
+                await asyncio.wait_for(in_lane(lanes[BULK], prewarm_domains(PREWARM_DOMAINS)), PREWARM_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Prewarming stopped after {PREWARM_TIMEOUT}s with {state['prewarmed_domains']} domains")
+    except Exception as e:
+        state["stage"] = f"failed: {e}"
+        logger.error(f"Warm-up failed: {e}")
+        return
+    state.update(ready=True, stage="ready", seconds=round(time.monotonic() - started, 3))
+    logger.info(f"Worker ready after {state['seconds']}s ({state['prewarmed_domains']} domains prewarmed)")